@@ -48,11 +48,11 @@ def create_app(config_class='config.Config'):
              "origins": cors_origins,
              "supports_credentials": True,
              "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
-             "expose_headers": ["Content-Type", "Authorization"],
+             "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor"],
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
              "max_age": 86400  # Cache preflight response for 24 hours
          }},
-         expose_headers=["Content-Type", "Authorization"])
+         expose_headers=["Content-Type", "Authorization", "X-Next-Cursor"])
     
     # Initialize extensions with app
     db.init_app(app)
@@ -64,11 +64,18 @@ def create_app(config_class='config.Config'):
     # Import models to ensure they're registered with SQLAlchemy
     with app.app_context():
         # Import models
-        from models import User, Pet, Device, Location
+        from models import User, Pet, Device, Location, DeviceLatestLocation, DeviceCommand
         
         # Create database tables
         db.create_all()
     
+    # An ingest-only process needs the database but none of the web API
+    from config import get_process_role, serves_api
+    role = get_process_role(app.config.get('PROCESS_ROLE'))
+    if not serves_api(role):
+        app.logger.info(f"PROCESS_ROLE={role}, not registering the web API")
+        return app
+    
     # Register blueprints
     from routes.auth import auth_bp
     from routes.pets import pets_bp
@@ -5,6 +5,26 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Process roles: 'api' serves the web API only, 'ingest' runs the device protocol server only
+# (no web blueprints), 'all' does both in one process
+PROCESS_ROLES = ("api", "ingest", "all")
+
+def get_process_role(role=None):
+    """Normalise a PROCESS_ROLE value (default: the PROCESS_ROLE environment variable), unknown roles become 'all'"""
+    role = (role or os.environ.get("PROCESS_ROLE") or "all").strip().lower()
+    if role not in PROCESS_ROLES:
+        logger.warning(f"Unknown PROCESS_ROLE '{role}', falling back to 'all'")
+        role = "all"
+    return role
+
+def serves_api(role):
+    """Whether a process with this role registers the web API blueprints"""
+    return role in ("api", "all")
+
+def runs_ingest(role):
+    """Whether a process with this role runs the device protocol server"""
+    return role in ("ingest", "all")
+
 # Flask app configuration
 class Config:
     # Secret key for session management
@@ -26,8 +46,49 @@ class Config:
     RATELIMIT_DEFAULT = "100/hour"
     RATELIMIT_STORAGE_URL = "memory://"
     
+    # What this process does: 'api', 'ingest' or 'all' (see PROCESS_ROLES)
+    PROCESS_ROLE = get_process_role()
+    
     # 808 Protocol configuration
     PROTOCOL_808_PORT = os.environ.get("PROTOCOL_808_PORT", 8080)
+    # Ingest engine: 'threaded' (one thread per connection) or 'asyncio' (single event loop)
+    PROTOCOL_SERVER_ENGINE = os.environ.get("PROTOCOL_SERVER_ENGINE", "threaded")
+    # Worker threads the asyncio engine uses for parsing and persistence
+    PROTOCOL_ASYNC_WORKERS = int(os.environ.get("PROTOCOL_ASYNC_WORKERS", 8))
+    # When to ACK a device report: 'commit' (once persisted) or 'enqueue' (once queued)
+    PROTOCOL_ACK_POLICY = os.environ.get("PROTOCOL_ACK_POLICY", "commit")
+    # Idle sessions: close a connection after PROTOCOL_IDLE_HEARTBEATS heartbeat intervals without data
+    PROTOCOL_HEARTBEAT_INTERVAL = float(os.environ.get("PROTOCOL_HEARTBEAT_INTERVAL", 60))
+    PROTOCOL_IDLE_HEARTBEATS = float(os.environ.get("PROTOCOL_IDLE_HEARTBEATS", 3))
+    # Admission control: open connection limit and new connections per second (0 = unlimited)
+    PROTOCOL_MAX_CONNECTIONS = int(os.environ.get("PROTOCOL_MAX_CONNECTIONS", 0))
+    PROTOCOL_ACCEPT_RATE = float(os.environ.get("PROTOCOL_ACCEPT_RATE", 0))
+    PROTOCOL_ACCEPT_BURST = int(os.environ.get("PROTOCOL_ACCEPT_BURST", 0))
+    PROTOCOL_LISTEN_BACKLOG = int(os.environ.get("PROTOCOL_LISTEN_BACKLOG", 1024))
+    # When the location write queue fills up: 'pause' (stop reading from devices) or 'reject' (withhold ACKs)
+    PROTOCOL_QUEUE_FULL_POLICY = os.environ.get("PROTOCOL_QUEUE_FULL_POLICY", "pause")
+    
+    # Downlink commands: dispatcher poll interval, response timeout (seconds, grows per attempt),
+    # sends per command and how long a command waits for its device to come online
+    COMMAND_POLL_INTERVAL = float(os.environ.get("COMMAND_POLL_INTERVAL", 2))
+    COMMAND_ACK_TIMEOUT = float(os.environ.get("COMMAND_ACK_TIMEOUT", 30))
+    COMMAND_MAX_ATTEMPTS = int(os.environ.get("COMMAND_MAX_ATTEMPTS", 3))
+    COMMAND_TTL = int(os.environ.get("COMMAND_TTL", 3600))
+    
+    # Batched location persistence
+    LOCATION_BATCH_SIZE = int(os.environ.get("LOCATION_BATCH_SIZE", 500))
+    LOCATION_FLUSH_INTERVAL_MS = int(os.environ.get("LOCATION_FLUSH_INTERVAL_MS", 200))
+    LOCATION_QUEUE_SIZE = int(os.environ.get("LOCATION_QUEUE_SIZE", 10000))
+    
+    # Device identity cache used to resolve protocol identifiers (seconds)
+    DEVICE_CACHE_TTL = int(os.environ.get("DEVICE_CACHE_TTL", 300))
+    DEVICE_CACHE_NEGATIVE_TTL = int(os.environ.get("DEVICE_CACHE_NEGATIVE_TTL", 30))
+    
+    # Location history paging (hard cap on the page size clients may request)
+    LOCATION_HISTORY_DEFAULT_LIMIT = int(os.environ.get("LOCATION_HISTORY_DEFAULT_LIMIT", 100))
+    LOCATION_HISTORY_MAX_LIMIT = int(os.environ.get("LOCATION_HISTORY_MAX_LIMIT", 1000))
+    # Row cap for streamed location exports (?stream=json|ndjson)
+    LOCATION_EXPORT_MAX_LIMIT = int(os.environ.get("LOCATION_EXPORT_MAX_LIMIT", 100000))
     
     # Application constants
     PET_TYPES = ["Dog", "Cat", "Bird", "Other"]
@@ -16,10 +16,17 @@ logger = logging.getLogger(__name__)
 
 # Import app after loading environment variables
 from app import app
-from services.protocol808 import start_protocol_server, get_server_instance
+from config import get_process_role, runs_ingest, serves_api
+
+# PROCESS_ROLE decides what this process does: 'api' (web API only, e.g. gunicorn workers),
+# 'ingest' (protocol server only) or 'all' (both, the default)
+process_role = get_process_role(app.config.get('PROCESS_ROLE'))
 
 def start_protocol_server_with_retry():
     """Start the 808 protocol server with retry logic in case of initial failure"""
+    # Imported here so API-only processes never load the protocol server
+    from services.protocol808 import start_protocol_server, get_server_instance
+
     max_retries = 3
     retry_delay = 2
     
@@ -43,12 +50,24 @@ def start_protocol_server_with_retry():
                 logger.error("Maximum retries reached. Protocol server not started.")
                 return None
 
-# Start the 808 protocol server when the module is loaded
+# Start the 808 protocol server when the module is loaded, unless this is an API-only process.
 # This ensures it's started regardless of how the app is run (direct, gunicorn, etc.)
-logger.info("Initializing Pet Tracking system and 808 Protocol server")
-protocol_thread = start_protocol_server_with_retry()
+if runs_ingest(process_role):
+    logger.info(f"Initializing Pet Tracking system and 808 Protocol server (PROCESS_ROLE={process_role})")
+    protocol_thread = start_protocol_server_with_retry()
+else:
+    logger.info(f"Initializing Pet Tracking system without the 808 Protocol server (PROCESS_ROLE={process_role})")
+    protocol_thread = None
 
 if __name__ == "__main__":
-    logger.info("Starting Pet Tracking API server in direct mode")
-    # Run the Flask application
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if serves_api(process_role):
+        logger.info("Starting Pet Tracking API server in direct mode")
+        # Run the Flask application
+        app.run(host="0.0.0.0", port=5000, debug=True)
+    elif protocol_thread is not None:
+        logger.info("Running the 808 Protocol server only, press Ctrl+C to stop")
+        try:
+            protocol_thread.join()
+        except KeyboardInterrupt:
+            from services.protocol808 import stop_protocol_server
+            stop_protocol_server()
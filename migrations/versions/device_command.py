@@ -0,0 +1,46 @@
+"""Add device_command table for downlink commands
+
+Revision ID: device_command
+Revises: device_latest_location
+Create Date: 2026-10-16 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'device_command'
+down_revision = 'device_latest_location'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_command',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=False),
+        sa.Column('command', sa.String(length=32), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('body', sa.LargeBinary(), nullable=False),
+        sa.Column('arguments', sa.JSON(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('serial_number', sa.Integer(), nullable=True),
+        sa.Column('result', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['device.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_device_command_device_id'), 'device_command', ['device_id'], unique=False)
+    op.create_index(op.f('ix_device_command_status'), 'device_command', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_device_command_status'), table_name='device_command')
+    op.drop_index(op.f('ix_device_command_device_id'), table_name='device_command')
+    op.drop_table('device_command')
@@ -0,0 +1,58 @@
+"""Add device_latest_location table
+
+Revision ID: device_latest_location
+Revises: location_device_timestamp_index
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'device_latest_location'
+down_revision = 'location_device_timestamp_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_latest_location',
+        sa.Column('device_id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=True),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('altitude', sa.Float(), nullable=True),
+        sa.Column('speed', sa.Float(), nullable=True),
+        sa.Column('heading', sa.Float(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('accuracy', sa.Float(), nullable=True),
+        sa.Column('battery_level', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['device.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('device_id')
+    )
+
+    # Backfill with the newest fix of every device
+    op.execute(
+        """
+        INSERT INTO device_latest_location
+            (device_id, location_id, latitude, longitude, altitude, speed, heading,
+             timestamp, accuracy, battery_level, created_at, updated_at)
+        SELECT device_id, id, latitude, longitude, altitude, speed, heading,
+               timestamp, accuracy, battery_level, created_at, CURRENT_TIMESTAMP
+        FROM (
+            SELECT location.*,
+                   ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY timestamp DESC, id DESC) AS rn
+            FROM location
+            WHERE timestamp IS NOT NULL
+        ) ranked
+        WHERE rn = 1
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('device_latest_location')
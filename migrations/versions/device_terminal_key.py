@@ -0,0 +1,52 @@
+"""Add indexed terminal_key to device for suffix matching
+
+Revision ID: device_terminal_key
+Revises: imei_as_primary_identifier
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'device_terminal_key'
+down_revision = 'imei_as_primary_identifier'
+branch_labels = None
+depends_on = None
+
+# Must match models.TERMINAL_KEY_LENGTH
+TERMINAL_KEY_LENGTH = 12
+
+
+def make_terminal_key(identifier):
+    """Same normalization as Device.make_terminal_key (kept here so the migration doesn't import the app)"""
+    digits = ''.join(c for c in (identifier or '') if c.isdigit())
+    if not digits:
+        return None
+    return digits[-TERMINAL_KEY_LENGTH:].zfill(TERMINAL_KEY_LENGTH)
+
+
+def upgrade():
+    op.add_column('device', sa.Column('terminal_key', sa.String(length=TERMINAL_KEY_LENGTH), nullable=True))
+
+    # Backfill from the existing IMEIs
+    bind = op.get_bind()
+    devices = bind.execute(sa.text("SELECT id, imei FROM device")).fetchall()
+    updates = [
+        {"id": device_pk, "terminal_key": make_terminal_key(imei)}
+        for device_pk, imei in devices
+    ]
+    if updates:
+        bind.execute(
+            sa.text("UPDATE device SET terminal_key = :terminal_key WHERE id = :id"),
+            updates
+        )
+
+    # Create the index after the backfill so it is built once
+    op.create_index(op.f('ix_device_terminal_key'), 'device', ['terminal_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_device_terminal_key'), table_name='device')
+    op.drop_column('device', 'terminal_key')
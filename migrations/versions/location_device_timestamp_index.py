@@ -0,0 +1,35 @@
+"""Add composite (device_id, timestamp DESC, id DESC) index on location
+
+Revision ID: location_device_timestamp_index
+Revises: device_terminal_key
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'location_device_timestamp_index'
+down_revision = 'device_terminal_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # Build the index without blocking location inserts from the protocol server
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_location_device_id_timestamp',
+                'location',
+                ['device_id', sa.text('timestamp DESC'), sa.text('id DESC')],
+                postgresql_concurrently=True
+            )
+    else:
+        op.create_index('ix_location_device_id_timestamp', 'location', ['device_id', sa.text('timestamp DESC'), sa.text('id DESC')])
+
+
+def downgrade():
+    op.drop_index('ix_location_device_id_timestamp', table_name='location')
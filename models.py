@@ -2,8 +2,13 @@ from app import db
 from flask_login import UserMixin
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import or_
+from sqlalchemy.orm import validates
 import uuid
 
+# Number of trailing IMEI digits matched against JT808 terminal phone numbers (6 BCD bytes)
+TERMINAL_KEY_LENGTH = 12
+
 class User(UserMixin, db.Model):
     """User model for authentication and profile information"""
     __table_args__ = {'extend_existing': True}
@@ -87,6 +92,8 @@ class Device(db.Model):
     # Keeping device_id as internal reference but it's no longer the primary identifier
     # Making it nullable for backward compatibility during migration
     device_id = db.Column(db.String(64), unique=True, nullable=True, index=True)
+    # Normalized IMEI suffix, lets a reported JT808 phone number be resolved with an index seek
+    terminal_key = db.Column(db.String(TERMINAL_KEY_LENGTH), nullable=True, index=True)
     name = db.Column(db.String(64))
     device_type = db.Column(db.String(32))
     serial_number = db.Column(db.String(64), unique=True)
@@ -103,6 +110,8 @@ class Device(db.Model):
     
     # Relationships
     locations = db.relationship('Location', backref='device', lazy='dynamic', cascade='all, delete-orphan')
+    latest_location = db.relationship('DeviceLatestLocation', uselist=False, cascade='all, delete-orphan')
+    commands = db.relationship('DeviceCommand', lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Device {self.imei}>'
@@ -120,6 +129,43 @@ class Device(db.Model):
         # Remove any non-numeric characters
         return ''.join(c for c in imei if c.isdigit())
     
+    @staticmethod
+    def make_terminal_key(identifier):
+        """
+        Normalize an IMEI or terminal phone number to its last TERMINAL_KEY_LENGTH digits
+        
+        JT808 terminals report a 12 digit BCD phone number that is usually a suffix of
+        their IMEI, zero-padded on the left when shorter, so both sides are padded the same way.
+        """
+        digits = Device.format_imei(identifier)
+        if not digits:
+            return None
+        return digits[-TERMINAL_KEY_LENGTH:].zfill(TERMINAL_KEY_LENGTH)
+    
+    @classmethod
+    def find_by_identifier(cls, identifier):
+        """
+        Find a device by a reported identifier using indexed lookups only
+        
+        Tries an exact device_id/IMEI match first, then the terminal_key suffix
+        match used for JT808 phone numbers.
+        """
+        if not identifier:
+            return None
+        device = cls.query.filter(or_(cls.device_id == identifier, cls.imei == identifier)).first()
+        if device:
+            return device
+        terminal_key = cls.make_terminal_key(identifier)
+        if not terminal_key:
+            return None
+        return cls.query.filter_by(terminal_key=terminal_key).order_by(cls.id).first()
+    
+    @validates('imei')
+    def _update_terminal_key(self, key, imei):
+        """Keep terminal_key in sync whenever the IMEI changes"""
+        self.terminal_key = Device.make_terminal_key(imei)
+        return imei
+    
     def to_dict(self):
         """Convert object to dictionary"""
         result = {
@@ -151,7 +197,6 @@ class Device(db.Model):
 
 class Location(db.Model):
     """Location model for device location history"""
-    __table_args__ = {'extend_existing': True}
     id = db.Column(db.Integer, primary_key=True)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
@@ -173,6 +218,13 @@ class Location(db.Model):
     # Foreign Keys
     device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
     
+    __table_args__ = (
+        # Serves the history and latest-fix queries: device_id = X [AND (timestamp, id) < cursor]
+        # ORDER BY timestamp DESC, id DESC, so ties on timestamp are resolved in the index too
+        db.Index('ix_location_device_id_timestamp', device_id, timestamp.desc(), id.desc()),
+        {'extend_existing': True}
+    )
+    
     def __repr__(self):
         return f'<Location ({self.latitude}, {self.longitude}) @ {self.timestamp}>'
     
@@ -197,3 +249,78 @@ class Location(db.Model):
         # Instead, it's published to MQTT topics for real-time use by clients
             
         return data
+
+class DeviceLatestLocation(db.Model):
+    """Most recent fix of each device, maintained on ingest so "where is it now" is a primary-key read"""
+    __table_args__ = {'extend_existing': True}
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id', ondelete='CASCADE'), primary_key=True)
+    location_id = db.Column(db.Integer, nullable=True)  # Location row this fix was copied from
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    altitude = db.Column(db.Float)
+    speed = db.Column(db.Float)
+    heading = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    accuracy = db.Column(db.Float)
+    battery_level = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DeviceLatestLocation {self.device_id} ({self.latitude}, {self.longitude}) @ {self.timestamp}>'
+    
+    def to_dict(self):
+        """Convert object to dictionary (same shape as Location.to_dict)"""
+        return {
+            'id': self.location_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'altitude': self.altitude,
+            'speed': self.speed,
+            'heading': self.heading,
+            'timestamp': self.timestamp.isoformat(),
+            'accuracy': self.accuracy,
+            'battery_level': self.battery_level,
+            'device_id': self.device_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class DeviceCommand(db.Model):
+    """Downlink command queued for a JT808 terminal, delivered by the protocol server (services/downlink.py)"""
+    __table_args__ = {'extend_existing': True}
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id', ondelete='CASCADE'), nullable=False, index=True)
+    command = db.Column(db.String(32), nullable=False)  # e.g. 'set_parameters', 'location_query'
+    message_id = db.Column(db.Integer, nullable=False)  # JT808 message ID sent to the terminal
+    body = db.Column(db.LargeBinary, nullable=False, default=b'')  # Encoded message body
+    arguments = db.Column(db.JSON, nullable=True)  # Request as submitted, for display
+    # pending -> sent -> acknowledged / failed / timeout, or expired if never delivered
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    serial_number = db.Column(db.Integer, nullable=True)  # Serial of the last frame sent
+    result = db.Column(db.Integer, nullable=True)  # Result code of the terminal's general response
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<DeviceCommand {self.id} {self.command} for device {self.device_id}: {self.status}>'
+    
+    def to_dict(self):
+        """Convert object to dictionary"""
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'command': self.command,
+            'message_id': self.message_id,
+            'arguments': self.arguments,
+            'status': self.status,
+            'attempts': self.attempts,
+            'serial_number': self.serial_number,
+            'result': self.result,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
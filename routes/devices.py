@@ -1,10 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app import db, limiter
-from models import Device, Pet
+from models import Device, DeviceCommand, Pet
 from flask_jwt_extended import get_jwt_identity
 from utils.auth_helpers import jwt_required_except_options
 from utils.error_handlers import handle_error, handle_database_error
+from services.device_cache import get_device_cache, invalidate_device
+from services.downlink import CommandError, create_command
 import logging
 from datetime import datetime
 from sqlalchemy.exc import SQLAlchemyError
@@ -152,6 +154,7 @@ def create_device():
     try:
         db.session.add(device)
         db.session.commit()
+        invalidate_device(device)
         logger.info(f"Created device {device.id} for user {user_id}")
         return jsonify(device.to_dict()), 201
     except SQLAlchemyError as db_error:
@@ -247,6 +250,7 @@ def update_device(device_id):
     # Save to database
     try:
         db.session.commit()
+        invalidate_device(device)
         logger.info(f"Updated device {device_id}")
         return jsonify(device.to_dict())
     except SQLAlchemyError as db_error:
@@ -288,8 +292,10 @@ def delete_device(device_id):
             logger.info(f"Deleted {location_count} location records for device {device_id}")
         
         # Now delete the device
+        identifiers = (device.device_id, device.imei)
         db.session.delete(device)
         db.session.commit()
+        get_device_cache().invalidate(*identifiers, device_pk=device_id)
         logger.info(f"Successfully deleted device {device_id}")
         return jsonify({"message": "Device deleted successfully"})
     except SQLAlchemyError as db_error:
@@ -327,6 +333,7 @@ def device_ping(device_identifier):
     # Save to database
     try:
         db.session.commit()
+        invalidate_device(device)
         return jsonify({"message": "Ping recorded successfully"})
     except SQLAlchemyError as db_error:
         db.session.rollback()
@@ -408,3 +415,101 @@ def unassign_from_pet(device_id):
         db.session.rollback()
         return handle_error(e, status_code=500,
                           user_message="An error occurred while unassigning the device.")
+
+@devices_bp.route('/<int:device_id>/commands', methods=['POST', 'OPTIONS'])
+@jwt_required_except_options
+@limiter.limit("30/minute")
+def send_device_command(device_id):
+    """
+    Queue a downlink command for a JT808 device
+    
+    The protocol server sends it as soon as the device is connected and tracks the
+    terminal's response; poll the returned command for its status. Body:
+    {"command": "set_parameters", "parameters": {"report_interval": 10}} or
+    {"command": "location_query"}, with an optional "ttl" in seconds.
+    """
+    user_id = int(get_jwt_identity())
+    
+    device = Device.query.filter_by(id=device_id, user_id=user_id).first()
+    if not device:
+        return jsonify({"error": "Device not found"}), 404
+    
+    data = request.get_json()
+    if not data or not data.get('command'):
+        return jsonify({"error": "Command is required"}), 400
+    
+    ttl = data.get('ttl')
+    try:
+        ttl = int(ttl) if ttl is not None else int(current_app.config.get('COMMAND_TTL', 3600))
+    except (TypeError, ValueError):
+        ttl = 0
+    if ttl <= 0:
+        return jsonify({"error": "Invalid ttl, expected a positive number of seconds"}), 400
+    
+    arguments = {'parameters': data['parameters']} if 'parameters' in data else None
+    try:
+        command = create_command(device.id, data['command'], arguments, ttl=ttl)
+    except CommandError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        db.session.add(command)
+        db.session.commit()
+        logger.info(f"Queued command {command.id} ({command.command}) for device {device_id}")
+        return jsonify(command.to_dict()), 202
+    except SQLAlchemyError as db_error:
+        db.session.rollback()
+        return handle_database_error(db_error, operation=f"queueing command for device {device_id}",
+                                    user_message="Unable to queue the command. Please try again later.")
+    except Exception as e:
+        db.session.rollback()
+        return handle_error(e, status_code=500,
+                           user_message="An error occurred while queueing the command.")
+
+@devices_bp.route('/<int:device_id>/commands', methods=['GET', 'OPTIONS'])
+@jwt_required_except_options
+def get_device_commands(device_id):
+    """List the most recent downlink commands of a device, optionally filtered by status"""
+    try:
+        user_id = int(get_jwt_identity())
+        
+        device = Device.query.filter_by(id=device_id, user_id=user_id).first()
+        if not device:
+            return jsonify({"error": "Device not found"}), 404
+        
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        query = DeviceCommand.query.filter_by(device_id=device.id)
+        status = request.args.get('status')
+        if status:
+            query = query.filter_by(status=status)
+        commands = query.order_by(DeviceCommand.id.desc()).limit(limit).all()
+        return jsonify([command.to_dict() for command in commands])
+    except SQLAlchemyError as db_error:
+        return handle_database_error(db_error, operation=f"retrieving commands for device {device_id}",
+                                    user_message="Unable to retrieve device commands. Please try again later.")
+    except Exception as e:
+        return handle_error(e, status_code=500,
+                           user_message="An error occurred while retrieving device commands.")
+
+@devices_bp.route('/<int:device_id>/commands/<int:command_id>', methods=['GET', 'OPTIONS'])
+@jwt_required_except_options
+def get_device_command(device_id, command_id):
+    """Get the status of a downlink command"""
+    try:
+        user_id = int(get_jwt_identity())
+        
+        device = Device.query.filter_by(id=device_id, user_id=user_id).first()
+        if not device:
+            return jsonify({"error": "Device not found"}), 404
+        
+        command = DeviceCommand.query.filter_by(id=command_id, device_id=device.id).first()
+        if not command:
+            return jsonify({"error": "Command not found"}), 404
+        
+        return jsonify(command.to_dict())
+    except SQLAlchemyError as db_error:
+        return handle_database_error(db_error, operation=f"retrieving command {command_id}",
+                                    user_message="Unable to retrieve the command. Please try again later.")
+    except Exception as e:
+        return handle_error(e, status_code=500,
+                           user_message="An error occurred while retrieving the command.")
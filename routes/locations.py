@@ -1,24 +1,200 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db, limiter
-from models import Location, Device, Pet
+from models import Location, Device, Pet, DeviceLatestLocation
 from flask_jwt_extended import get_jwt_identity
 from utils.auth_helpers import jwt_required_except_options
 from utils.error_handlers import handle_error, handle_database_error
+import base64
+import binascii
+import json
 import logging
 import uuid
 from datetime import datetime, timedelta
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, func, or_
 from sqlalchemy.exc import SQLAlchemyError
+from services.location_service import LocationService
+from services.location_writer import latest_location_row, upsert_latest_locations
 
 locations_bp = Blueprint('locations', __name__)
 logger = logging.getLogger(__name__)
 
+# Streaming export formats and the number of rows fetched per server-side cursor round trip
+STREAM_FORMATS = ('json', 'ndjson')
+STREAM_CHUNK_SIZE = 1000
+
+def record_latest_location(location):
+    """Refresh the device's latest fix from a Location added to the current session"""
+    db.session.flush()  # Assigns location.id
+    upsert_latest_locations([latest_location_row({
+        'device_id': location.device_id,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'altitude': location.altitude,
+        'speed': location.speed,
+        'heading': location.heading,
+        'timestamp': location.timestamp,
+        'accuracy': location.accuracy,
+        'battery_level': location.battery_level,
+        'created_at': location.created_at,
+    }, location.id)])
+
+def encode_cursor(location):
+    """Encode the (timestamp, id) keyset position of a location as an opaque cursor"""
+    raw = f"{location.timestamp.isoformat()}|{location.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, location_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(location_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError("Invalid 'cursor' parameter")
+
+def build_location_history_query(device_id, default_limit, max_limit):
+    """
+    Build the location history query for a device from the request parameters
+    
+    Query parameters:
+        limit: Number of rows, capped at max_limit
+        cursor: next_cursor from the previous page
+        before: ISO timestamp to start from (exclusive)
+        since / hours: Oldest fix to include. Defaults to the last 24 hours, except
+                       when paging with cursor/before where the whole history is reachable.
+    
+    Rows are ordered newest first and selected by keyset on (timestamp, id), which
+    matches the (device_id, timestamp DESC, id DESC) columns of
+    ix_location_device_id_timestamp, so every page is an index range scan with no
+    sort however deep the client pages.
+    
+    Returns:
+        (query, limit) - the ordered query without a LIMIT applied
+    
+    Raises:
+        ValueError: For malformed parameters
+    """
+    limit = request.args.get('limit', default=default_limit, type=int)
+    limit = max(1, min(limit, max_limit))
+    hours = request.args.get('hours', type=int)
+    since = request.args.get('since', type=str)
+    cursor = request.args.get('cursor', type=str)
+    before = request.args.get('before', type=str)
+    
+    # Create base query
+    query = Location.query.filter_by(device_id=device_id)
+    
+    # Apply time filter
+    if since:
+        try:
+            since_time = datetime.fromisoformat(since)
+        except ValueError:
+            raise ValueError("Invalid 'since' parameter format. Use ISO format.")
+        query = query.filter(Location.timestamp >= since_time)
+    elif hours is not None or not (cursor or before):
+        # Default to last N hours
+        time_threshold = datetime.utcnow() - timedelta(hours=hours if hours is not None else 24)
+        query = query.filter(Location.timestamp >= time_threshold)
+    
+    # Continue after the last row of the previous page
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        query = query.filter(
+            Location.timestamp <= cursor_time,
+            or_(Location.timestamp < cursor_time, Location.id < cursor_id)
+        )
+    elif before:
+        try:
+            before_time = datetime.fromisoformat(before)
+        except ValueError:
+            raise ValueError("Invalid 'before' parameter format. Use ISO format.")
+        query = query.filter(Location.timestamp < before_time)
+    
+    # Order by timestamp (id breaks ties)
+    return query.order_by(desc(Location.timestamp), desc(Location.id)), limit
+
+def get_location_history_page(device_id):
+    """
+    Fetch one page of a device's location history (see build_location_history_query)
+    
+    Returns:
+        (locations, next_cursor) - next_cursor is None on the last page
+    
+    Raises:
+        ValueError: For malformed parameters
+    """
+    query, limit = build_location_history_query(
+        device_id,
+        current_app.config.get('LOCATION_HISTORY_DEFAULT_LIMIT', 100),
+        current_app.config.get('LOCATION_HISTORY_MAX_LIMIT', 1000)
+    )
+    
+    # Fetch one extra row to know if there is another page
+    locations = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(locations) > limit:
+        locations = locations[:limit]
+        next_cursor = encode_cursor(locations[-1])
+    
+    return locations, next_cursor
+
+def stream_location_history(device_id, stream_format):
+    """
+    Stream a device's location history as a JSON array or NDJSON
+    
+    Rows are read through a server-side cursor in chunks (yield_per) and written out
+    as they arrive, so memory use does not grow with the size of the export.
+    
+    Headers go out before the first row, so whether the export is cut off at the
+    row limit is checked up front: if more rows match, X-Next-Cursor holds the
+    cursor of the last streamed row and the export continues with cursor=<it>.
+    """
+    query, limit = build_location_history_query(
+        device_id,
+        current_app.config.get('LOCATION_EXPORT_MAX_LIMIT', 100000),
+        current_app.config.get('LOCATION_EXPORT_MAX_LIMIT', 100000)
+    )
+    # The last row of the export and the one after it, if any
+    boundary = query.with_entities(Location.timestamp, Location.id).offset(limit - 1).limit(2).all()
+    next_cursor = encode_cursor(boundary[0]) if len(boundary) > 1 else None
+    rows = query.limit(limit).yield_per(STREAM_CHUNK_SIZE)
+    
+    if stream_format == 'ndjson':
+        def generate():
+            for location in rows:
+                yield json.dumps(location.to_dict()) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            yield '['
+            separator = ''
+            for location in rows:
+                yield separator + json.dumps(location.to_dict())
+                separator = ','
+            yield ']'
+        mimetype = 'application/json'
+    
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
 @locations_bp.route('/device/<int:device_id>', methods=['GET', 'OPTIONS'])
 @jwt_required_except_options
 @limiter.limit("120/minute")
 def get_device_locations(device_id):
-    """Get location history for a specific device"""
+    """
+    Get location history for a specific device
+    
+    Returns a plain list for backward compatibility, with the next page cursor in the
+    X-Next-Cursor header. When paging (cursor or before given) the response is an
+    object with "locations" and "next_cursor".
+    
+    With stream=json or stream=ndjson the whole matching history (up to
+    LOCATION_EXPORT_MAX_LIMIT rows, X-Next-Cursor is set if there are more) is
+    streamed instead, for exports.
+    """
     try:
         user_id = int(get_jwt_identity())
         
@@ -27,30 +203,27 @@ def get_device_locations(device_id):
         if not device:
             return jsonify({"error": "Device not found"}), 404
         
-        # Get query parameters for filtering
-        limit = request.args.get('limit', default=100, type=int)
-        hours = request.args.get('hours', default=24, type=int)
-        since = request.args.get('since', type=str)
+        stream_format = request.args.get('stream', type=str)
+        if stream_format and stream_format not in STREAM_FORMATS:
+            return jsonify({"error": f"Invalid 'stream' parameter. Use one of: {', '.join(STREAM_FORMATS)}"}), 400
         
-        # Create base query
-        query = Location.query.filter_by(device_id=device.id)
+        try:
+            if stream_format:
+                return stream_location_history(device.id, stream_format)
+            locations, next_cursor = get_location_history_page(device.id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Apply time filter
-        if since:
-            try:
-                since_time = datetime.fromisoformat(since)
-                query = query.filter(Location.timestamp >= since_time)
-            except ValueError:
-                return jsonify({"error": "Invalid 'since' parameter format. Use ISO format."}), 400
+        if 'cursor' in request.args or 'before' in request.args:
+            response = jsonify({
+                "locations": [location.to_dict() for location in locations],
+                "next_cursor": next_cursor
+            })
         else:
-            # Default to last N hours
-            time_threshold = datetime.utcnow() - timedelta(hours=hours)
-            query = query.filter(Location.timestamp >= time_threshold)
-        
-        # Order by timestamp and limit results
-        locations = query.order_by(desc(Location.timestamp)).limit(limit).all()
-        
-        return jsonify([location.to_dict() for location in locations])
+            response = jsonify([location.to_dict() for location in locations])
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
     except SQLAlchemyError as db_error:
         # Handle database-specific errors
@@ -66,7 +239,7 @@ def get_device_locations(device_id):
 @jwt_required_except_options
 @limiter.limit("120/minute")
 def get_pet_locations(pet_id):
-    """Get location history for a specific pet"""
+    """Get location history for a specific pet (paged like get_device_locations)"""
     user_id = int(get_jwt_identity())
     
     # Find the pet
@@ -79,33 +252,16 @@ def get_pet_locations(pet_id):
     if not device:
         return jsonify({"error": "No device assigned to this pet"}), 404
     
-    # Get query parameters for filtering
-    limit = request.args.get('limit', default=100, type=int)
-    hours = request.args.get('hours', default=24, type=int)
-    since = request.args.get('since', type=str)
-    
-    # Create base query
-    query = Location.query.filter_by(device_id=device.id)
-    
-    # Apply time filter
-    if since:
-        try:
-            since_time = datetime.fromisoformat(since)
-            query = query.filter(Location.timestamp >= since_time)
-        except ValueError:
-            return jsonify({"error": "Invalid 'since' parameter format. Use ISO format."}), 400
-    else:
-        # Default to last N hours
-        time_threshold = datetime.utcnow() - timedelta(hours=hours)
-        query = query.filter(Location.timestamp >= time_threshold)
-    
-    # Order by timestamp and limit results
-    locations = query.order_by(desc(Location.timestamp)).limit(limit).all()
+    try:
+        locations, next_cursor = get_location_history_page(device.id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     return jsonify({
         "pet": pet.to_dict(),
         "device": device.to_dict(),
-        "locations": [location.to_dict() for location in locations]
+        "locations": [location.to_dict() for location in locations],
+        "next_cursor": next_cursor
     })
 
 @locations_bp.route('/device/<int:device_id>/latest/', methods=['GET', 'OPTIONS'])
@@ -120,7 +276,7 @@ def get_device_latest_location(device_id):
         return jsonify({"error": "Device not found"}), 404
     
     # Get the latest location
-    location = Location.query.filter_by(device_id=device.id).order_by(desc(Location.timestamp)).first()
+    location = LocationService.get_latest_location(device.id)
     
     if not location:
         return jsonify({
@@ -152,7 +308,7 @@ def get_pet_latest_location(pet_id):
         return jsonify({"error": "No device assigned to this pet"}), 404
     
     # Get the latest location
-    location = Location.query.filter_by(device_id=device.id).order_by(desc(Location.timestamp)).first()
+    location = LocationService.get_latest_location(device.id)
     
     if not location:
         return jsonify({"error": "No location data available for this pet"}), 404
@@ -217,6 +373,7 @@ def record_location():
     # Save to database
     try:
         db.session.add(location)
+        record_latest_location(location)
         db.session.commit()
         return jsonify({"message": "Location recorded successfully", "location_id": location.id})
     except SQLAlchemyError as db_error:
@@ -237,20 +394,52 @@ def get_all_pets_latest_locations():
     try:
         user_id = int(get_jwt_identity())
         
-        # Get all pets belonging to the user
-        pets = Pet.query.filter_by(user_id=user_id).all()
+        # One device per pet (the first one registered), ranked in the database
+        ranked_devices = (db.session.query(
+                Device.id.label('device_id'),
+                Device.pet_id.label('pet_id'),
+                func.row_number().over(partition_by=Device.pet_id, order_by=Device.id).label('rank')
+            )
+            .filter(Device.pet_id.isnot(None))
+            .subquery())
+        
+        # Pets, their device and its latest fix in a single round trip. Device.to_dict()
+        # resolves device.pet from the identity map, so it doesn't query either.
+        rows = (db.session.query(Pet, Device, DeviceLatestLocation)
+                .outerjoin(ranked_devices, and_(ranked_devices.c.pet_id == Pet.id, ranked_devices.c.rank == 1))
+                .outerjoin(Device, Device.id == ranked_devices.c.device_id)
+                .outerjoin(DeviceLatestLocation, DeviceLatestLocation.device_id == Device.id)
+                .filter(Pet.user_id == user_id)
+                .order_by(Pet.id)
+                .all())
+        
+        # Devices without a maintained latest fix fall back to the history table, in one query
+        missing = [device.id for _, device, latest in rows if device and not latest]
+        fallback = {}
+        if missing:
+            ranked_locations = (db.session.query(
+                    Location.id.label('id'),
+                    func.row_number().over(
+                        partition_by=Location.device_id,
+                        order_by=(desc(Location.timestamp), desc(Location.id))
+                    ).label('rank')
+                )
+                .filter(Location.device_id.in_(missing))
+                .subquery())
+            fallback = {
+                location.device_id: location
+                for location in (Location.query
+                                 .join(ranked_locations, ranked_locations.c.id == Location.id)
+                                 .filter(ranked_locations.c.rank == 1))
+            }
         
         result = []
-        for pet in pets:
+        for pet, device, latest in rows:
             pet_data = pet.to_dict()
-            
-            # Find the pet's device
-            device = Device.query.filter_by(pet_id=pet.id).first()
             if device:
                 pet_data['device'] = device.to_dict()
                 
-                # Get the latest location
-                location = Location.query.filter_by(device_id=device.id).order_by(desc(Location.timestamp)).first()
+                location = latest or fallback.get(device.id)
                 if location:
                     pet_data['location'] = location.to_dict()
             
@@ -354,12 +543,14 @@ def simulate_device_location():
     if missing_fields:
         return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
     
-    # Find the device by device_id (allowing partial match to make testing easier)
-    device_query = Device.query.filter(Device.device_id.like(f"%{data['device_id']}%"))
-    device = device_query.first()
+    # Find the device by device_id, IMEI or IMEI suffix
+    device = Device.find_by_identifier(data['device_id'])
+    if not device:
+        # Allow a device_id prefix to make testing easier (prefix matches can use the index)
+        device = Device.query.filter(Device.device_id.startswith(data['device_id'], autoescape=True)).first()
     
     if not device:
-        return jsonify({"error": f"Device with ID containing '{data['device_id']}' not found"}), 404
+        return jsonify({"error": f"Device with ID '{data['device_id']}' not found"}), 404
     
     # Create a new location with the current timestamp
     location = Location(
@@ -384,6 +575,7 @@ def simulate_device_location():
     # Save to database
     try:
         db.session.add(location)
+        record_latest_location(location)
         db.session.commit()
         
         logger.info(f"Simulated location recorded for device {device.device_id}: " 
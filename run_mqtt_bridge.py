@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Run the MQTT to Database Bridge
+
+This script subscribes to the device location topics published by the MQTT
+adapter (devices/+/location and devices/+/location/bin) and stores the fixes
+in the Location table in batches.
+
+Run several bridges with the same --shared-group to spread the messages over
+them (MQTT shared subscriptions, supported by Mosquitto 2.x and EMQX).
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='MQTT to Database Bridge')
+
+    parser.add_argument(
+        '--mqtt-host',
+        default=os.environ.get('MQTT_HOST', '127.0.0.1'),
+        help='MQTT broker host (default: 127.0.0.1)'
+    )
+
+    parser.add_argument(
+        '--mqtt-port',
+        type=int,
+        default=int(os.environ.get('MQTT_PORT', 1883)),
+        help='MQTT broker port (default: 1883)'
+    )
+
+    parser.add_argument(
+        '--mqtt-username',
+        default=os.environ.get('MQTT_USERNAME', None),
+        help='MQTT broker username'
+    )
+
+    parser.add_argument(
+        '--mqtt-password',
+        default=os.environ.get('MQTT_PASSWORD', None),
+        help='MQTT broker password'
+    )
+
+    parser.add_argument(
+        '--client-id',
+        default=os.environ.get('MQTT_BRIDGE_CLIENT_ID', None),
+        help='MQTT client ID (default: auto-generated)'
+    )
+
+    parser.add_argument(
+        '--shared-group',
+        default=os.environ.get('MQTT_BRIDGE_SHARED_GROUP', None),
+        help='Shared subscription group, for running several bridges side by side (default: none)'
+    )
+
+    parser.add_argument(
+        '--max-inflight',
+        type=int,
+        default=int(os.environ.get('MQTT_BRIDGE_MAX_INFLIGHT', 20)),
+        help="The broker's in-flight message limit (Mosquitto max_inflight_messages, default: 20)"
+    )
+
+    parser.add_argument(
+        '--stats-interval',
+        type=int,
+        default=60,
+        help='Seconds between statistics log lines, 0 to disable (default: 60)'
+    )
+
+    parser.add_argument(
+        '--debug',
+        action='store_true',
+        help='Enable debug logging'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point for the bridge"""
+    args = parse_arguments()
+
+    # Set debug logging if requested
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+        logging.info("Debug logging enabled")
+
+    # The bridge only needs the database, not the web API
+    os.environ.setdefault('PROCESS_ROLE', 'ingest')
+
+    from app import app
+    from config import Config
+    from services.location_writer import LocationWriter
+    from services.mqtt_bridge import MQTTBridge
+
+    location_writer = LocationWriter(
+        app=app,
+        batch_size=Config.LOCATION_BATCH_SIZE,
+        flush_interval_ms=Config.LOCATION_FLUSH_INTERVAL_MS,
+        max_queue_size=Config.LOCATION_QUEUE_SIZE,
+        # Block the MQTT network thread while the queue is full, the backlog stays with the broker
+        enqueue_timeout=None
+    )
+    bridge = MQTTBridge(
+        location_writer,
+        broker_host=args.mqtt_host,
+        broker_port=args.mqtt_port,
+        client_id=args.client_id,
+        shared_group=args.shared_group,
+        ack_policy=Config.PROTOCOL_ACK_POLICY,
+        app=app,
+        username=args.mqtt_username,
+        password=args.mqtt_password,
+        max_inflight=args.max_inflight
+    )
+
+    # Handle graceful shutdown
+    def signal_handler(sig, frame):
+        logger.info("Shutting down bridge...")
+        bridge.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    try:
+        bridge.start()
+        logger.info(f"MQTT bridge started, topics: {', '.join(bridge.topics)}")
+
+        while True:
+            time.sleep(args.stats_interval or 1)
+            if args.stats_interval:
+                logger.info(f"Bridge stats: {bridge.get_stats()}")
+    except Exception as e:
+        logger.error(f"Error in bridge: {e}", exc_info=True)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
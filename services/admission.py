@@ -0,0 +1,103 @@
+"""
+Admission control for device connections.
+
+After a cell outage every collar in the area reconnects at once. Accepting all
+of them immediately means a thread (threaded engine) or transport (asyncio
+engine) per connection plus a burst of registration/authentication writes, all
+at the same moment. AdmissionControl caps the number of open connections and
+the rate at which new ones are accepted; connections over either limit are
+closed straight away, and the devices retry later with their usual reconnect
+backoff.
+
+This module has no Flask/database dependencies.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Log at most one refused-connection warning per this many seconds
+REFUSAL_LOG_INTERVAL = 10
+
+
+class TokenBucket:
+    """Token bucket allowing rate events per second on average and up to burst at once"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'clock')
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate, 1.0)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+
+    def try_acquire(self):
+        """Take one token if available"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class AdmissionControl:
+    """
+    Decides whether a newly accepted connection may stay open
+
+    Args:
+        max_connections: Open connection limit (0 for no limit)
+        accept_rate: New connections admitted per second (0 for no limit)
+        accept_burst: Connections that may be admitted at once before the rate applies
+                      (defaults to accept_rate)
+
+    Not thread-safe: call admit() from the thread (or event loop) that accepts connections.
+    """
+
+    def __init__(self, max_connections=0, accept_rate=0, accept_burst=None, clock=time.monotonic):
+        self.max_connections = max_connections
+        self.bucket = TokenBucket(accept_rate, accept_burst, clock) if accept_rate > 0 else None
+        self.clock = clock
+        self.metrics = {
+            'admitted': 0,
+            'refused_max_connections': 0,
+            'refused_accept_rate': 0,
+        }
+        self._last_refusal_log = None
+
+    def admit(self, open_connections, addr=None):
+        """
+        Check a new connection against the limits
+
+        Args:
+            open_connections: Connections currently open, not counting the new one
+
+        Returns:
+            True if the connection may stay open, False if it should be closed
+        """
+        if self.max_connections and open_connections >= self.max_connections:
+            self._refuse('refused_max_connections', addr, f"{open_connections} connections open")
+            return False
+        if self.bucket is not None and not self.bucket.try_acquire():
+            self._refuse('refused_accept_rate', addr, "accept rate exceeded")
+            return False
+        self.metrics['admitted'] += 1
+        return True
+
+    def get_stats(self):
+        """Return admission counters for monitoring"""
+        stats = dict(self.metrics)
+        stats['max_connections'] = self.max_connections
+        stats['accept_rate'] = self.bucket.rate if self.bucket is not None else 0
+        return stats
+
+    def _refuse(self, counter, addr, reason):
+        self.metrics[counter] += 1
+        now = self.clock()
+        if self._last_refusal_log is None or now - self._last_refusal_log >= REFUSAL_LOG_INTERVAL:
+            self._last_refusal_log = now
+            logger.warning(f"Refusing connection from {addr}: {reason} "
+                           f"(refused so far: {self.metrics['refused_max_connections']} over the connection "
+                           f"limit, {self.metrics['refused_accept_rate']} over the accept rate)")
@@ -0,0 +1,148 @@
+"""
+In-memory cache resolving protocol identifiers to devices.
+
+Every inbound protocol message names its device by whatever the terminal reports
+(JT808 terminal phone number, 808 IMEI or the legacy device_id). Looking that up
+in the database for each message costs several queries, so resolved devices are
+kept in a process-local cache keyed by the reported identifier. Entries expire
+after a TTL, unknown identifiers are remembered for a shorter negative TTL, and
+the device routes invalidate entries explicitly when a device is created,
+changed or deleted.
+
+Invalidation only reaches the cache of the current process; other processes
+pick up the change when their entries expire.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRef:
+    """Detached snapshot of the Device columns the ingest path needs"""
+    __slots__ = ('id', 'device_id', 'imei', 'battery_level')
+
+    def __init__(self, id, device_id, imei, battery_level=None):
+        self.id = id
+        self.device_id = device_id
+        self.imei = imei
+        self.battery_level = battery_level
+
+    @classmethod
+    def from_device(cls, device):
+        """Build a reference from a Device model instance"""
+        return cls(device.id, device.device_id, device.imei, device.battery_level)
+
+    def __repr__(self):
+        return f'<DeviceRef {self.id} {self.imei}>'
+
+
+class DeviceIdentityCache:
+    """
+    Thread-safe identifier -> DeviceRef cache with TTL and negative caching
+
+    Lookups that hit a live entry do no locking and no SQL. On a miss the
+    caller-supplied loader is run (outside the lock) and its result cached; a
+    loader result is discarded if an invalidation happened while it was running
+    so a concurrent update can never be overwritten by stale data.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=100000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # identifier -> (DeviceRef or None, expires_at)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, identifier, loader):
+        """
+        Resolve an identifier, calling loader(identifier) on a cache miss
+
+        Args:
+            identifier: Identifier reported by the device
+            loader: Callable returning a DeviceRef, or None for unknown devices
+
+        Returns:
+            DeviceRef or None
+        """
+        now = time.monotonic()
+        entry = self._entries.get(identifier)
+        if entry is not None and entry[1] > now:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        generation = self._generation
+        ref = loader(identifier)
+        expires_at = now + (self.ttl if ref is not None else self.negative_ttl)
+
+        with self._lock:
+            if generation == self._generation:
+                if len(self._entries) >= self.max_entries:
+                    self._evict_expired(now)
+                self._entries[identifier] = (ref, expires_at)
+        return ref
+
+    def invalidate(self, *identifiers, device_pk=None):
+        """
+        Drop cached entries for a device
+
+        Removes the given identifiers, every entry resolving to device_pk and all
+        negative entries (a new or renamed device may match an identifier that was
+        previously unknown, e.g. a JT808 phone number that is a suffix of its IMEI).
+        """
+        with self._lock:
+            self._generation += 1
+            for identifier in identifiers:
+                if identifier:
+                    self._entries.pop(identifier, None)
+            stale = [
+                identifier for identifier, (ref, _) in self._entries.items()
+                if ref is None or (device_pk is not None and ref.id == device_pk)
+            ]
+            for identifier in stale:
+                del self._entries[identifier]
+        logger.debug(f"Invalidated device cache entries for device {device_pk} {identifiers}")
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def get_stats(self):
+        """Return cache size and hit/miss counters"""
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _evict_expired(self, now):
+        expired = [identifier for identifier, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for identifier in expired:
+            del self._entries[identifier]
+        if len(self._entries) >= self.max_entries:
+            # Everything is live; start over rather than growing without bound
+            logger.warning(f"Device cache is full ({len(self._entries)} entries), clearing it")
+            self._entries.clear()
+
+
+# Process-wide cache shared by the protocol servers and the device routes
+_device_cache = None
+
+def get_device_cache():
+    """Get the process-wide device identity cache"""
+    global _device_cache
+    if _device_cache is None:
+        from config import Config
+        _device_cache = DeviceIdentityCache(
+            ttl=Config.DEVICE_CACHE_TTL,
+            negative_ttl=Config.DEVICE_CACHE_NEGATIVE_TTL
+        )
+    return _device_cache
+
+def invalidate_device(device):
+    """Invalidate cached lookups for a Device model instance (call after committing changes)"""
+    get_device_cache().invalidate(device.device_id, device.imei, device_pk=device.id)
@@ -0,0 +1,358 @@
+"""
+Downlink commands for JT808 terminals.
+
+The web API queues commands as DeviceCommand rows (create_command) and the
+protocol server's CommandDispatcher delivers them over the device's live
+session. The table is the hand-off because API and ingest usually run in
+separate processes (PROCESS_ROLE), and it keeps commands for an offline device
+until it reconnects, e.g. to shorten the report interval of a lost pet as soon
+as its collar is back in coverage.
+
+Every command frame takes the next serial number of the session's outbound
+counter. The terminal answers with a general response (0x0001), or a location
+query response (0x0201) for a location query, quoting that serial number, which
+completes the command. Unanswered commands are resent after ack_timeout *
+attempts seconds (the growing retransmission timeout of JT/T 808) until
+max_attempts frames have been sent.
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from models import DeviceCommand
+from services import jt808
+
+logger = logging.getLogger(__name__)
+
+# Command lifecycle
+STATUS_PENDING = 'pending'  # Waiting for the device to be online
+STATUS_SENT = 'sent'  # Sent, waiting for the terminal's response
+STATUS_ACKNOWLEDGED = 'acknowledged'  # Terminal reported success
+STATUS_FAILED = 'failed'  # Terminal reported failure, see DeviceCommand.result
+STATUS_TIMEOUT = 'timeout'  # No response after max_attempts sends
+STATUS_EXPIRED = 'expired'  # Device did not come online before expires_at
+OPEN_STATUSES = (STATUS_PENDING, STATUS_SENT)
+
+# Commands accepted by create_command
+COMMAND_SET_PARAMETERS = 'set_parameters'
+COMMAND_LOCATION_QUERY = 'location_query'
+COMMANDS = (COMMAND_SET_PARAMETERS, COMMAND_LOCATION_QUERY)
+
+# Names accepted for terminal parameters, in addition to numeric IDs such as "0x0029"
+PARAMETER_NAMES = {
+    'heartbeat_interval': jt808.PARAM_HEARTBEAT_INTERVAL,
+    'report_interval': jt808.PARAM_REPORT_INTERVAL,
+    'sleep_report_interval': jt808.PARAM_SLEEP_REPORT_INTERVAL,
+    'emergency_report_interval': jt808.PARAM_EMERGENCY_REPORT_INTERVAL,
+}
+
+# Seconds a command waits for its device before it expires
+DEFAULT_COMMAND_TTL = 3600
+
+
+class CommandError(ValueError):
+    """Invalid downlink command request"""
+
+
+def encode_command(command, arguments=None):
+    """
+    Encode a command request into a JT808 message
+
+    Args:
+        command: One of COMMANDS
+        arguments: For set_parameters, {"parameters": {name or ID: value}}
+
+    Returns:
+        (message_id, body) tuple
+
+    Raises:
+        CommandError: Unknown command or invalid arguments
+    """
+    arguments = arguments or {}
+    if command == COMMAND_LOCATION_QUERY:
+        return jt808.MSG_LOCATION_QUERY, b''
+    if command != COMMAND_SET_PARAMETERS:
+        raise CommandError(f"Unknown command '{command}', expected one of: {', '.join(COMMANDS)}")
+
+    parameters = arguments.get('parameters')
+    if not isinstance(parameters, dict) or not parameters:
+        raise CommandError("'parameters' must be a non-empty object")
+    params = []
+    for name, value in parameters.items():
+        param_id = PARAMETER_NAMES.get(name)
+        if param_id is None:
+            try:
+                param_id = int(name, 0)
+            except ValueError:
+                raise CommandError(f"Unknown terminal parameter '{name}'")
+        params.append((param_id, value))
+    try:
+        return jt808.MSG_SET_TERMINAL_PARAMETERS, jt808.encode_parameters(params)
+    except jt808.JT808Error as e:
+        raise CommandError(str(e))
+
+
+def create_command(device_pk, command, arguments=None, ttl=DEFAULT_COMMAND_TTL):
+    """
+    Build a pending DeviceCommand for a device (the caller adds and commits it)
+
+    Raises:
+        CommandError: Unknown command or invalid arguments
+    """
+    message_id, body = encode_command(command, arguments)
+    now = datetime.utcnow()
+    return DeviceCommand(
+        device_id=device_pk,
+        command=command,
+        message_id=message_id,
+        body=body,
+        arguments=arguments,
+        status=STATUS_PENDING,
+        attempts=0,
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl)
+    )
+
+
+class CommandDispatcher:
+    """
+    Delivers queued DeviceCommand rows to the devices connected to this server
+
+    The protocol server attaches a session once the device it belongs to is
+    known, forwards terminal responses to on_response and detaches the session
+    when the connection closes. A background thread polls the table every
+    poll_interval seconds (and immediately when a device comes online), sends
+    due commands and records the responses.
+
+    With several ingest workers each one only sends to its own connections; a
+    command is claimed with a conditional UPDATE before it is sent, so it goes
+    out once even if a device briefly appears in two workers.
+    """
+
+    def __init__(self, app=None, poll_interval=2.0, ack_timeout=30.0, max_attempts=3):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.online = {}  # device pk -> ClientSession
+        self.in_flight = {}  # (session, serial) -> (command id, message id)
+        self._results = deque()  # (command id, status, result) waiting to be saved
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.running = False
+        self._thread = None
+        self.metrics = {
+            'sent': 0,
+            'resent': 0,
+            'acknowledged': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'expired': 0,
+        }
+
+    def start(self):
+        """Start the dispatcher thread"""
+        if self.running:
+            return
+        self.running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self._run, name='command-dispatcher')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Command dispatcher started (polling every {self.poll_interval:g} seconds)")
+
+    def stop(self, timeout=5.0):
+        """Stop the dispatcher thread after saving the responses received so far"""
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def attach(self, session, device_pk):
+        """Deliver the device's commands through session from now on"""
+        session.device_pk = device_pk
+        with self._lock:
+            self.online[device_pk] = session
+        # Send whatever was queued while the device was offline right away
+        self._wakeup.set()
+
+    def detach(self, session):
+        """Forget a closed session; its unanswered commands are resent on the next connection"""
+        device_pk = session.device_pk
+        if device_pk is None:
+            return
+        with self._lock:
+            if self.online.get(device_pk) is session:
+                del self.online[device_pk]
+            for key in [key for key in self.in_flight if key[0] is session]:
+                del self.in_flight[key]
+
+    def on_response(self, session, reply_serial, reply_id, result=0):
+        """
+        Match a terminal response to the command frame it answers
+
+        Returns:
+            True if it completed a command
+        """
+        with self._lock:
+            entry = self.in_flight.get((session, reply_serial))
+            if entry is None or entry[1] != reply_id:
+                return False
+            del self.in_flight[(session, reply_serial)]
+            status = STATUS_ACKNOWLEDGED if result == 0 else STATUS_FAILED
+            self._results.append((entry[0], status, result))
+        self._wakeup.set()
+        return True
+
+    def get_stats(self):
+        """Return delivery counters for monitoring"""
+        stats = dict(self.metrics)
+        stats['online_devices'] = len(self.online)
+        stats['in_flight'] = len(self.in_flight)
+        return stats
+
+    def dispatch(self):
+        """Save received responses, expire stale commands and send the due ones"""
+        app = self.app
+        if app is None:
+            from app import app
+
+        with self._lock:
+            results = list(self._results)
+            self._results.clear()
+
+        with app.app_context():
+            try:
+                now = datetime.utcnow()
+                self._save_results(results, now)
+                self._expire(now)
+                sends = self._claim_due(now)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                # Keep the responses for the next pass, ahead of any that arrived meanwhile
+                with self._lock:
+                    self._results.extendleft(reversed(results))
+                logger.error(f"Error dispatching device commands: {str(e)}")
+                return
+            finally:
+                db.session.remove()
+
+        for command_id, status, result in results:
+            self.metrics['acknowledged' if status == STATUS_ACKNOWLEDGED else 'failed'] += 1
+            logger.info(f"Command {command_id} {status} (result {result})")
+
+        # Only send once the claims are committed
+        for session, serial, command_id, message_id, body in sends:
+            with self._lock:
+                self._forget(command_id)  # A resent command is only answered through its latest frame
+                self.in_flight[(session, serial)] = (command_id, message_id)
+            try:
+                session.send(jt808.encode_frame(message_id, session.client_id, serial, body))
+                logger.info(f"Sent command {command_id} (0x{message_id:04X}) to device {session.client_id}, "
+                            f"serial {serial}")
+            except Exception as e:
+                logger.warning(f"Could not send command {command_id} to {session.client_id}: {str(e)}")
+
+    def _save_results(self, results, now):
+        for command_id, status, result in results:
+            db.session.execute(
+                update(DeviceCommand)
+                .where(DeviceCommand.id == command_id, DeviceCommand.status == STATUS_SENT)
+                .values(status=status, result=result, completed_at=now)
+            )
+
+    def _expire(self, now):
+        for status, final_status, counter in ((STATUS_PENDING, STATUS_EXPIRED, 'expired'),
+                                              (STATUS_SENT, STATUS_TIMEOUT, 'timed_out')):
+            command_ids = db.session.execute(
+                select(DeviceCommand.id).where(DeviceCommand.status == status, DeviceCommand.expires_at < now)
+            ).scalars().all()
+            if not command_ids:
+                continue
+            expired = db.session.execute(
+                update(DeviceCommand)
+                .where(DeviceCommand.id.in_(command_ids), DeviceCommand.status == status)
+                .values(status=final_status, completed_at=now)
+            ).rowcount
+            with self._lock:
+                for command_id in command_ids:
+                    self._forget(command_id)
+            self.metrics[counter] += expired or 0
+
+    def _claim_due(self, now):
+        """Mark the commands to send now as sent, returning what to send where"""
+        with self._lock:
+            online = dict(self.online)
+        if not online:
+            return []
+
+        rows = db.session.execute(
+            select(DeviceCommand.id, DeviceCommand.device_id, DeviceCommand.message_id, DeviceCommand.body,
+                   DeviceCommand.status, DeviceCommand.attempts, DeviceCommand.sent_at)
+            .where(DeviceCommand.status.in_(OPEN_STATUSES), DeviceCommand.device_id.in_(list(online)))
+            .order_by(DeviceCommand.id)
+        ).all()
+
+        sends = []
+        for command_id, device_pk, message_id, body, status, attempts, sent_at in rows:
+            session = online.get(device_pk)
+            if session is None:
+                continue
+            if status == STATUS_SENT:
+                if sent_at and sent_at + timedelta(seconds=self.ack_timeout * attempts) > now:
+                    continue  # Still waiting for the response
+                if attempts >= self.max_attempts:
+                    db.session.execute(
+                        update(DeviceCommand)
+                        .where(DeviceCommand.id == command_id, DeviceCommand.status == STATUS_SENT)
+                        .values(status=STATUS_TIMEOUT, completed_at=now)
+                    )
+                    with self._lock:
+                        self._forget(command_id)
+                    self.metrics['timed_out'] += 1
+                    logger.warning(f"Command {command_id} for device {session.client_id} timed out "
+                                   f"after {attempts} attempts")
+                    continue
+
+            serial = session.downlink_serial = (session.downlink_serial + 1) & 0xFFFF
+            claimed = db.session.execute(
+                update(DeviceCommand)
+                .where(DeviceCommand.id == command_id, DeviceCommand.status == status,
+                       DeviceCommand.attempts == attempts)
+                .values(status=STATUS_SENT, attempts=attempts + 1, sent_at=now, serial_number=serial)
+            ).rowcount
+            if claimed != 1:
+                continue  # Taken by another worker
+            self.metrics['resent' if attempts else 'sent'] += 1
+            sends.append((session, serial, command_id, message_id, bytes(body or b'')))
+        return sends
+
+    def _forget(self, command_id):
+        """Drop the in-flight entries of a command (call with the lock held)"""
+        for key in [key for key, entry in self.in_flight.items() if entry[0] == command_id]:
+            del self.in_flight[key]
+
+    def _run(self):
+        while self.running:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Error in command dispatcher: {str(e)}", exc_info=True)
+        # Keep the responses that arrived before shutdown
+        if self._results:
+            try:
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Error saving command responses: {str(e)}", exc_info=True)
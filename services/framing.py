@@ -0,0 +1,201 @@
+"""
+Incremental framing for device TCP streams.
+
+TCP does not preserve message boundaries: several device reports can arrive in
+one recv() (coalescing) and a single report can be split across several recv()
+calls (fragmentation). FrameSplitter buffers the stream per connection and yields
+complete frames delimited by a start and end byte - 0x7e ... 0x7e for JT808 and
+'*' ... '#' for the text-based 808 protocol.
+
+JT808 frames additionally escape 0x7e/0x7d inside the frame and end with an XOR
+checksum; escape_jt808(), unescape_jt808() and xor_checksum() handle both
+without a per-byte Python loop.
+
+This module has no Flask/database dependencies so it can be shared by the
+Flask-embedded protocol server and the standalone MQTT protocol adapter.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Start and end delimiters for each supported protocol
+PROTOCOL_DELIMITERS = {
+    'jt808': (0x7e, 0x7e),
+    '808': (ord('*'), ord('#')),
+}
+
+# Largest frame we are willing to buffer. A JT808 body is at most 1023 bytes, so even
+# a fully escaped frame with a sub-package header stays well below this.
+DEFAULT_MAX_FRAME_SIZE = 4096
+
+
+class FrameSplitter:
+    """
+    Per-connection incremental frame splitter
+
+    Every received byte is scanned once: the search position is remembered between
+    calls so a partially received frame is never re-scanned, and the buffer is
+    compacted once per feed() so only the unfinished frame is kept. Bytes outside a
+    frame are discarded, and a frame that grows past max_frame_size is dropped so a
+    misbehaving client cannot make the buffer grow without bound.
+    """
+    __slots__ = ('start', 'end', 'max_frame_size', 'dropped_bytes', '_buffer', '_frame_start', '_scan_pos')
+
+    def __init__(self, start=0x7e, end=0x7e, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        self.start = start
+        self.end = end
+        self.max_frame_size = max_frame_size
+        self.dropped_bytes = 0
+        self._buffer = bytearray()
+        self._frame_start = -1  # Index of the start delimiter of the frame being received
+        self._scan_pos = 0  # Where the next delimiter search resumes
+
+    @classmethod
+    def for_protocol(cls, protocol_type, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        """Create a splitter for 'jt808' or '808' framed streams"""
+        start, end = PROTOCOL_DELIMITERS[protocol_type]
+        return cls(start, end, max_frame_size)
+
+    @property
+    def buffered(self):
+        """Number of bytes currently held for an incomplete frame"""
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Add received bytes and return the complete frames they finish
+
+        Args:
+            data: Bytes received from the socket
+
+        Returns:
+            List of complete frames (bytes), including their delimiters
+        """
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        frame_start = self._frame_start
+        pos = self._scan_pos
+
+        while True:
+            if frame_start < 0:
+                frame_start = buffer.find(self.start, pos)
+                if frame_start < 0:
+                    # Nothing but noise outside a frame, discard it
+                    self.dropped_bytes += len(buffer) - pos
+                    buffer.clear()
+                    pos = 0
+                    break
+                self.dropped_bytes += frame_start - pos
+                pos = frame_start + 1
+
+            end = buffer.find(self.end, pos)
+            if end < 0:
+                pos = len(buffer)
+                break
+
+            if end == frame_start + 1 and self.start == self.end:
+                # Two adjacent 0x7e: we were out of sync, treat the second one as the start
+                frame_start = end
+                pos = end + 1
+                continue
+
+            frames.append(bytes(buffer[frame_start:end + 1]))
+            frame_start = -1
+            pos = end + 1
+
+        # Keep only the unfinished frame
+        if frame_start > 0:
+            del buffer[:frame_start]
+            pos -= frame_start
+            frame_start = 0
+
+        if frame_start == 0 and len(buffer) > self.max_frame_size:
+            logger.warning(f"Discarding oversized frame ({len(buffer)} bytes without an end delimiter)")
+            self.dropped_bytes += len(buffer)
+            buffer.clear()
+            frame_start = -1
+            pos = 0
+
+        self._frame_start = frame_start
+        self._scan_pos = pos
+        return frames
+
+    def reset(self):
+        """Discard any buffered partial frame"""
+        self._buffer.clear()
+        self._frame_start = -1
+        self._scan_pos = 0
+
+
+def escape_jt808(data):
+    """
+    Apply JT808 escaping: 0x7d -> 0x7d 0x01 and 0x7e -> 0x7d 0x02
+
+    Args:
+        data: Frame contents between the 0x7e delimiters (header, body and check code)
+
+    Returns:
+        Escaped bytes of the same type
+    """
+    # 0x7d first, so the 0x7d introduced by escaping 0x7e is not escaped again
+    return data.replace(b'\x7d', b'\x7d\x01').replace(b'\x7e', b'\x7d\x02')
+
+
+def unescape_jt808(data):
+    """
+    Reverse JT808 escaping: 0x7d 0x02 -> 0x7e and 0x7d 0x01 -> 0x7d
+
+    A 0x7d followed by any other byte is kept as is. Most frames contain no
+    0x7d at all, in which case data is returned untouched (no copy).
+
+    Args:
+        data: Escaped frame (bytes or bytearray), with or without its 0x7e delimiters
+
+    Returns:
+        Unescaped frame of the same type, or data itself if there was nothing to unescape
+    """
+    if data.find(0x7d) < 0:
+        return data
+    # Escape pairs never overlap (0x01/0x02 are not 0x7d) and replace() does not
+    # rescan its output, so two passes give the same result as a sequential scan
+    return data.replace(b'\x7d\x02', b'\x7e').replace(b'\x7d\x01', b'\x7d')
+
+
+# Masks for the low half of a folded checksum, indexed by half width in bytes (frames up to 8 KiB)
+_FOLD_MASKS = {1 << shift: (1 << (8 << shift)) - 1 for shift in range(13)}
+
+# Below this size a plain loop beats the setup cost of the big-integer fold
+_FOLD_MIN_SIZE = 48
+
+
+def xor_checksum(data):
+    """
+    XOR of all bytes in data (the JT808 check code)
+
+    The bytes are read as one integer whose halves are folded onto each other,
+    so the work is log2(len) big-integer operations instead of one Python
+    operation per byte. Very short inputs use a plain loop.
+
+    Args:
+        data: bytes, bytearray or memoryview (slice a memoryview to avoid copying)
+
+    Returns:
+        int in 0..255
+    """
+    size = len(data)
+    if size < _FOLD_MIN_SIZE:
+        checksum = 0
+        for b in data:
+            checksum ^= b
+        return checksum
+
+    value = int.from_bytes(data, 'little')
+    # Round the width up to a power of two bytes, then fold in halves down to one byte
+    width = 1 << (size - 1).bit_length()
+    while width > 1:
+        width >>= 1
+        mask = _FOLD_MASKS.get(width) or (1 << (width << 3)) - 1
+        value = (value >> (width << 3)) ^ (value & mask)
+    return value
@@ -0,0 +1,64 @@
+"""
+JT/T 808 codec for the pet tracking system.
+
+Used by the Flask-embedded protocol server, the standalone MQTT protocol
+adapter and the device simulators, so all of them read and write the same
+wire format.
+"""
+
+from services.jt808.codec import (
+    MESSAGE_TYPES,
+    MSG_HEARTBEAT,
+    MSG_LOCATION_QUERY,
+    MSG_LOCATION_QUERY_RESPONSE,
+    MSG_LOCATION_REPORT,
+    MSG_PLATFORM_GENERAL_RESPONSE,
+    MSG_SET_TERMINAL_PARAMETERS,
+    MSG_TERMINAL_AUTHENTICATION,
+    MSG_TERMINAL_GENERAL_RESPONSE,
+    MSG_TERMINAL_LOGOUT,
+    MSG_TERMINAL_REGISTRATION,
+    MSG_TERMINAL_REGISTRATION_RESPONSE,
+    PARAM_EMERGENCY_REPORT_INTERVAL,
+    PARAM_HEARTBEAT_INTERVAL,
+    PARAM_REPORT_INTERVAL,
+    PARAM_SLEEP_REPORT_INTERVAL,
+    Frame,
+    JT808Error,
+    LocationReport,
+    ResponseBuilder,
+    bcd_to_datetime,
+    bcd_to_epoch,
+    datetime_to_bcd,
+    decode_authentication,
+    decode_frame,
+    decode_general_response,
+    decode_location,
+    decode_location_query_response,
+    decode_parameters,
+    decode_phone,
+    decode_registration,
+    decode_registration_response,
+    encode_frame,
+    encode_general_response,
+    encode_location,
+    encode_parameters,
+    encode_phone,
+    encode_registration,
+    encode_registration_response,
+)
+
+__all__ = [
+    'MESSAGE_TYPES', 'Frame', 'JT808Error', 'LocationReport', 'ResponseBuilder',
+    'MSG_HEARTBEAT', 'MSG_LOCATION_QUERY', 'MSG_LOCATION_QUERY_RESPONSE', 'MSG_LOCATION_REPORT', 'MSG_PLATFORM_GENERAL_RESPONSE',
+    'MSG_SET_TERMINAL_PARAMETERS', 'MSG_TERMINAL_AUTHENTICATION', 'MSG_TERMINAL_GENERAL_RESPONSE',
+    'MSG_TERMINAL_LOGOUT', 'MSG_TERMINAL_REGISTRATION', 'MSG_TERMINAL_REGISTRATION_RESPONSE',
+    'PARAM_EMERGENCY_REPORT_INTERVAL', 'PARAM_HEARTBEAT_INTERVAL', 'PARAM_REPORT_INTERVAL',
+    'PARAM_SLEEP_REPORT_INTERVAL',
+    'bcd_to_datetime', 'bcd_to_epoch', 'datetime_to_bcd',
+    'decode_authentication', 'decode_frame', 'decode_general_response', 'decode_location',
+    'decode_location_query_response', 'decode_parameters', 'decode_phone', 'decode_registration',
+    'decode_registration_response',
+    'encode_frame', 'encode_general_response', 'encode_location', 'encode_parameters', 'encode_phone',
+    'encode_registration', 'encode_registration_response',
+]
@@ -0,0 +1,692 @@
+"""
+JT/T 808 codec shared by the protocol servers and the device simulators.
+
+Frames look like 0x7e | header | body | check code | 0x7e, with 0x7e/0x7d
+escaped inside the frame (see services/framing.py). The header is
+
+    message ID (H) | attributes (H) | phone number (6 byte BCD) | serial (H)
+    [total packages (H) | package number (H)]   when attribute bit 13 is set
+
+and the low 10 attribute bits hold the body length.
+
+Location reports (0x0200) carry the pet tracking extensions documented in
+JT808_PROTOCOL_EXTENSION.md as additional items 0x30-0x33. Early simulator
+builds sent the same values as 0xE0-0xE3; those IDs are still decoded.
+
+Decoders take the body as bytes or a memoryview and raise JT808Error on
+malformed input. This module has no Flask/database dependencies.
+"""
+
+import binascii
+import struct
+from collections.abc import Mapping
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional
+
+from services.framing import escape_jt808, unescape_jt808, xor_checksum
+
+# Message IDs
+MSG_TERMINAL_GENERAL_RESPONSE = 0x0001
+MSG_PLATFORM_GENERAL_RESPONSE = 0x8001
+MSG_HEARTBEAT = 0x0002
+MSG_TERMINAL_LOGOUT = 0x0003
+MSG_TERMINAL_REGISTRATION = 0x0100
+MSG_TERMINAL_REGISTRATION_RESPONSE = 0x8100
+MSG_TERMINAL_AUTHENTICATION = 0x0102
+MSG_SET_TERMINAL_PARAMETERS = 0x8103
+MSG_LOCATION_REPORT = 0x0200
+MSG_LOCATION_QUERY = 0x8201
+MSG_LOCATION_QUERY_RESPONSE = 0x0201
+
+MESSAGE_TYPES = {
+    MSG_TERMINAL_GENERAL_RESPONSE: "Terminal General Response",
+    MSG_PLATFORM_GENERAL_RESPONSE: "Platform General Response",
+    MSG_HEARTBEAT: "Heartbeat",
+    MSG_TERMINAL_REGISTRATION: "Terminal Registration",
+    MSG_TERMINAL_REGISTRATION_RESPONSE: "Terminal Registration Response",
+    MSG_TERMINAL_LOGOUT: "Terminal Logout",
+    MSG_TERMINAL_AUTHENTICATION: "Terminal Authentication",
+    MSG_SET_TERMINAL_PARAMETERS: "Set Terminal Parameters",
+    MSG_LOCATION_REPORT: "Location Information Report",
+    MSG_LOCATION_QUERY: "Location Information Query",
+    MSG_LOCATION_QUERY_RESPONSE: "Location Information Query Response",
+}
+
+# Terminal parameters (0x8103)
+PARAM_HEARTBEAT_INTERVAL = 0x0001  # Seconds
+PARAM_SLEEP_REPORT_INTERVAL = 0x0027  # Seconds between reports while sleeping
+PARAM_EMERGENCY_REPORT_INTERVAL = 0x0028  # Seconds between reports during an alarm
+PARAM_REPORT_INTERVAL = 0x0029  # Default seconds between location reports
+
+# Header attribute bits
+BODY_LENGTH_MASK = 0x03FF
+SUBPACKAGE_FLAG = 0x2000
+
+# Location status bits
+STATUS_ACC_ON = 0x01
+STATUS_POSITIONED = 0x02
+STATUS_SOUTH = 0x04
+STATUS_WEST = 0x08
+STATUS_MOVING = 0x10
+
+# Location additional item IDs (pet tracking extensions per JT808_PROTOCOL_EXTENSION.md)
+ITEM_MILEAGE = 0x01
+ITEM_FUEL_LEVEL = 0x02
+ITEM_RECORDER_SPEED = 0x03
+ITEM_SIGNAL_STATUS = 0x04
+ITEM_SIGNAL_STRENGTH = 0x11
+ITEM_BATTERY_LEVEL = 0x30
+ITEM_ACTIVITY_LEVEL = 0x31
+ITEM_HEALTH_FLAGS = 0x32
+ITEM_TEMPERATURE = 0x33
+
+PHONE_DIGITS = 12
+
+# Distinct BCD timestamps kept decoded (see _decode_bcd_time)
+BCD_TIME_CACHE_SIZE = 256
+
+# Precompiled layouts (big-endian)
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_I16 = struct.Struct('>h')
+_HEADER = struct.Struct('>HH6sH')  # Message ID, attributes, phone number, serial number
+_SUBPACKAGE = struct.Struct('>HH')  # Total packages, package number
+_GENERAL_RESPONSE = struct.Struct('>HHB')  # Serial number, reply ID, result
+# Header serial number followed by the general response body, at its offset in a delimited frame
+_GENERAL_RESPONSE_PATCH = struct.Struct('>HHHB')
+_GENERAL_RESPONSE_PATCH_OFFSET = 1 + _HEADER.size - 2
+_REGISTRATION = struct.Struct('>HH5s20s7sB')  # Province, city, manufacturer, model, terminal ID, plate color
+_REGISTRATION_RESPONSE = struct.Struct('>HB')  # Serial number, result
+_PARAMETER_HEADER = struct.Struct('>IB')  # Parameter ID, length
+_LOCATION_BASIC = struct.Struct('>IIiiHHH6s')  # Alarm, status, lat, lon, altitude, speed, direction, BCD time
+
+# Value layout of each known terminal parameter ID, None for strings
+_PARAMETER_LAYOUTS = {
+    **dict.fromkeys(range(0x0001, 0x0008), _U32),
+    **dict.fromkeys(range(0x0010, 0x0017), None),
+    **dict.fromkeys((0x0020, 0x0021, 0x0022, 0x0027, 0x0028, 0x0029), _U32),
+    **dict.fromkeys((0x0030, 0x0031, 0x0032), _U16),
+    **dict.fromkeys((0xF140, 0xF141, 0xF142), _U8),  # Pet tracker custom parameters
+}
+
+# Value of each BCD byte (0-99), None when a nibble is above 9
+_BCD_VALUES = tuple((b >> 4) * 10 + (b & 0x0F) if b >> 4 < 10 and b & 0x0F < 10 else None for b in range(256))
+_EPOCH = datetime(1970, 1, 1)
+
+# Additional location items: id -> (name, length, layout or None for a single byte, divisor or None)
+_LOCATION_ITEMS = {
+    ITEM_MILEAGE: ('mileage', 4, _U32, 10.0),  # km
+    ITEM_FUEL_LEVEL: ('fuel_level', 2, _U16, 10.0),  # liters
+    ITEM_RECORDER_SPEED: ('additional_speed', 2, _U16, 10.0),  # km/h
+    ITEM_SIGNAL_STATUS: ('signal_status', 4, _U32, None),
+    ITEM_SIGNAL_STRENGTH: ('signal_strength', 1, None, None),
+    ITEM_BATTERY_LEVEL: ('battery_level', 1, None, None),  # %
+    ITEM_ACTIVITY_LEVEL: ('activity_level', 1, None, None),  # %
+    ITEM_HEALTH_FLAGS: ('health_flags', 2, _U16, None),
+    ITEM_TEMPERATURE: ('temperature', 2, _I16, 10.0),  # Celsius
+}
+# Legacy pet extension IDs sent by early simulator builds
+for _legacy_id, _item_id in ((0xE0, ITEM_BATTERY_LEVEL), (0xE1, ITEM_ACTIVITY_LEVEL),
+                             (0xE2, ITEM_HEALTH_FLAGS), (0xE3, ITEM_TEMPERATURE)):
+    _LOCATION_ITEMS[_legacy_id] = _LOCATION_ITEMS[_item_id]
+# Items that are published as pet data rather than stored with the location
+_PET_DATA_ITEMS = frozenset(('activity_level', 'health_flags', 'temperature'))
+
+
+class JT808Error(ValueError):
+    """Raised for frames or message bodies that cannot be decoded"""
+
+
+class Frame(NamedTuple):
+    """A decoded JT808 frame; body is a memoryview into data"""
+    message_id: int
+    attributes: int
+    phone: str
+    serial: int
+    body: memoryview
+    total_packages: Optional[int]
+    package_number: Optional[int]
+    data: bytes  # Unescaped frame, including the 0x7e delimiters
+
+    @property
+    def body_length(self):
+        """Body length declared in the header attributes"""
+        return self.attributes & BODY_LENGTH_MASK
+
+    @property
+    def is_subpackage(self):
+        return bool(self.attributes & SUBPACKAGE_FLAG)
+
+
+def encode_phone(phone: str) -> bytes:
+    """Encode a terminal phone number as 6 BCD bytes (left-padded with zeros, last 12 digits kept)"""
+    try:
+        return bytes.fromhex(phone.rjust(PHONE_DIGITS, '0')[-PHONE_DIGITS:])
+    except ValueError as e:
+        raise JT808Error(f"Invalid terminal phone number {phone!r}") from e
+
+
+def decode_phone(raw) -> str:
+    """Decode a 6 byte BCD phone number to its 12 digits"""
+    return bytes(raw).hex()
+
+
+def datetime_to_bcd(value: Optional[datetime] = None) -> bytes:
+    """Encode a datetime as 6 BCD bytes (YYMMDDhhmmss), defaulting to now"""
+    if value is None:
+        value = datetime.now()
+    return bytes.fromhex(value.strftime('%y%m%d%H%M%S'))
+
+
+def bcd_to_datetime(raw) -> datetime:
+    """
+    Decode 6 BCD bytes (YYMMDDhhmmss) to a naive UTC datetime
+
+    Out of range fields are replaced (January, the 1st, 00:00:00) and
+    undecodable values give the current UTC time, rather than rejecting the
+    whole report.
+    """
+    if type(raw) is not bytes:
+        raw = bytes(raw)
+    value = _decode_bcd_time(raw)
+    return datetime.utcnow() if value is None else value
+
+
+def bcd_to_epoch(raw) -> int:
+    """Decode 6 BCD bytes (YYMMDDhhmmss, UTC) to Unix epoch seconds, like bcd_to_datetime()"""
+    return int((bcd_to_datetime(raw) - _EPOCH).total_seconds())
+
+
+@lru_cache(maxsize=BCD_TIME_CACHE_SIZE)
+def _decode_bcd_time(raw: bytes) -> Optional[datetime]:
+    """
+    bcd_to_datetime() without the current time fallback (None instead), so it can be cached
+
+    Terminals report their current time, so reports arriving together - from
+    one device or from many - mostly share the same few seconds and are
+    answered from the cache.
+    """
+    if len(raw) != 6:
+        return None
+    values = _BCD_VALUES
+    year, month, day, hour, minute, second = (values[raw[0]], values[raw[1]], values[raw[2]],
+                                              values[raw[3]], values[raw[4]], values[raw[5]])
+    if None in (year, month, day, hour, minute, second):
+        # Not BCD
+        return None
+    year += 2000
+    try:
+        return datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        pass
+
+    if not (1 <= month <= 12):
+        month = 1
+    if not (1 <= day <= 31):
+        day = 1
+    if not (0 <= hour <= 23):
+        hour = 0
+    if not (0 <= minute <= 59):
+        minute = 0
+    if not (0 <= second <= 59):
+        second = 0
+    try:
+        return datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        # A day past the end of the month
+        return None
+
+
+def encode_frame(message_id: int, phone: str, serial: int, body: bytes = b'',
+                 total_packages: Optional[int] = None, package_number: Optional[int] = None) -> bytes:
+    """
+    Build an escaped frame, delimiters included
+
+    Args:
+        message_id: JT808 message ID
+        phone: Terminal phone number (up to 12 digits)
+        serial: Message serial number (wrapped to 16 bits)
+        body: Encoded message body (at most 1023 bytes)
+        total_packages, package_number: Sub-package fields, for split messages
+    """
+    return _encode_frame(message_id, encode_phone(phone), serial, body, total_packages, package_number)
+
+
+def _encode_frame(message_id, phone_bcd, serial, body, total_packages=None, package_number=None):
+    """encode_frame() with the phone number already BCD encoded"""
+    if len(body) > BODY_LENGTH_MASK:
+        raise JT808Error(f"Message body too long: {len(body)} bytes")
+    attributes = len(body)
+    if total_packages is not None:
+        attributes |= SUBPACKAGE_FLAG
+    payload = _HEADER.pack(message_id, attributes, phone_bcd, serial & 0xFFFF)
+    if total_packages is not None:
+        payload += _SUBPACKAGE.pack(total_packages, package_number)
+    payload += body
+    payload += bytes((xor_checksum(payload),))
+    return b'\x7e' + escape_jt808(payload) + b'\x7e'
+
+
+class ResponseBuilder:
+    """
+    Platform responses for one terminal, for use by a connection session
+
+    The general response (0x8001) is the ACK for almost every message and
+    only its serial number, reply ID and result change between calls. They
+    are patched into a preallocated frame whose header and BCD phone number
+    were encoded once, and the check code is derived from the precomputed
+    XOR of the fixed bytes. Output is identical to encode_frame().
+
+    Not thread-safe: use one builder per connection.
+    """
+    __slots__ = ('phone', '_phone_bcd', '_general', '_general_xor')
+
+    def __init__(self, phone: str):
+        self.phone = phone
+        self._phone_bcd = encode_phone(phone)
+        header = _HEADER.pack(MSG_PLATFORM_GENERAL_RESPONSE, _GENERAL_RESPONSE.size, self._phone_bcd, 0)
+        self._general = bytearray(b'\x7e' + header + bytes(_GENERAL_RESPONSE.size) + b'\x00\x7e')
+        self._general_xor = xor_checksum(header)
+
+    def general_response(self, serial: int, reply_id: int, result: int = 0) -> bytes:
+        """General response frame answering message reply_id, reusing its serial number"""
+        serial &= 0xFFFF
+        frame = self._general
+        _GENERAL_RESPONSE_PATCH.pack_into(frame, _GENERAL_RESPONSE_PATCH_OFFSET, serial, serial, reply_id, result)
+        # The serial number is in the frame twice, so it cancels out of the check code
+        frame[-2] = self._general_xor ^ (reply_id >> 8) ^ (reply_id & 0xFF) ^ result
+        data = bytes(frame)
+        if 0x7d in data or data.count(0x7e) != 2:
+            # A patched byte needs escaping
+            return b'\x7e' + escape_jt808(data[1:-1]) + b'\x7e'
+        return data
+
+    def registration_response(self, serial: int, result: int = 0, auth_code: str = '') -> bytes:
+        """Terminal registration response frame (0x8100)"""
+        return _encode_frame(MSG_TERMINAL_REGISTRATION_RESPONSE, self._phone_bcd, serial,
+                             encode_registration_response(serial, result, auth_code))
+
+
+def decode_frame(frame) -> Frame:
+    """
+    Unescape a frame (with its 0x7e delimiters), verify it and split header and body
+
+    Raises:
+        JT808Error: Missing delimiters, truncated header or checksum mismatch
+    """
+    data = bytes(unescape_jt808(frame))
+    size = len(data)
+    if size < _HEADER.size + 3 or data[0] != 0x7e or data[-1] != 0x7e:
+        raise JT808Error("Invalid JT808 frame: missing delimiters or too short")
+
+    view = memoryview(data)
+    message_id, attributes, phone, serial = _HEADER.unpack_from(view, 1)
+    header_end = 1 + _HEADER.size
+    total_packages = package_number = None
+    if attributes & SUBPACKAGE_FLAG:
+        if size < header_end + _SUBPACKAGE.size + 2:
+            raise JT808Error("Invalid JT808 frame: truncated sub-package header")
+        total_packages, package_number = _SUBPACKAGE.unpack_from(view, header_end)
+        header_end += _SUBPACKAGE.size
+
+    # The check code is the XOR of everything between the delimiters but itself
+    checksum = xor_checksum(view[1:-2])
+    if checksum != data[-2]:
+        raise JT808Error(f"Checksum mismatch. Received: {data[-2]}, Calculated: {checksum}")
+
+    return Frame(message_id, attributes, decode_phone(phone), serial, view[header_end:-2],
+                 total_packages, package_number, data)
+
+
+def encode_general_response(reply_serial: int, reply_id: int, result: int = 0) -> bytes:
+    """Body of a general response (0x0001 terminal, 0x8001 platform)"""
+    return _GENERAL_RESPONSE.pack(reply_serial, reply_id, result)
+
+
+def decode_general_response(body) -> Dict[str, Any]:
+    """Decode a general response body (0x0001/0x8001)"""
+    if len(body) < _GENERAL_RESPONSE.size:
+        raise JT808Error("Message body too short")
+    response_serial_number, reply_id, result = _GENERAL_RESPONSE.unpack_from(body)
+    decoded = {
+        'response_serial_number': response_serial_number,
+        'reply_id': reply_id,
+        'result': result,
+    }
+    if len(body) > _GENERAL_RESPONSE.size:
+        # Alarm processing confirmation, sent by some platforms
+        decoded['alarm_process_confirmation'] = body[_GENERAL_RESPONSE.size]
+    return decoded
+
+
+def encode_registration(province_id: int, city_id: int, manufacturer_id: str, terminal_model: str,
+                        terminal_id: str, plate_color: int = 0, plate_number: str = '') -> bytes:
+    """Body of a terminal registration (0x0100); string fields are NUL padded"""
+    return _REGISTRATION.pack(
+        province_id, city_id,
+        manufacturer_id.encode('ascii'), terminal_model.encode('ascii'), terminal_id.encode('ascii'),
+        plate_color
+    ) + plate_number.encode('gbk')
+
+
+def decode_registration(body) -> Dict[str, Any]:
+    """Decode a terminal registration body (0x0100)"""
+    if len(body) < _REGISTRATION.size:
+        raise JT808Error("Message body too short")
+    (provincial_id, city_id, manufacturer_id, terminal_model,
+     terminal_id, car_color) = _REGISTRATION.unpack_from(body)
+    return {
+        'provincial_id': provincial_id,
+        'city_id': city_id,
+        'manufacturer_id': _ascii(manufacturer_id),
+        'terminal_model': _ascii(terminal_model),
+        'terminal_id': _ascii(terminal_id),
+        'car_color': car_color,
+        # Plate number (or pet name) in GBK, empty when unregistered
+        'plate_number': str(body[_REGISTRATION.size:], 'gbk', errors='ignore').strip('\x00 '),
+    }
+
+
+def encode_registration_response(reply_serial: int, result: int = 0, auth_code: str = '') -> bytes:
+    """Body of a terminal registration response (0x8100); the auth code is only sent on success"""
+    body = _REGISTRATION_RESPONSE.pack(reply_serial, result)
+    if result == 0 and auth_code:
+        body += auth_code.encode('ascii')
+    return body
+
+
+def decode_registration_response(body) -> Dict[str, Any]:
+    """Decode a terminal registration response body (0x8100)"""
+    if len(body) < _REGISTRATION_RESPONSE.size:
+        raise JT808Error("Message body too short")
+    response_serial_number, result = _REGISTRATION_RESPONSE.unpack_from(body)
+    authentication_code = ''
+    if result == 0:
+        authentication_code = _ascii(body[_REGISTRATION_RESPONSE.size:])
+    return {
+        'response_serial_number': response_serial_number,
+        'result': result,
+        'authentication_code': authentication_code,
+    }
+
+
+def decode_authentication(body) -> Dict[str, Any]:
+    """Decode a terminal authentication body (0x0102), which is just the auth code"""
+    return {'authentication_code': _ascii(body)}
+
+
+def encode_parameters(params) -> bytes:
+    """
+    Body of a set terminal parameters message (0x8103)
+
+    Args:
+        params: (param_id, value) pairs; values are ints or strings for known IDs,
+                or already encoded bytes for any ID
+
+    Raises:
+        JT808Error: Unknown parameter without a bytes value, or a value that does not fit
+    """
+    items = []
+    for param_id, value in params:
+        if isinstance(value, (bytes, bytearray)):
+            raw = bytes(value)
+        elif param_id not in _PARAMETER_LAYOUTS:
+            raise JT808Error(f"Unknown terminal parameter 0x{param_id:04X}, pass its value as bytes")
+        elif _PARAMETER_LAYOUTS[param_id] is None:
+            raw = str(value).encode('ascii')
+        else:
+            try:
+                raw = _PARAMETER_LAYOUTS[param_id].pack(value)
+            except struct.error:
+                raise JT808Error(f"Invalid value for terminal parameter 0x{param_id:04X}: {value!r}")
+        if len(raw) > 0xFF:
+            raise JT808Error(f"Terminal parameter 0x{param_id:04X} value too long: {len(raw)} bytes")
+        items.append(_PARAMETER_HEADER.pack(param_id, len(raw)) + raw)
+    if not items or len(items) > 0xFF:
+        raise JT808Error(f"Expected 1 to 255 terminal parameters, got {len(items)}")
+    return bytes((len(items),)) + b''.join(items)
+
+
+def decode_parameters(body) -> Dict[str, Any]:
+    """Decode a set terminal parameters body (0x8103)"""
+    if len(body) < 1:
+        raise JT808Error("Message body too short")
+
+    params = []
+    offset = 1
+    size = len(body)
+    while offset + _PARAMETER_HEADER.size <= size:
+        param_id, param_len = _PARAMETER_HEADER.unpack_from(body, offset)
+        offset += _PARAMETER_HEADER.size
+        if offset + param_len > size:
+            break
+        params.append({
+            'param_id': param_id,
+            'param_value': decode_parameter_value(param_id, body[offset:offset + param_len])
+        })
+        offset += param_len
+
+    return {'num_params': body[0], 'params': params}
+
+
+def decode_parameter_value(param_id: int, value):
+    """Decode a terminal parameter value by ID, falling back to hex for unknown IDs"""
+    if param_id in _PARAMETER_LAYOUTS:
+        if _PARAMETER_LAYOUTS[param_id] is None:
+            return _ascii(value)
+        # Some terminals send numeric parameters narrower than the standard, e.g. intervals as a BYTE
+        if len(value) in (1, 2, 4):
+            return int.from_bytes(value, 'big')
+    return binascii.hexlify(value).decode('ascii')
+
+
+def encode_location(latitude: float, longitude: float, altitude: float = 0, speed: float = 0,
+                    heading: float = 0, timestamp: Optional[datetime] = None, alarm: int = 0,
+                    status: int = STATUS_POSITIONED, mileage: Optional[float] = None,
+                    battery_level: Optional[float] = None, activity_level: Optional[float] = None,
+                    health_flags: Optional[int] = None, temperature: Optional[float] = None) -> bytes:
+    """
+    Body of a location report (0x0200)
+
+    Latitude/longitude are sent as absolute values with the south/west status
+    bits set for negative coordinates. Speed is in km/h, temperature in Celsius;
+    optional extensions are only added when given.
+    """
+    status &= ~(STATUS_SOUTH | STATUS_WEST)
+    if latitude < 0:
+        status |= STATUS_SOUTH
+    if longitude < 0:
+        status |= STATUS_WEST
+
+    body = _LOCATION_BASIC.pack(
+        alarm, status,
+        int(round(abs(latitude) * 1000000)), int(round(abs(longitude) * 1000000)),
+        int(altitude), int(round(speed * 10)), int(heading) % 360,
+        datetime_to_bcd(timestamp)
+    )
+    if mileage is not None:
+        body += bytes((ITEM_MILEAGE, 4)) + _U32.pack(int(round(mileage * 10)))
+    if battery_level is not None:
+        body += bytes((ITEM_BATTERY_LEVEL, 1, int(battery_level)))
+    if activity_level is not None:
+        body += bytes((ITEM_ACTIVITY_LEVEL, 1, int(activity_level)))
+    if health_flags is not None:
+        body += bytes((ITEM_HEALTH_FLAGS, 2)) + _U16.pack(health_flags)
+    if temperature is not None:
+        body += bytes((ITEM_TEMPERATURE, 2)) + _I16.pack(int(round(temperature * 10)))
+    return body
+
+
+class LocationReport(Mapping):
+    """
+    Read-only view of a location report body (0x0200)
+
+    The 28 byte basic information is decoded when the view is created; the
+    additional items after it are only read when they are asked for.
+    battery_level and has_pet_data share one pass over the item IDs,
+    additional_data decodes every item once and caches the dict. A report
+    that is only written to the database never builds the extras.
+
+    The view keeps a reference to the body, which for frames from
+    decode_frame() is a memoryview into Frame.data.
+
+    It is also a read-only mapping with the keys decode_location() has
+    always returned, so dict-style callers keep working.
+    """
+    __slots__ = ('alarm', 'status', 'valid', 'latitude', 'longitude', 'altitude', 'speed', 'heading',
+                 'timestamp', '_body', '_battery_level', '_has_pet_data', '_additional_data')
+
+    KEYS = ('valid', 'latitude', 'longitude', 'altitude', 'speed', 'heading', 'timestamp', 'additional_data')
+    _KEY_SET = frozenset(KEYS)
+
+    def __init__(self, body):
+        size = len(body)
+        if size < _LOCATION_BASIC.size:
+            raise JT808Error(f"Location body too short: {size} bytes, expected at least {_LOCATION_BASIC.size}")
+
+        (alarm, status, latitude, longitude, altitude, speed, heading,
+         time_bcd) = _LOCATION_BASIC.unpack_from(body)
+        if status & STATUS_SOUTH and latitude > 0:
+            latitude = -latitude
+        if status & STATUS_WEST and longitude > 0:
+            longitude = -longitude
+
+        self.alarm = alarm
+        self.status = status
+        self.valid = bool(status & STATUS_POSITIONED)
+        self.latitude = latitude / 1000000.0
+        self.longitude = longitude / 1000000.0
+        self.altitude = altitude
+        self.speed = speed / 10.0  # km/h
+        self.heading = heading
+        self.timestamp = bcd_to_datetime(time_bcd)
+        self._body = body
+        self._has_pet_data = None  # Not scanned yet
+        self._battery_level = None
+        self._additional_data = None
+
+    @property
+    def battery_level(self) -> Optional[int]:
+        """Battery level in percent, or None if the terminal did not report it"""
+        if self._has_pet_data is None:
+            self._scan()
+        return self._battery_level
+
+    @property
+    def has_pet_data(self) -> bool:
+        """True if the report carries activity level, health flags or temperature"""
+        if self._has_pet_data is None:
+            self._scan()
+        return self._has_pet_data
+
+    @property
+    def additional_data(self) -> Dict[str, Any]:
+        """alarm, status and every known additional item, decoded on first access"""
+        if self._additional_data is None:
+            additional_data = {'alarm': self.alarm, 'status': self.status}
+            body = self._body
+            size = len(body)
+            offset = _LOCATION_BASIC.size
+            while offset + 2 <= size:  # Item ID and length bytes
+                item_id = body[offset]
+                item_length = body[offset + 1]
+                offset += 2
+                if offset + item_length > size:
+                    break
+                item = _LOCATION_ITEMS.get(item_id)
+                if item is not None:
+                    name, length, layout, divisor = item
+                    if length == item_length:
+                        value = body[offset] if layout is None else layout.unpack_from(body, offset)[0]
+                        additional_data[name] = value / divisor if divisor else value
+                offset += item_length
+            self._additional_data = additional_data
+        return self._additional_data
+
+    def _scan(self):
+        """Find the battery level and whether pet data is present without decoding other items"""
+        battery_level = None
+        has_pet_data = False
+        body = self._body
+        size = len(body)
+        offset = _LOCATION_BASIC.size
+        while offset + 2 <= size:
+            item_length = body[offset + 1]
+            if offset + 2 + item_length > size:
+                break
+            item = _LOCATION_ITEMS.get(body[offset])
+            if item is not None and item[1] == item_length:
+                if item[0] == 'battery_level':
+                    battery_level = body[offset + 2]
+                elif item[0] in _PET_DATA_ITEMS:
+                    has_pet_data = True
+            offset += 2 + item_length
+        self._battery_level = battery_level
+        self._has_pet_data = has_pet_data
+
+    # Mapping interface, with the keys decode_location() returned as a dict
+
+    def __getitem__(self, key):
+        if key in self._KEY_SET:
+            return getattr(self, key)
+        if key == 'battery_level':
+            value = self.battery_level
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._KEY_SET:
+            return getattr(self, key)
+        if key == 'battery_level':
+            value = self.battery_level
+            if value is not None:
+                return value
+        return default
+
+    def __contains__(self, key):
+        return key in self._KEY_SET or (key == 'battery_level' and self.battery_level is not None)
+
+    def __iter__(self):
+        yield from self.KEYS
+        if self.battery_level is not None:
+            yield 'battery_level'
+
+    def __len__(self):
+        return len(self.KEYS) + (self.battery_level is not None)
+
+    def __repr__(self):
+        return f"LocationReport({dict(self)!r})"
+
+
+def decode_location(body) -> LocationReport:
+    """
+    Decode a location report body (0x0200)
+
+    Coordinates are returned signed. Both conventions seen from terminals are
+    accepted: absolute values with the south/west status bits, or negative
+    values without them.
+
+    Returns:
+        LocationReport with valid, latitude, longitude, altitude, speed (km/h),
+        heading, timestamp and additional_data (alarm, status and the
+        additional items), plus battery_level when the terminal reports it
+    """
+    return LocationReport(body)
+
+
+def decode_location_query_response(body) -> Dict[str, Any]:
+    """Decode a location query response body (0x0201): reply serial number plus a location report"""
+    if len(body) < 2:
+        raise JT808Error("Message body too short")
+    decoded = {'response_serial_number': _U16.unpack_from(body)[0]}
+    if len(body) >= 2 + _LOCATION_BASIC.size:
+        decoded.update(decode_location(body[2:]))
+    return decoded
+
+
+def _ascii(raw) -> str:
+    """Decode a NUL/space padded ASCII field"""
+    return str(raw, 'ascii', errors='ignore').strip('\x00 ')
@@ -1,6 +1,6 @@
 import logging
 from app import db
-from models import Location, Device, Pet
+from models import Location, Device, Pet, DeviceLatestLocation
 from datetime import datetime, timedelta
 from sqlalchemy import desc, func
 import json
@@ -78,15 +78,19 @@ class LocationService:
     
     @staticmethod
     def get_latest_location(device_id):
-        """Get the latest location for a device"""
-        try:
-            location = Location.query.filter_by(device_id=device_id) \
-                .order_by(desc(Location.timestamp)) \
-                .first()
-            return location
-        except Exception as e:
-            logger.error(f"Error getting latest location: {str(e)}", exc_info=True)
-            return None
+        """
+        Get the latest location for a device
+        
+        Reads the DeviceLatestLocation row maintained on ingest (a primary-key lookup) and
+        only falls back to the location history for devices that have no row yet. Database
+        errors are raised, so callers can tell them apart from a device without fixes.
+        """
+        latest = db.session.get(DeviceLatestLocation, device_id)
+        if latest:
+            return latest
+        return Location.query.filter_by(device_id=device_id) \
+            .order_by(desc(Location.timestamp), desc(Location.id)) \
+            .first()
     
     @staticmethod
     def calculate_distance_traveled(device_id, hours=24):
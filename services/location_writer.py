@@ -0,0 +1,392 @@
+"""
+Write-behind persistence for protocol location fixes.
+
+Committing every fix individually inside its own app context caps ingest at a few
+hundred fixes per second. LocationWriter takes parsed fixes (and the device
+status changes that come with them) from a bounded queue and persists them from a
+single background thread with bulk statements: one executemany INSERT for the
+Location rows, one upsert of the DeviceLatestLocation rows and one
+UPDATE-by-primary-key batch for the Device rows, flushed every batch_size items
+or flush_interval_ms milliseconds, whichever comes first.
+
+Callers get a WriteTicket back. With ack-on-enqueue the device is acknowledged
+as soon as the fix is queued; with ack-on-commit the ACK is attached to the
+ticket and only sent once the batch containing the fix has been committed.
+"""
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from models import Device, DeviceLatestLocation, Location
+
+logger = logging.getLogger(__name__)
+
+# When to acknowledge a device message that produced a write
+ACK_ON_ENQUEUE = 'enqueue'
+ACK_ON_COMMIT = 'commit'
+ACK_POLICIES = (ACK_ON_ENQUEUE, ACK_ON_COMMIT)
+
+# Once the queue is this full, device updates that only record a heartbeat are dropped
+# (and acknowledged) so the remaining room goes to location fixes
+SHED_HEARTBEATS_AT = 0.5
+_HEARTBEAT_COLUMNS = frozenset(('id', 'last_ping'))
+
+# Queue item that ends the batch being collected, see LocationWriter.request_flush
+_FLUSH_NOW = object()
+
+
+class WriteTicket:
+    """Completion handle for a submitted write"""
+    __slots__ = ('done', 'ok', 'rejected', '_callbacks', '_lock')
+
+    def __init__(self, lock, rejected=False):
+        self.done = rejected
+        self.ok = False
+        self.rejected = rejected
+        self._callbacks = None
+        self._lock = lock
+
+    def add_done_callback(self, callback):
+        """Call callback(ok) once the write has been committed (or has failed)"""
+        with self._lock:
+            if not self.done:
+                if self._callbacks is None:
+                    self._callbacks = []
+                self._callbacks.append(callback)
+                return
+        callback(self.ok)
+
+    def _resolve(self, ok):
+        with self._lock:
+            self.done = True
+            self.ok = ok
+            callbacks, self._callbacks = self._callbacks, None
+        if callbacks:
+            for callback in callbacks:
+                try:
+                    callback(ok)
+                except Exception as e:
+                    logger.error(f"Error in write completion callback: {str(e)}", exc_info=True)
+
+
+class LocationWriter:
+    """
+    Bounded queue plus a background thread that persists fixes in batches
+
+    Each queued item is a (location_row, device_update, ticket) triple where
+    location_row is a dict of Location column values (or None for messages that
+    only touch the device, such as heartbeats) and device_update is a dict with
+    the Device primary key 'id' and the columns to update.
+    """
+
+    def __init__(self, app=None, batch_size=500, flush_interval_ms=200, max_queue_size=10000,
+                 enqueue_timeout=1.0, metrics_log_interval=60):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.enqueue_timeout = enqueue_timeout
+        self.metrics_log_interval = metrics_log_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.shed_depth = int(max_queue_size * SHED_HEARTBEATS_AT)
+        self.running = False
+        self._thread = None
+        self._ticket_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._last_metrics_log = time.monotonic()
+        self.metrics = {
+            'enqueued': 0,
+            'rejected': 0,
+            'shed': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'rows_written': 0,
+            'rows_failed': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def start(self):
+        """Start the background writer thread"""
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='location-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Location writer started (batch size {self.batch_size}, "
+                    f"flush interval {int(self.flush_interval * 1000)} ms, queue size {self.queue.maxsize})")
+
+    def stop(self, timeout=5.0):
+        """Stop the writer after flushing whatever is still queued"""
+        if not self.running:
+            return
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Location writer stopped")
+
+    def submit(self, location_row=None, device_update=None):
+        """
+        Queue a fix and/or a device status update for persistence
+
+        Blocks for up to enqueue_timeout seconds (indefinitely if None) when the queue
+        is full. Heartbeat-only updates are shed (not written, but reported as
+        committed) once the queue is SHED_HEARTBEATS_AT full; the next fix from the
+        device updates last_ping anyway.
+
+        Returns:
+            WriteTicket; ticket.rejected is True if the queue stayed full
+        """
+        ticket = WriteTicket(self._ticket_lock)
+        if (location_row is None and device_update is not None and self.shed_depth
+                and self.queue.qsize() >= self.shed_depth and device_update.keys() <= _HEARTBEAT_COLUMNS):
+            self.metrics['shed'] += 1
+            ticket._resolve(True)
+            return ticket
+        try:
+            self.queue.put((location_row, device_update, ticket), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.metrics['rejected'] += 1
+            logger.warning("Location write queue is full, rejecting fix")
+            return WriteTicket(self._ticket_lock, rejected=True)
+        self.metrics['enqueued'] += 1
+        return ticket
+
+    def request_flush(self):
+        """Write the batch being collected now instead of waiting for the flush interval"""
+        if self._flush_requested.is_set():
+            return
+        self._flush_requested.set()
+        try:
+            self.queue.put_nowait(_FLUSH_NOW)
+        except queue.Full:
+            self._flush_requested.clear()  # A full queue makes full batches anyway
+
+    def fill_ratio(self):
+        """Fraction of the queue in use (0.0 to 1.0)"""
+        return self.queue.qsize() / self.queue.maxsize if self.queue.maxsize > 0 else 0.0
+
+    def get_metrics(self):
+        """Return a snapshot of the writer metrics (flush latency in milliseconds)"""
+        metrics = dict(self.metrics)
+        metrics['queue_depth'] = self.queue.qsize()
+        metrics['avg_flush_ms'] = (metrics['total_flush_ms'] / metrics['flushes']) if metrics['flushes'] else 0.0
+        return metrics
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+            self._maybe_log_metrics()
+
+    def _collect_batch(self):
+        """Wait for the first item, then gather more until the batch is full or the interval elapses"""
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        if first is _FLUSH_NOW:
+            self._flush_requested.clear()
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _FLUSH_NOW:
+                self._flush_requested.clear()
+                break
+            batch.append(item)
+        return batch
+
+    def _flush(self, batch):
+        app = self.app
+        if app is None:
+            from app import app
+
+        location_rows = [item[0] for item in batch if item[0] is not None]
+        device_updates = self._merge_device_updates(item[1] for item in batch)
+
+        started = time.perf_counter()
+        with app.app_context():
+            try:
+                try:
+                    self._write(location_rows, device_updates)
+                    results = [True] * len(batch)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    self.metrics['failed_flushes'] += 1
+                    logger.error(f"Batch write of {len(location_rows)} locations failed, "
+                                 f"retrying row by row: {str(e)}")
+                    results = self._write_individually(batch)
+            except Exception as e:
+                self.metrics['failed_flushes'] += 1
+                logger.error(f"Error writing location batch: {str(e)}", exc_info=True)
+                results = [False] * len(batch)
+            finally:
+                db.session.remove()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        written = sum(1 for item, ok in zip(batch, results) if ok and item[0] is not None)
+        self._record_flush(written, elapsed_ms)
+
+        for item, ok in zip(batch, results):
+            item[2]._resolve(ok)
+
+    def _write(self, location_rows, device_updates):
+        if location_rows:
+            result = db.session.execute(
+                insert(Location).returning(Location.id, sort_by_parameter_order=True),
+                location_rows
+            )
+            location_ids = result.scalars().all()
+            upsert_latest_locations([
+                latest_location_row(row, location_id)
+                for row, location_id in zip(location_rows, location_ids)
+            ])
+        if device_updates:
+            db.session.execute(update(Device), device_updates)
+        db.session.commit()
+
+    def _write_individually(self, batch):
+        """Fallback after a failed batch so one bad row (e.g. a deleted device) doesn't drop the rest"""
+        results = []
+        for location_row, device_update, _ in batch:
+            try:
+                self._write([location_row] if location_row else [], [device_update] if device_update else [])
+                results.append(True)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self.metrics['rows_failed'] += 1
+                logger.error(f"Dropping location for device {device_update and device_update.get('id')}: {str(e)}")
+                results.append(False)
+        return results
+
+    @staticmethod
+    def _merge_device_updates(updates):
+        """Collapse device updates so each device row is updated once per batch"""
+        merged = {}
+        for device_update in updates:
+            if not device_update:
+                continue
+            current = merged.get(device_update['id'])
+            if current is None:
+                merged[device_update['id']] = dict(device_update)
+            else:
+                current.update(device_update)
+        return list(merged.values())
+
+    def _record_flush(self, rows, elapsed_ms):
+        metrics = self.metrics
+        metrics['flushes'] += 1
+        metrics['rows_written'] += rows
+        metrics['last_batch_size'] = rows
+        metrics['max_batch_size'] = max(metrics['max_batch_size'], rows)
+        metrics['last_flush_ms'] = elapsed_ms
+        metrics['max_flush_ms'] = max(metrics['max_flush_ms'], elapsed_ms)
+        metrics['total_flush_ms'] += elapsed_ms
+        logger.debug(f"Flushed {rows} locations in {elapsed_ms:.1f} ms")
+
+    def _maybe_log_metrics(self):
+        if not self.metrics_log_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_metrics_log >= self.metrics_log_interval:
+            self._last_metrics_log = now
+            metrics = self.get_metrics()
+            logger.info(f"Location writer: {metrics['rows_written']} rows in {metrics['flushes']} flushes, "
+                        f"avg {metrics['avg_flush_ms']:.1f} ms, max {metrics['max_flush_ms']:.1f} ms, "
+                        f"queue depth {metrics['queue_depth']}, rejected {metrics['rejected']}")
+
+
+def build_location_row(device_pk, location_data, battery_level=None):
+    """Build the Location column values for a parsed protocol fix"""
+    now = datetime.utcnow()
+    return {
+        'device_id': device_pk,
+        'latitude': location_data["latitude"],
+        'longitude': location_data["longitude"],
+        'speed': location_data.get("speed"),
+        'heading': location_data.get("heading"),
+        'altitude': location_data.get("altitude"),
+        'timestamp': location_data.get("timestamp") or now,
+        'battery_level': battery_level,
+        'accuracy': location_data.get("accuracy"),
+        'created_at': now,
+    }
+
+
+def latest_location_row(location_row, location_id=None):
+    """Build the DeviceLatestLocation column values for a Location row"""
+    row = dict(location_row)
+    row['location_id'] = location_id
+    row['updated_at'] = datetime.utcnow()
+    return row
+
+
+def upsert_latest_locations(rows):
+    """
+    Insert or refresh DeviceLatestLocation rows in the current session
+
+    A stored fix is only replaced by a newer one, so out-of-order (e.g. buffered
+    and retransmitted) fixes never move a device back in time. Uses the dialect's
+    INSERT ... ON CONFLICT DO UPDATE where available.
+    """
+    # One row per device: a single statement cannot update the same row twice
+    newest = {}
+    for row in rows:
+        current = newest.get(row['device_id'])
+        if current is None or row['timestamp'] >= current['timestamp']:
+            newest[row['device_id']] = row
+    if not newest:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _merge_latest_locations(newest.values())
+        return
+
+    stmt = dialect_insert(DeviceLatestLocation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DeviceLatestLocation.device_id],
+        set_={
+            column.name: stmt.excluded[column.name]
+            for column in DeviceLatestLocation.__table__.columns
+            if column.name != 'device_id'
+        },
+        where=stmt.excluded.timestamp >= DeviceLatestLocation.timestamp
+    )
+    db.session.execute(stmt, list(newest.values()))
+
+
+def _merge_latest_locations(rows):
+    """Portable (row by row) fallback for dialects without ON CONFLICT support"""
+    for row in rows:
+        latest = db.session.get(DeviceLatestLocation, row['device_id'])
+        if latest is None:
+            db.session.add(DeviceLatestLocation(**row))
+        elif row['timestamp'] >= latest.timestamp:
+            for name, value in row.items():
+                setattr(latest, name, value)
@@ -4,5 +4,7 @@ MQTT Adapter module for the pet tracking system.
 
 from services.mqtt_adapter.mqtt_client import MQTTClient
 from services.mqtt_adapter.protocol_adapter import ProtocolAdapter
+from services.mqtt_adapter.publisher import MQTTPublisher, get_publisher
+from services.mqtt_adapter.spool import MessageSpool
 
-__all__ = ['MQTTClient', 'ProtocolAdapter']
\ No newline at end of file
+__all__ = ['MQTTClient', 'ProtocolAdapter', 'MQTTPublisher', 'get_publisher', 'MessageSpool']
\ No newline at end of file
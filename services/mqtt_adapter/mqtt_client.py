@@ -2,13 +2,15 @@
 MQTT Client module for publishing device data to MQTT broker.
 """
 
-import json
 import logging
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 import paho.mqtt.client as mqtt
 
+from services.mqtt_adapter.payloads import encode_device_message
+from services.mqtt_adapter.spool import MessageSpool
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -24,7 +26,10 @@ class MQTTClient:
     def __init__(self, 
                 broker_host: str = "127.0.0.1", 
                 broker_port: int = 1883,
-                client_id: str = "pet_tracker_adapter"):
+                client_id: str = "pet_tracker_adapter",
+                spool: Optional[MessageSpool] = None,
+                replay_rate: float = 100.0,
+                payload_format: Optional[str] = None):
         """
         Initialize the MQTT client.
         
@@ -32,10 +37,17 @@ class MQTTClient:
             broker_host: MQTT broker hostname or IP address
             broker_port: MQTT broker port
             client_id: Client ID for connecting to the broker
+            spool: Optional disk spool for messages published while disconnected
+            replay_rate: Spooled messages replayed per second after reconnecting
+            payload_format: 'json' or 'binary' (compact location messages on .../location/bin),
+                defaults to MQTT_PAYLOAD_FORMAT
         """
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.client_id = client_id
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.payload_format = payload_format or os.environ.get("MQTT_PAYLOAD_FORMAT", "json")
         self.client = mqtt.Client(client_id=client_id, clean_session=True, protocol=mqtt.MQTTv311)
         
         # Set up handlers
@@ -67,12 +79,18 @@ class MQTTClient:
             return True
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {e}")
+            if self.spool is not None:
+                # Keep retrying in the background; publishes are spooled meanwhile
+                self.client.connect_async(self.broker_host, self.broker_port)
+                self.client.loop_start()
             return False
     
     def disconnect(self) -> None:
         """Disconnect from the MQTT broker."""
         self.client.loop_stop()
         self.client.disconnect()
+        if self.spool is not None:
+            self.spool.close()
         logger.info("Disconnected from MQTT broker")
     
     def publish_device_data(self, device_id: str, data_type: str, payload: Dict[str, Any]) -> bool:
@@ -85,18 +103,27 @@ class MQTTClient:
             payload: Dictionary containing the data to publish
             
         Returns:
-            bool: True if message was published successfully, False otherwise
+            bool: True if message was published (or spooled) successfully, False otherwise
         """
-        if not self.connected:
+        topic, message = encode_device_message(device_id, data_type, payload, self.payload_format)
+
+        if self.spool is not None:
+            # Spool instead of reconnecting inline, and keep order behind already spooled messages
+            if not self.connected or self.spool.has_pending():
+                if not self.spool.append(topic, message, 1):
+                    logger.error(f"Failed to spool message to {topic}")
+                    return False
+                if self.connected:
+                    self._start_replay()
+                return True
+        elif not self.connected:
             logger.warning("Not connected to MQTT broker. Attempting reconnection...")
             self.connect()
             if not self.connected:
                 logger.error("Failed to reconnect to MQTT broker")
                 return False
         
-        topic = f"devices/{device_id}/{data_type}"
         try:
-            message = json.dumps(payload)
             result = self.client.publish(topic, message, qos=1)
             if result.rc != mqtt.MQTT_ERR_SUCCESS:
                 logger.error(f"Failed to publish message to {topic}: {mqtt.error_string(result.rc)}")
@@ -108,11 +135,20 @@ class MQTTClient:
             logger.error(f"Error publishing message to {topic}: {e}")
             return False
     
+    def _start_replay(self) -> None:
+        """Replay spooled messages in the background while connected"""
+        self.spool.start_replay(self._publish_spooled, lambda: self.connected, self.replay_rate)
+
+    def _publish_spooled(self, topic: str, payload: bytes, qos: int) -> bool:
+        return self.client.publish(topic, payload, qos=qos).rc == mqtt.MQTT_ERR_SUCCESS
+
     def _on_connect(self, client, userdata, flags, rc):
         """Callback for when the client connects to the broker."""
         if rc == 0:
             self.connected = True
             logger.info("Connected to MQTT broker")
+            if self.spool is not None and self.spool.has_pending():
+                self._start_replay()
         else:
             self.connected = False
             logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
@@ -0,0 +1,139 @@
+"""
+Compact binary encoding for high-frequency MQTT location messages.
+
+A JSON location message is a few hundred bytes of string keys and a nested
+status dict. The binary format packs the same fix into a fixed 32 byte
+big-endian record:
+
+    version (B) | present (H) | timestamp (I, unix seconds) |
+    latitude (i, 1e-6 deg) | longitude (i, 1e-6 deg) | altitude (h, m) |
+    speed (H, 0.1 km/h) | heading (H, deg) | raw_status (I) |
+    satellite_count (B) | battery_level (B) | activity_level (B) |
+    health_flags (H) | temperature (h, 0.1 C)
+
+The present bitmask marks which optional fields carry a value. The device ID
+is already part of the topic and the status dict is derived from raw_status,
+so neither is encoded. Binary messages are published with a /bin topic suffix
+(devices/<id>/location/bin) because the clients connect with MQTT 3.1.1, which
+has no content-type property.
+"""
+
+import datetime
+import json
+import struct
+from typing import Any, Dict, Tuple, Union
+
+PAYLOAD_FORMATS = ('json', 'binary')
+BINARY_TOPIC_SUFFIX = '/bin'
+LOCATION_FORMAT_VERSION = 1
+
+LOCATION_STRUCT = struct.Struct('>BHIiihHHIBBBHh')
+
+# Optional fields in present-bit order: (name, scale)
+OPTIONAL_FIELDS = (
+    ('altitude', 1),
+    ('speed', 10),
+    ('heading', 1),
+    ('raw_status', 1),
+    ('satellite_count', 1),
+    ('battery_level', 1),
+    ('activity_level', 1),
+    ('health_flags', 1),
+    ('temperature', 10),
+)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_epoch(timestamp: Union[str, datetime.datetime, int, float, None]) -> int:
+    """Convert an ISO string or naive UTC datetime to unix seconds"""
+    if timestamp is None:
+        return int((datetime.datetime.utcnow() - _EPOCH).total_seconds())
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int((timestamp - _EPOCH).total_seconds())
+
+
+def encode_location(payload: Dict[str, Any]) -> bytes:
+    """
+    Pack a location payload (as published in JSON) into the binary format.
+
+    Raises:
+        ValueError: If latitude/longitude are missing or a value is out of range
+    """
+    if payload.get('latitude') is None or payload.get('longitude') is None:
+        raise ValueError("Location payload requires latitude and longitude")
+
+    try:
+        present = 0
+        values = []
+        for bit, (name, scale) in enumerate(OPTIONAL_FIELDS):
+            value = payload.get(name)
+            if value is None:
+                values.append(0)
+            else:
+                present |= 1 << bit
+                values.append(int(round(value * scale)))
+
+        return LOCATION_STRUCT.pack(
+            LOCATION_FORMAT_VERSION,
+            present,
+            _to_epoch(payload.get('timestamp')),
+            int(round(payload['latitude'] * 1000000)),
+            int(round(payload['longitude'] * 1000000)),
+            *values
+        )
+    except Exception as e:
+        # struct.error for out of range values, TypeError/ValueError for bad types
+        raise ValueError(f"Cannot encode location payload: {e}") from e
+
+
+def decode_location(data: bytes) -> Dict[str, Any]:
+    """Unpack a binary location message into the JSON payload shape (without device_id)"""
+    if len(data) < LOCATION_STRUCT.size:
+        raise ValueError(f"Binary location message too short: {len(data)} bytes")
+    version, present, timestamp, latitude, longitude, *values = LOCATION_STRUCT.unpack_from(data)
+    if version != LOCATION_FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary location version: {version}")
+
+    payload = {
+        'timestamp': (_EPOCH + datetime.timedelta(seconds=timestamp)).isoformat(),
+        'latitude': latitude / 1000000.0,
+        'longitude': longitude / 1000000.0,
+    }
+    for bit, ((name, scale), value) in enumerate(zip(OPTIONAL_FIELDS, values)):
+        if present & (1 << bit):
+            payload[name] = value / scale if scale != 1 else value
+
+    status = payload.get('raw_status')
+    if status is not None:
+        payload['status'] = {
+            'acc_on': bool(status & 0x01),
+            'gps_positioned': bool(status & 0x02),
+            'latitude_type': 'South' if status & 0x04 else 'North',
+            'longitude_type': 'West' if status & 0x08 else 'East',
+            'moving': bool(status & 0x10),
+            'vehicle_status': bool(status & 0x20),
+        }
+    return payload
+
+
+def encode_device_message(device_id: str, data_type: str, payload: Dict[str, Any],
+                          payload_format: str = 'json') -> Tuple[str, Union[bytes, str]]:
+    """
+    Build the topic and wire payload for a devices/<device_id>/<data_type> message.
+
+    Only location messages have a binary form; everything else (and locations
+    that cannot be packed) is published as JSON on the plain topic.
+    """
+    topic = f"devices/{device_id}/{data_type}"
+    if payload_format == 'binary' and data_type == 'location':
+        try:
+            return topic + BINARY_TOPIC_SUFFIX, encode_location(payload)
+        except ValueError:
+            pass
+    return topic, json.dumps(payload)
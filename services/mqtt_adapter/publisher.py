@@ -0,0 +1,240 @@
+"""
+Shared MQTT publisher for fan-out from the ingest path.
+
+Creating an MQTTClient per message costs a TCP connection, an MQTT CONNECT
+handshake and a network thread for every fix. MQTTPublisher keeps one
+connection and one network loop per process, reconnects in the background with
+exponential backoff and bounds the number of messages paho keeps queued while
+the broker is unreachable, so publish() is a cheap, non-blocking call that is
+safe to use from any thread.
+
+With a MessageSpool attached, messages published while the broker is down go
+to disk instead of paho's in-memory queue and are replayed in order once the
+connection is back.
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, Optional, Union
+
+import paho.mqtt.client as mqtt
+
+from services.mqtt_adapter.payloads import encode_device_message
+from services.mqtt_adapter.spool import MessageSpool
+
+logger = logging.getLogger(__name__)
+
+
+def create_paho_client(client_id: str, clean_session: bool = True) -> mqtt.Client:
+    """Create a paho client using the v2 callback API where available (paho-mqtt >= 2.0)"""
+    callback_api = getattr(mqtt, "CallbackAPIVersion", None)
+    if callback_api is not None:
+        return mqtt.Client(callback_api.VERSION2, client_id=client_id,
+                           clean_session=clean_session, protocol=mqtt.MQTTv311)
+    return mqtt.Client(client_id=client_id, clean_session=clean_session, protocol=mqtt.MQTTv311)
+
+
+class MQTTPublisher:
+    """
+    Process-wide, thread-safe MQTT publisher.
+
+    The connection is established asynchronously by paho's network thread, so
+    start() never blocks and publishing before the broker is reachable queues
+    the message (up to max_queued_messages, QoS 1) instead of failing.
+    """
+
+    def __init__(self,
+                 broker_host: str = "127.0.0.1",
+                 broker_port: int = 1883,
+                 client_id: Optional[str] = None,
+                 qos: int = 1,
+                 max_queued_messages: int = 10000,
+                 min_reconnect_delay: int = 1,
+                 max_reconnect_delay: int = 60,
+                 spool: Optional[MessageSpool] = None,
+                 replay_rate: float = 100.0,
+                 payload_format: str = "json"):
+        """
+        Initialize the publisher.
+
+        Args:
+            broker_host: MQTT broker hostname or IP address
+            broker_port: MQTT broker port
+            client_id: Client ID (defaults to a unique pet_tracker_publisher_* ID)
+            qos: Default QoS for published messages
+            max_queued_messages: Messages buffered while disconnected or in flight before publishes are dropped
+            min_reconnect_delay: First reconnect delay in seconds (doubles up to max_reconnect_delay)
+            max_reconnect_delay: Largest reconnect delay in seconds
+            spool: Optional disk spool for messages published while disconnected
+            replay_rate: Spooled messages replayed per second after reconnecting
+            payload_format: 'json' or 'binary' (compact location messages on .../location/bin)
+        """
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.client_id = client_id or f"pet_tracker_publisher_{uuid.uuid4().hex[:8]}"
+        self.qos = qos
+        self.connected = False
+        self.started = False
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.payload_format = payload_format
+        self._lock = threading.Lock()
+        self.metrics = {'published': 0, 'dropped': 0, 'reconnects': 0, 'spooled': 0}
+
+        self.client = create_paho_client(self.client_id)
+        self.client.reconnect_delay_set(min_delay=min_reconnect_delay, max_delay=max_reconnect_delay)
+        self.client.max_queued_messages_set(max_queued_messages)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+        # Configure authentication if needed
+        mqtt_username = os.environ.get("MQTT_USERNAME")
+        mqtt_password = os.environ.get("MQTT_PASSWORD")
+        if mqtt_username and mqtt_password:
+            self.client.username_pw_set(mqtt_username, mqtt_password)
+
+    def start(self) -> None:
+        """Start the network loop; connects (and reconnects) in the background"""
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        logger.info(f"Starting MQTT publisher for {self.broker_host}:{self.broker_port}")
+        self.client.connect_async(self.broker_host, self.broker_port)
+        self.client.loop_start()
+
+    def stop(self) -> None:
+        """Disconnect and stop the network loop"""
+        with self._lock:
+            if not self.started:
+                return
+            self.started = False
+        self.client.disconnect()
+        self.client.loop_stop()
+        if self.spool is not None:
+            self.spool.close()
+        logger.info("MQTT publisher stopped")
+
+    def publish(self, topic: str, payload: Union[bytes, str, Dict[str, Any]], qos: Optional[int] = None,
+                retain: bool = False) -> bool:
+        """
+        Queue a message for publishing.
+
+        Args:
+            topic: MQTT topic
+            payload: bytes/str, or a dict that is JSON encoded
+            qos: QoS level (defaults to the publisher's qos)
+            retain: Retain flag
+
+        Returns:
+            bool: True if the message was accepted, False if it was dropped
+        """
+        if not self.started:
+            self.start()
+
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+
+        qos = self.qos if qos is None else qos
+
+        # Keep ordering: while anything is spooled, new messages queue up behind it
+        if self.spool is not None and (not self.connected or self.spool.has_pending()):
+            if self.spool.append(topic, payload, qos):
+                self.metrics['spooled'] += 1
+                if self.connected:
+                    # Resume a replay that stopped early, e.g. on a full outbound queue
+                    self._start_replay()
+                return True
+            self.metrics['dropped'] += 1
+            return False
+
+        try:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            logger.error(f"Error publishing message to {topic}: {e}")
+            self.metrics['dropped'] += 1
+            return False
+
+        # While disconnected paho keeps QoS 1/2 messages queued and sends them on reconnect
+        queued = info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and not queued:
+            # e.g. MQTT_ERR_QUEUE_SIZE when the outbound queue is full
+            self.metrics['dropped'] += 1
+            logger.warning(f"Dropped message to {topic}: {mqtt.error_string(info.rc)}")
+            return False
+
+        self.metrics['published'] += 1
+        return True
+
+    def publish_device_data(self, device_id: str, data_type: str, payload: Dict[str, Any]) -> bool:
+        """Publish device data to devices/<device_id>/<data_type> (same interface as MQTTClient)"""
+        topic, message = encode_device_message(device_id, data_type, payload, self.payload_format)
+        return self.publish(topic, message)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return publish counters and connection state"""
+        metrics = dict(self.metrics)
+        metrics['connected'] = self.connected
+        if self.spool is not None:
+            metrics['spool'] = self.spool.get_stats()
+        return metrics
+
+    def _start_replay(self) -> None:
+        self.spool.start_replay(self._publish_spooled, lambda: self.connected, self.replay_rate)
+
+    def _publish_spooled(self, topic: str, payload: bytes, qos: int) -> bool:
+        """Publish a replayed message, False if paho did not accept it"""
+        return self.client.publish(topic, payload, qos=qos).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        """Callback for when the client connects to the broker."""
+        if reason_code == 0:
+            self.connected = True
+            logger.info("Connected to MQTT broker")
+            if self.spool is not None and self.spool.has_pending():
+                self._start_replay()
+        else:
+            self.connected = False
+            logger.error(f"Failed to connect to MQTT broker: {reason_code}")
+
+    def _on_disconnect(self, client, userdata, *args):
+        """Callback for when the client disconnects (v1 and v2 callback signatures)."""
+        self.connected = False
+        if self.started:
+            self.metrics['reconnects'] += 1
+            logger.warning("Disconnected from MQTT broker, reconnecting in the background")
+
+
+# Process-wide publisher, created on first use
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> MQTTPublisher:
+    """Get the process-wide MQTT publisher (configured from MQTT_HOST/MQTT_PORT and MQTT_SPOOL_*)"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = MQTTPublisher(
+                    broker_host=os.environ.get("MQTT_HOST", "127.0.0.1"),
+                    broker_port=int(os.environ.get("MQTT_PORT", 1883)),
+                    max_queued_messages=int(os.environ.get("MQTT_MAX_QUEUED_MESSAGES", 10000)),
+                    spool=MessageSpool.from_environ(),
+                    replay_rate=float(os.environ.get("MQTT_SPOOL_REPLAY_RATE", 100)),
+                    payload_format=os.environ.get("MQTT_PAYLOAD_FORMAT", "json")
+                )
+                _publisher.start()
+    return _publisher
+
+
+def stop_publisher() -> None:
+    """Stop the process-wide publisher if it was started"""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is not None:
+            _publisher.stop()
+            _publisher = None
@@ -0,0 +1,387 @@
+"""
+Disk-backed spool for MQTT publishes made while the broker is unreachable.
+
+Messages are appended to segment files in a spool directory and replayed in
+order once the connection is back. Each record is a fixed header followed by
+the topic and payload:
+
+    payload length (uint32) | crc32 (uint32) | timestamp (float64) |
+    topic length (uint16) | qos (uint8) | topic | payload
+
+The read position is checkpointed to disk, so messages survive a restart and
+are delivered at least once. The spool is bounded by total bytes (oldest
+segments are discarded first) and by message age (stale messages are skipped
+on replay).
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('>IIdHB')
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_FILE = 'checkpoint'
+
+
+class SpooledMessage(NamedTuple):
+    """A message read back from the spool; position is where the next record starts"""
+    topic: str
+    payload: bytes
+    qos: int
+    timestamp: float
+    position: Tuple[int, int]
+
+
+class MessageSpool:
+    """
+    Append-only, size and age bounded message spool.
+
+    append() is called from publishing threads; read()/commit() (or replay())
+    from a single replay thread. All file access is serialized by one lock.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 max_age: float = 24 * 3600,
+                 segment_bytes: int = 4 * 1024 * 1024,
+                 use_mmap: bool = False):
+        """
+        Initialize the spool, recovering any segments left by a previous run.
+
+        Args:
+            directory: Directory holding the segment files
+            max_bytes: Total size of all segments before the oldest are discarded
+            max_age: Seconds after which spooled messages are no longer replayed
+            segment_bytes: Size at which the current segment is closed and a new one started
+            use_mmap: Read segments through mmap instead of buffered reads
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.use_mmap = use_mmap
+        self.metrics = {'spooled': 0, 'replayed': 0, 'expired': 0, 'discarded_bytes': 0, 'rejected': 0}
+
+        self._lock = threading.Lock()
+        self._replay_thread = None
+        self._replay_requested = False
+        os.makedirs(directory, exist_ok=True)
+
+        # Segment sequence number -> size in bytes
+        self._segments = {}
+        for name in os.listdir(directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[:-len(SEGMENT_SUFFIX)])
+                self._segments[seq] = os.path.getsize(self._segment_path(seq))
+
+        self._read_seq, self._read_offset = self._load_checkpoint()
+
+        # Always write to a fresh segment so a torn record from a crash stays at the end of a sealed one
+        self._write_file = None
+        self._write_seq = max(self._segments, default=0)
+        self._roll_segment()
+        if self._read_seq not in self._segments:
+            self._read_seq, self._read_offset = min(self._segments), 0
+
+        if self.pending_bytes:
+            logger.info(f"Recovered {self.pending_bytes} spooled bytes from {directory}")
+
+    @classmethod
+    def from_environ(cls) -> Optional['MessageSpool']:
+        """Create a spool from MQTT_SPOOL_* environment variables, or None if MQTT_SPOOL_DIR is unset"""
+        directory = os.environ.get('MQTT_SPOOL_DIR')
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_bytes=int(os.environ.get('MQTT_SPOOL_MAX_BYTES', 256 * 1024 * 1024)),
+            max_age=float(os.environ.get('MQTT_SPOOL_MAX_AGE', 24 * 3600)),
+            use_mmap=os.environ.get('MQTT_SPOOL_MMAP', 'false').lower() == 'true'
+        )
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._segments.values())
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes appended but not yet committed as replayed"""
+        with self._lock:
+            return sum(size for seq, size in self._segments.items() if seq >= self._read_seq) - self._read_offset
+
+    def has_pending(self) -> bool:
+        return self.pending_bytes > 0
+
+    def append(self, topic: str, payload: Union[bytes, str], qos: int = 1) -> bool:
+        """
+        Append a message to the spool.
+
+        Returns:
+            bool: True if the message was spooled, False if it can never fit
+        """
+        topic_bytes = topic.encode('utf-8')
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        body = topic_bytes + payload
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(body), time.time(), len(topic_bytes), qos) + body
+
+        if len(record) > self.max_bytes:
+            self.metrics['rejected'] += 1
+            return False
+
+        with self._lock:
+            try:
+                if self._write_file is None or self._segments[self._write_seq] >= self.segment_bytes:
+                    self._roll_segment()
+                self._write_file.write(record)
+                self._write_file.flush()
+            except OSError as e:
+                logger.error(f"Error writing to MQTT spool: {e}", exc_info=True)
+                self.metrics['rejected'] += 1
+                return False
+            self._segments[self._write_seq] += len(record)
+            self.metrics['spooled'] += 1
+            self._enforce_limits()
+        return True
+
+    def read(self, max_records: int = 100) -> List[SpooledMessage]:
+        """Read up to max_records messages from the replay position without consuming them"""
+        messages = []
+        now = time.time()
+        with self._lock:
+            start = seq, offset = self._read_seq, self._read_offset
+            while len(messages) < max_records and seq in self._segments:
+                records, at_end = self._read_segment(seq, offset, max_records - len(messages))
+                for message in records:
+                    if self.max_age and now - message.timestamp > self.max_age:
+                        self.metrics['expired'] += 1
+                    else:
+                        messages.append(message)
+                if records:
+                    offset = records[-1].position[1]
+                if not at_end:
+                    continue
+                next_seq = self._next_segment(seq)
+                if seq == self._write_seq or next_seq is None:
+                    break
+                # Sealed segment exhausted (or ends in a torn record from a crash)
+                seq, offset = next_seq, 0
+
+        if not messages and (seq, offset) != start:
+            # Only expired or unreadable records, don't read them again
+            self.commit((seq, offset))
+        return messages
+
+    def commit(self, position: Tuple[int, int]) -> None:
+        """Mark everything before position as replayed, deleting fully consumed segments"""
+        with self._lock:
+            seq, offset = position
+            if seq not in self._segments or position < (self._read_seq, self._read_offset):
+                # Stale: the segment was discarded by the size/age limits after it was read
+                return
+            for old_seq in [s for s in self._segments if s < seq]:
+                self._delete_segment(old_seq)
+            self._read_seq, self._read_offset = seq, offset
+            self._save_checkpoint()
+
+    def replay(self, publish: Callable[[str, bytes, int], bool], should_continue: Callable[[], bool],
+               rate: float = 100.0, batch_size: int = 100) -> int:
+        """
+        Publish spooled messages in order until the spool is drained or publishing fails.
+
+        Args:
+            publish: Called with (topic, payload, qos), returns False if the message was not accepted
+            should_continue: Checked before every message, e.g. the client's connected flag
+            rate: Maximum messages per second (0 for unlimited)
+            batch_size: Messages read from disk at a time
+
+        Returns:
+            int: Number of messages replayed
+        """
+        interval = 1.0 / rate if rate else 0.0
+        replayed = 0
+        next_send = time.monotonic()
+        while should_continue():
+            messages = self.read(batch_size)
+            if not messages:
+                break
+            position = None
+            for message in messages:
+                if not should_continue() or not publish(message.topic, message.payload, message.qos):
+                    break
+                position = message.position
+                replayed += 1
+                if interval:
+                    next_send += interval
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_send = time.monotonic()
+            if position is None:
+                break
+            self.commit(position)
+            if position != messages[-1].position:
+                break
+
+        self.metrics['replayed'] += replayed
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled MQTT messages")
+        return replayed
+
+    def start_replay(self, publish: Callable[[str, bytes, int], bool], should_continue: Callable[[], bool],
+                     rate: float = 100.0) -> None:
+        """Run replay() in a background thread, or make the running one go round again"""
+        with self._lock:
+            if self._replay_thread is not None:
+                # It may have read the last record before our message was appended
+                self._replay_requested = True
+                return
+            self._replay_thread = threading.Thread(
+                target=self._run_replay, args=(publish, should_continue, rate),
+                name='mqtt-spool-replay', daemon=True
+            )
+            self._replay_thread.start()
+
+    def close(self) -> None:
+        """Flush and close the current segment"""
+        with self._lock:
+            if self._write_file is not None:
+                self._write_file.close()
+                self._write_file = None
+            self._save_checkpoint()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.metrics)
+        stats['segments'] = len(self._segments)
+        stats['total_bytes'] = self.total_bytes
+        stats['pending_bytes'] = self.pending_bytes
+        return stats
+
+    def _run_replay(self, publish, should_continue, rate):
+        while True:
+            try:
+                self.replay(publish, should_continue, rate)
+            except Exception as e:
+                logger.error(f"Error replaying MQTT spool: {e}", exc_info=True)
+            # Decide under the lock so a start_replay() from now on starts a new thread instead
+            with self._lock:
+                if not self._replay_requested or not should_continue():
+                    self._replay_thread = None
+                    self._replay_requested = False
+                    return
+                self._replay_requested = False
+
+    def _read_segment(self, seq, offset, max_records):
+        """Decode records of one segment from offset; returns (messages, reached_end)"""
+        messages = []
+        with open(self._segment_path(seq), 'rb') as f:
+            if self.use_mmap and self._segments[seq] > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    end = self._decode(seq, buffer, offset, max_records, messages)
+            else:
+                f.seek(offset)
+                end = self._decode_file(seq, f, offset, max_records, messages)
+        return messages, end
+
+    def _decode_file(self, seq, f, offset, max_records, messages):
+        """Decode records from a buffered file positioned at offset, like _decode without reading ahead"""
+        while len(messages) < max_records:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return True
+            payload_len, crc, timestamp, topic_len, qos = RECORD_HEADER.unpack(header)
+            body = f.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len:
+                return True
+            if zlib.crc32(body) != crc:
+                logger.warning(f"Corrupt record in MQTT spool segment {seq} at {offset}, skipping rest")
+                return True
+            offset += RECORD_HEADER.size + len(body)
+            messages.append(SpooledMessage(body[:topic_len].decode('utf-8'), body[topic_len:], qos,
+                                           timestamp, (seq, offset)))
+        return False
+
+    def _decode(self, seq, buffer, offset, max_records, messages):
+        """Decode records from buffer into messages; returns True at the end of the readable data"""
+        size = len(buffer)
+        while len(messages) < max_records:
+            if offset + RECORD_HEADER.size > size:
+                return True
+            payload_len, crc, timestamp, topic_len, qos = RECORD_HEADER.unpack_from(buffer, offset)
+            start = offset + RECORD_HEADER.size
+            stop = start + topic_len + payload_len
+            if stop > size:
+                return True
+            body = bytes(buffer[start:stop])
+            if zlib.crc32(body) != crc:
+                logger.warning(f"Corrupt record in MQTT spool segment {seq} at {offset}, skipping rest")
+                return True
+            offset = stop
+            messages.append(SpooledMessage(body[:topic_len].decode('utf-8'), body[topic_len:], qos,
+                                           timestamp, (seq, offset)))
+        return False
+
+    def _next_segment(self, seq):
+        later = [s for s in self._segments if s > seq]
+        return min(later) if later else None
+
+    def _roll_segment(self):
+        if self._write_file is not None:
+            self._write_file.close()
+        self._write_seq += 1
+        self._segments[self._write_seq] = 0
+        self._write_file = open(self._segment_path(self._write_seq), 'ab')
+
+    def _enforce_limits(self):
+        """Discard the oldest sealed segments while over max_bytes or older than max_age"""
+        now = time.time()
+        for seq in sorted(self._segments):
+            if seq == self._write_seq:
+                break
+            too_big = self.total_bytes > self.max_bytes
+            too_old = self.max_age and now - os.path.getmtime(self._segment_path(seq)) > self.max_age
+            if not too_big and not too_old:
+                break
+            if seq >= self._read_seq:
+                logger.warning(f"MQTT spool limit reached, discarding segment {seq} ({self._segments[seq]} bytes)")
+                self.metrics['discarded_bytes'] += self._segments[seq]
+            self._delete_segment(seq)
+            if seq >= self._read_seq:
+                self._read_seq, self._read_offset = self._next_segment(seq), 0
+                self._save_checkpoint()
+
+    def _delete_segment(self, seq):
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+        self._segments.pop(seq, None)
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            return min(self._segments, default=1), 0
+
+    def _save_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        try:
+            with open(path + '.tmp', 'w') as f:
+                f.write(f"{self._read_seq} {self._read_offset}")
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error(f"Error saving MQTT spool checkpoint: {e}", exc_info=True)
@@ -0,0 +1,325 @@
+"""
+MQTT to database bridge.
+
+The standalone MQTT adapter (run_mqtt_adapter.py) only publishes fixes to the
+broker. MQTTBridge is the matching consumer: it subscribes to the device
+location topics, decodes JSON and compact binary payloads, resolves the device
+through the shared DeviceIdentityCache and hands the fixes to a LocationWriter,
+which inserts them in batches.
+
+With a shared subscription group ($share/<group>/...) the broker spreads the
+messages over every bridge in the group, so persistence can be scaled out
+independently of the adapters that accept device connections.
+"""
+
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+
+from models import Device
+from services.device_cache import DeviceRef, get_device_cache
+from services.location_writer import ACK_ON_COMMIT, ACK_POLICIES, build_location_row
+from services.mqtt_adapter.payloads import BINARY_TOPIC_SUFFIX, decode_location
+from services.mqtt_adapter.publisher import create_paho_client
+
+logger = logging.getLogger(__name__)
+
+# JSON and binary location topics published by MQTTClient/MQTTPublisher
+LOCATION_TOPICS = ('devices/+/location', 'devices/+/location' + BINARY_TOPIC_SUFFIX)
+
+# QoS 1 messages the broker sends before it waits for acknowledgements
+# (Mosquitto's max_inflight_messages default)
+DEFAULT_MAX_INFLIGHT = 20
+
+# Writes that failed to commit are retried after 1, 2, 4, ... seconds
+WRITE_RETRY_DELAY = 1.0
+MAX_WRITE_ATTEMPTS = 5
+
+
+class MQTTBridge:
+    """
+    Subscribes to device location topics and persists the fixes.
+
+    Messages are handled on paho's network thread. Give it a LocationWriter
+    without an enqueue timeout (enqueue_timeout=None, as run_mqtt_bridge.py
+    does) and submit() blocks while the write queue is full, which stops the
+    bridge reading from the socket and leaves the backlog with the broker
+    instead of in memory.
+
+    With ack-on-commit a QoS 1 message is only acknowledged once its fix is
+    committed, or when it can never be written (undecodable payload, unknown
+    device). Messages whose write was rejected or whose handling raised (e.g.
+    the database was unreachable) stay unacknowledged; the session is
+    persistent (clean_session=False) so the broker delivers them again when
+    the bridge reconnects. Set a fixed client_id so that also holds across
+    restarts. A write that fails to commit is retried MAX_WRITE_ATTEMPTS times
+    with growing delays and then dropped (and acknowledged), so it cannot hold
+    one of the broker's in-flight slots forever.
+
+    The broker stops delivering once max_inflight messages are unacknowledged,
+    so waiting for the writer's flush interval would cap the bridge at
+    max_inflight fixes per interval. Instead the writer is asked to flush as
+    soon as that many messages wait for their commit; set max_inflight to the
+    broker's limit (max_inflight_messages in Mosquitto).
+    """
+
+    def __init__(self,
+                 location_writer,
+                 broker_host: str = "127.0.0.1",
+                 broker_port: int = 1883,
+                 client_id: str = None,
+                 shared_group: str = None,
+                 qos: int = 1,
+                 ack_policy: str = ACK_ON_COMMIT,
+                 app=None,
+                 username: str = None,
+                 password: str = None,
+                 max_inflight: int = DEFAULT_MAX_INFLIGHT):
+        """
+        Initialize the bridge.
+
+        Args:
+            location_writer: LocationWriter used to persist fixes
+            broker_host: MQTT broker hostname or IP address
+            broker_port: MQTT broker port
+            client_id: Client ID (defaults to a unique pet_tracker_bridge_* ID)
+            shared_group: Shared subscription group, None for a plain subscription
+            qos: Subscription QoS
+            ack_policy: With 'commit', QoS 1 messages are acknowledged to the broker only
+                once the fix is committed (needs paho-mqtt >= 2.0), with 'enqueue' on receipt
+            app: Flask app used for device lookups (defaults to app.app)
+            username, password: Broker credentials, if it requires authentication
+            max_inflight: The broker's in-flight message limit for this client (ack-on-commit only)
+        """
+        if ack_policy not in ACK_POLICIES:
+            raise ValueError(f"Unknown ACK policy {ack_policy!r}, expected one of {ACK_POLICIES}")
+
+        self.location_writer = location_writer
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.client_id = client_id or f"pet_tracker_bridge_{uuid.uuid4().hex[:8]}"
+        self.shared_group = shared_group
+        self.qos = qos
+        self.app = app
+        self.device_cache = get_device_cache()
+        self.connected = False
+        self.max_inflight = max_inflight
+        self.metrics = {'received': 0, 'queued': 0, 'invalid': 0, 'unknown_device': 0, 'rejected': 0,
+                        'failed': 0, 'retried': 0, 'dropped': 0}
+        self._unacked = 0  # Messages waiting for their commit before they are acknowledged
+        self._unacked_lock = threading.Lock()
+
+        # Keep the session (and its unacknowledged messages) on the broker across reconnects
+        self.client = create_paho_client(self.client_id, clean_session=ack_policy != ACK_ON_COMMIT)
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+        # Deferred broker acknowledgement, so a crash before the commit means redelivery
+        self.manual_ack = ack_policy == ACK_ON_COMMIT and hasattr(self.client, 'manual_ack_set')
+        if self.manual_ack:
+            self.client.manual_ack_set(True)
+            logger.info(f"Acknowledging messages on commit, flushing every {max_inflight} unacknowledged "
+                        f"messages (match the broker's in-flight limit)")
+        elif ack_policy == ACK_ON_COMMIT:
+            logger.warning("paho-mqtt does not support manual acknowledgement, acknowledging on receipt")
+
+    @property
+    def topics(self):
+        """Subscription topic filters, with the shared subscription prefix if configured"""
+        if self.shared_group:
+            return [f"$share/{self.shared_group}/{topic}" for topic in LOCATION_TOPICS]
+        return list(LOCATION_TOPICS)
+
+    def start(self) -> None:
+        """Start the location writer and connect to the broker in the background"""
+        self.location_writer.start()
+        logger.info(f"Starting MQTT bridge {self.client_id} for {self.broker_host}:{self.broker_port}")
+        self.client.connect_async(self.broker_host, self.broker_port)
+        self.client.loop_start()
+
+    def stop(self) -> None:
+        """Disconnect and flush the fixes that are still queued"""
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.location_writer.stop()
+        logger.info("MQTT bridge stopped")
+
+    def get_stats(self):
+        """Return message counters, writer metrics and device cache stats"""
+        stats = dict(self.metrics)
+        stats['connected'] = self.connected
+        stats['unacked'] = self._unacked
+        stats['location_writer'] = self.location_writer.get_metrics()
+        stats['device_cache'] = self.device_cache.get_stats()
+        return stats
+
+    def handle_message(self, topic, payload):
+        """
+        Decode a location message and queue it for persistence
+
+        Returns:
+            WriteTicket, or None if the message was dropped
+        """
+        write = self.decode_message(topic, payload)
+        return self._submit(write) if write is not None else None
+
+    def decode_message(self, topic, payload):
+        """
+        Decode a location message into the writes that persist it
+
+        Returns:
+            (location_row, device_update) for LocationWriter.submit, or None if the
+            message cannot be written
+        """
+        self.metrics['received'] += 1
+
+        # devices/<device_id>/location[/bin]
+        parts = topic.split('/')
+        if len(parts) < 3 or parts[0] != 'devices':
+            self.metrics['invalid'] += 1
+            logger.warning(f"Ignoring message on unexpected topic {topic}")
+            return None
+
+        try:
+            if topic.endswith(BINARY_TOPIC_SUFFIX):
+                location = decode_location(payload)
+            else:
+                location = json.loads(payload)
+            location_data = {
+                'latitude': float(location['latitude']),
+                'longitude': float(location['longitude']),
+                'altitude': location.get('altitude'),
+                'speed': location.get('speed'),
+                'heading': location.get('heading'),
+                'accuracy': location.get('accuracy'),
+                'timestamp': self._parse_timestamp(location.get('timestamp')),
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            self.metrics['invalid'] += 1
+            logger.warning(f"Dropping undecodable location message on {topic}: {e}")
+            return None
+
+        device = self.device_cache.get(parts[1], self._load_device)
+        if device is None:
+            self.metrics['unknown_device'] += 1
+            logger.warning(f"Dropping location for unknown device {parts[1]}")
+            return None
+
+        battery_level = location.get('battery_level')
+        device_update = {'id': device.id, 'last_ping': datetime.utcnow()}
+        if battery_level is not None:
+            device_update['battery_level'] = battery_level
+            device.battery_level = battery_level
+
+        return build_location_row(device.id, location_data, battery_level), device_update
+
+    def _submit(self, write):
+        ticket = self.location_writer.submit(*write)
+        if ticket.rejected:
+            self.metrics['rejected'] += 1
+        else:
+            self.metrics['queued'] += 1
+        return ticket
+
+    def _load_device(self, device_id):
+        """Look a device up in the database on a cache miss"""
+        app = self.app
+        if app is None:
+            from app import app
+
+        with app.app_context():
+            device = Device.find_by_identifier(device_id)
+            return DeviceRef.from_device(device) if device else None
+
+    @staticmethod
+    def _parse_timestamp(value):
+        """Parse an ISO 8601 timestamp into a naive UTC datetime (None for now)"""
+        if not value:
+            return None
+        timestamp = datetime.fromisoformat(value)
+        if timestamp.tzinfo is not None:
+            timestamp = datetime.utcfromtimestamp(timestamp.timestamp())
+        return timestamp
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        """Callback for when the client connects to the broker; (re)subscribes"""
+        if reason_code == 0:
+            self.connected = True
+            logger.info(f"Connected to MQTT broker, subscribing to {', '.join(self.topics)}")
+            client.subscribe([(topic, self.qos) for topic in self.topics])
+        else:
+            self.connected = False
+            logger.error(f"Failed to connect to MQTT broker: {reason_code}")
+
+    def _on_disconnect(self, client, userdata, *args):
+        """Callback for when the client disconnects (v1 and v2 callback signatures)."""
+        self.connected = False
+        logger.warning("Disconnected from MQTT broker, reconnecting in the background")
+
+    def _on_message(self, client, userdata, msg):
+        """Callback for a received location message"""
+        try:
+            write = self.decode_message(msg.topic, msg.payload)
+            ticket = self._submit(write) if write is not None else None
+        except Exception as e:
+            # Typically a transient database error while resolving the device: leave the
+            # message unacknowledged so the broker delivers it again
+            self.metrics['failed'] += 1
+            logger.error(f"Error handling message on {msg.topic}, not acknowledging it: {e}", exc_info=True)
+            return
+
+        if not self.manual_ack:
+            return
+        if ticket is None:
+            # Undecodable or for an unknown device, redelivery would not help
+            client.ack(msg.mid, msg.qos)
+        elif ticket.rejected:
+            logger.warning(f"Write queue full, not acknowledging message on {msg.topic}")
+        else:
+            with self._unacked_lock:
+                self._unacked += 1
+                window_full = self._unacked >= self.max_inflight
+            self._ack_on_commit(client, msg, write, ticket, 1)
+            if window_full:
+                # The broker sends nothing more until some of these are acknowledged
+                self.location_writer.request_flush()
+
+    def _ack_on_commit(self, client, msg, write, ticket, attempt):
+        ticket.add_done_callback(lambda ok: self._on_committed(client, msg, write, attempt, ok))
+
+    def _on_committed(self, client, msg, write, attempt, ok):
+        """Acknowledge a message once its fix is committed, retrying failed writes"""
+        if not ok:
+            self.metrics['failed'] += 1
+            if attempt < MAX_WRITE_ATTEMPTS:
+                delay = WRITE_RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"Location write failed for message on {msg.topic}, retrying in {delay:g} seconds")
+                # Not from the writer thread that runs this callback: submit() may block on a full queue
+                timer = threading.Timer(delay, self._retry, (client, msg, write, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+            self.metrics['dropped'] += 1
+            logger.error(f"Dropping message on {msg.topic} after {attempt} failed write attempts")
+
+        with self._unacked_lock:
+            self._unacked -= 1
+        client.ack(msg.mid, msg.qos)
+
+    def _retry(self, client, msg, write, attempt):
+        self.metrics['retried'] += 1
+        try:
+            ticket = self._submit(write)
+        except Exception as e:
+            logger.error(f"Error retrying write for message on {msg.topic}: {e}", exc_info=True)
+            ticket = None
+        if ticket is None or ticket.rejected:
+            self._on_committed(client, msg, write, attempt, False)
+            return
+        self._ack_on_commit(client, msg, write, ticket, attempt)
+        self.location_writer.request_flush()
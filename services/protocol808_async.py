@@ -0,0 +1,269 @@
+"""
+Asyncio ingest engine for the 808/JT808 protocol server.
+
+Protocol808Server dedicates one OS thread to every connected device, which does
+not scale to tens of thousands of mostly idle collars. This engine multiplexes all
+device connections on a single event loop and hands the (blocking) parse/persist
+work to a small, fixed-size thread pool, so an idle connection only costs a
+socket, a transport and a few slotted objects.
+
+Select it with PROTOCOL_SERVER_ENGINE=asyncio (see services.protocol808.start_protocol_server).
+"""
+
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from services.protocol808 import PAUSE_CHECK_INTERVAL, RESUME_READING_AT, ClientSession, Protocol808Server
+
+logger = logging.getLogger(__name__)
+
+# Stop reading from a connection once this many received chunks are waiting to be processed
+MAX_PENDING_CHUNKS = 8
+
+
+def raise_open_file_limit(target=1048576):
+    """Raise the soft RLIMIT_NOFILE towards the hard limit so we can hold many sockets"""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        limit = target if hard == resource.RLIM_INFINITY else min(hard, target)
+        if soft == resource.RLIM_INFINITY or soft >= limit:
+            return soft
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        logger.info(f"Raised open file limit from {soft} to {limit}")
+        return limit
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not raise open file limit: {str(e)}")
+        return None
+
+
+class DeviceProtocol(asyncio.Protocol):
+    """
+    asyncio protocol for a single device connection
+
+    Received chunks are processed one at a time (in arrival order) on the server's
+    thread pool. While a chunk is being processed further chunks are queued, and
+    reading is paused when the queue grows past MAX_PENDING_CHUNKS so a single
+    chatty device cannot buffer unbounded data in memory. Under the 'pause'
+    queue-full policy a chunk is also held back (and reading paused) while the
+    location write queue is saturated, see AsyncProtocol808Server.throttle.
+    """
+    __slots__ = ('server', 'transport', 'session', 'pending', 'busy', 'paused')
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.session = None
+        self.pending = None  # Created lazily so idle connections don't carry a deque
+        self.busy = False
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        addr = transport.get_extra_info('peername')
+        if not self.server.admission.admit(len(self.server.sessions), addr):
+            transport.abort()
+            return
+        self.session = ClientSession(addr, send=self.send_threadsafe, close=self.close_threadsafe,
+                                     send_many=self.send_many_threadsafe)
+        self.server.sessions.register(self.session)
+        self.server.connections.add(self)
+        logger.debug(f"New connection from {addr}")
+
+    def connection_lost(self, exc):
+        if self.session is None:
+            return  # Refused by admission control
+        self.server.connections.discard(self)
+        self.server.throttled.discard(self)
+        self.server.release_session(self.session)
+        self.transport = None
+        self.pending = None
+        logger.debug(f"Connection closed with {self.session.addr}")
+
+    def data_received(self, data):
+        if self.busy or self.pending:
+            if self.pending is None:
+                self.pending = deque()
+            self.pending.append(data)
+            if not self.paused and len(self.pending) >= MAX_PENDING_CHUNKS:
+                self.transport.pause_reading()
+                self.paused = True
+            return
+        self._process(data)
+
+    def _process(self, data):
+        if self.server.should_pause_reading():
+            # Hold the chunk until the write queue drains; the server resumes us
+            if self.pending is None:
+                self.pending = deque()
+            self.pending.appendleft(data)
+            if not self.paused:
+                self.transport.pause_reading()
+                self.paused = True
+            self.server.throttle(self)
+            return
+        self.busy = True
+        future = self.server.loop.run_in_executor(
+            self.server.executor, self.server.handle_data, self.session, data
+        )
+        future.add_done_callback(self._on_processed)
+
+    def _on_processed(self, future):
+        self.busy = False
+        if self.transport is None or self.transport.is_closing():
+            return
+
+        try:
+            responses = future.result()
+        except Exception as e:
+            logger.error(f"Error handling data from {self.session.addr}: {str(e)}", exc_info=True)
+            responses = None
+
+        if responses:
+            # One writelines() per processed chunk, so its ACKs share a system call
+            self.transport.writelines(responses)
+        self.process_next()
+
+    def process_next(self):
+        """Process the next queued chunk, resuming reading once the queue is short again"""
+        if self.transport is None or self.transport.is_closing() or self.busy:
+            return
+        if self.pending:
+            data = self.pending.popleft()
+            if self.paused and len(self.pending) < MAX_PENDING_CHUNKS // 2:
+                self.transport.resume_reading()
+                self.paused = False
+            self._process(data)
+        elif self.paused:
+            self.transport.resume_reading()
+            self.paused = False
+
+    def send_threadsafe(self, data):
+        """Write to the device from any thread"""
+        if self.transport is not None:
+            self.server.loop.call_soon_threadsafe(self._write, data)
+
+    def send_many_threadsafe(self, frames):
+        """Write a list of frames to the device from any thread, in a single writelines()"""
+        if self.transport is not None:
+            self.server.loop.call_soon_threadsafe(self._write_many, frames)
+
+    def close_threadsafe(self):
+        """Close the connection from any thread"""
+        if self.transport is not None:
+            self.server.loop.call_soon_threadsafe(self._close)
+
+    def _write(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def _write_many(self, frames):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.writelines(frames)
+
+    def _close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncProtocol808Server(Protocol808Server):
+    """
+    Event-loop based variant of Protocol808Server
+
+    Parsing, persistence and ACK generation are inherited unchanged from
+    Protocol808Server.handle_data; only connection handling differs.
+    """
+    def __init__(self, host='0.0.0.0', port=8080, max_workers=8, **kwargs):
+        super().__init__(host=host, port=port, **kwargs)
+        self.max_workers = max_workers
+        self.loop = None
+        self.executor = None
+        self.connections = set()
+        self.throttled = set()  # Connections paused until the write queue drains
+        self._throttle_timer = None
+        self._server = None
+        self._stopped = None
+
+    def start(self):
+        """Run the event loop until stop() is called (blocks, like Protocol808Server.start)"""
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            logger.error(f"Error starting asyncio 808 server: {str(e)}", exc_info=True)
+        finally:
+            self.running = False
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='protocol808')
+        raise_open_file_limit()
+
+        try:
+            self._server = await self.loop.create_server(
+                lambda: DeviceProtocol(self),
+                self.host,
+                self.port,
+                backlog=self.backlog,
+                reuse_address=True,
+                reuse_port=self.reuse_port
+            )
+            self.running = True
+            self.location_writer.start()
+            self.sessions.start()
+            self.commands.start()
+            logger.info(f"Protocol server started on {self.host}:{self.port} "
+                        f"(supporting 808 and JT808 protocols, asyncio engine, {self.max_workers} workers)")
+
+            await self._stopped.wait()
+        finally:
+            if self._server:
+                self._server.close()
+            # Flush queued fixes before the connections waiting for deferred ACKs go away
+            self.location_writer.stop()
+            self.sessions.stop()
+            self.commands.stop()
+            for connection in list(self.connections):
+                if connection.transport is not None:
+                    connection.transport.close()
+            self.executor.shutdown(wait=False)
+
+    def throttle(self, connection):
+        """Park a connection until the location write queue drains (call on the loop)"""
+        self.throttled.add(connection)
+        if self._throttle_timer is None:
+            logger.debug("Location write queue is full, pausing reads")
+            self._throttle_timer = self.loop.call_later(PAUSE_CHECK_INTERVAL, self._release_throttled)
+
+    def _release_throttled(self):
+        if self.location_writer.fill_ratio() >= RESUME_READING_AT:
+            for connection in self.throttled:
+                if connection.session is not None:
+                    # Not silent, just not read from, so keep the reaper away
+                    self.sessions.touch(connection.session)
+            self._throttle_timer = self.loop.call_later(PAUSE_CHECK_INTERVAL, self._release_throttled)
+            return
+        self._throttle_timer = None
+        throttled, self.throttled = self.throttled, set()
+        for connection in throttled:
+            connection.process_next()
+
+    def get_stats(self):
+        """Return connection and persistence metrics for monitoring"""
+        stats = super().get_stats()
+        stats['throttled'] = len(self.throttled)
+        return stats
+
+    def stop(self):
+        """Stop the protocol server"""
+        self.running = False
+        if self.loop and self._stopped:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+        logger.info("Protocol server stopped (808/JT808, asyncio engine)")
+
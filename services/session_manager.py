@@ -0,0 +1,157 @@
+"""
+Idle session tracking for device TCP connections.
+
+Collars that lose cellular coverage often vanish without closing their TCP
+connection. Nothing is received on such a half-open connection again, so without
+a timeout it would hold its socket (and, for the threaded server, a thread) and
+its Protocol808Server.clients entry forever.
+
+SessionManager records the last time each ClientSession received data and a
+single reaper thread closes sessions that have been silent for a configurable
+multiple of the device heartbeat interval. Deadlines live in one heap with at
+most one entry per session: receiving data only updates the session's
+timestamp, and when an entry comes due the reaper either closes the session or
+pushes it back with its new deadline. There are no per-socket timers, and the
+reaper sleeps until the earliest deadline.
+
+This module has no Flask/database dependencies and works for both the threaded
+and the asyncio server (session.close must be safe to call from another thread).
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Defaults: devices heartbeat every minute and are dropped after three silent intervals
+DEFAULT_HEARTBEAT_INTERVAL = 60
+DEFAULT_IDLE_HEARTBEATS = 3
+
+# The reaper wakes at most once per this many seconds, closing everything due in one pass
+REAP_GRANULARITY = 1.0
+
+
+class SessionManager:
+    """
+    Tracks live sessions and closes those idle for idle_heartbeats * heartbeat_interval seconds
+
+    A session is counted as idle once it has been silent for longer than one
+    heartbeat interval; it is closed (reaped) when it reaches the idle timeout.
+    An idle timeout of 0 disables reaping, sessions are still counted.
+    """
+
+    def __init__(self, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, idle_heartbeats=DEFAULT_IDLE_HEARTBEATS,
+                 clock=time.monotonic):
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = heartbeat_interval * idle_heartbeats
+        self.clock = clock
+        self.sessions = set()
+        self.reaped = 0
+        self._heap = []  # (deadline, sequence, session)
+        self._sequence = itertools.count()  # Tie breaker, sessions are not orderable
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the reaper thread (a no-op when reaping is disabled)"""
+        if self._running or self.idle_timeout <= 0:
+            return
+        self._running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self._run, name='session-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info(f"Session reaper started (closing sessions idle for {self.idle_timeout:g} seconds)")
+
+    def stop(self):
+        """Stop the reaper thread; tracked sessions are left open"""
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+
+    def register(self, session):
+        """Start tracking a newly opened session"""
+        now = self.clock()
+        session.last_activity = now
+        with self._lock:
+            self.sessions.add(session)
+            if self.idle_timeout > 0:
+                heapq.heappush(self._heap, (now + self.idle_timeout, next(self._sequence), session))
+
+    def touch(self, session):
+        """Record activity on a session (called for every received chunk, so it takes no lock)"""
+        session.last_activity = self.clock()
+
+    def unregister(self, session):
+        """Stop tracking a closed session; its heap entry is dropped when it comes due"""
+        with self._lock:
+            self.sessions.discard(session)
+
+    def __len__(self):
+        """Number of live sessions"""
+        return len(self.sessions)
+
+    def reap(self):
+        """
+        Close every session that has reached the idle timeout
+
+        Returns:
+            Seconds until the next deadline (None if nothing is tracked)
+        """
+        now = self.clock()
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, _, session = heapq.heappop(heap)
+                if session not in self.sessions:
+                    continue  # Already closed
+                deadline = session.last_activity + self.idle_timeout
+                if deadline > now:
+                    # Active since the entry was pushed, re-arm for the new deadline
+                    heapq.heappush(heap, (deadline, next(self._sequence), session))
+                else:
+                    self.sessions.discard(session)
+                    expired.append(session)
+            next_deadline = heap[0][0] - now if heap else None
+
+        for session in expired:
+            logger.info(f"Closing session {session.addr} ({session.client_id or 'unidentified'}), "
+                        f"idle for {now - session.last_activity:.0f} seconds")
+            try:
+                session.close()
+            except Exception as e:
+                logger.debug(f"Error closing idle session {session.addr}: {str(e)}")
+        self.reaped += len(expired)
+        return next_deadline
+
+    def get_stats(self):
+        """Return live and idle session counts for monitoring"""
+        idle_since = self.clock() - self.heartbeat_interval
+        with self._lock:
+            sessions = list(self.sessions)
+        return {
+            'live': len(sessions),
+            'idle': sum(1 for session in sessions if session.last_activity < idle_since),
+            'reaped': self.reaped,
+            'idle_timeout': self.idle_timeout,
+        }
+
+    def _run(self):
+        while self._running:
+            try:
+                delay = self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping idle sessions: {str(e)}", exc_info=True)
+                delay = None
+            # Sessions registered meanwhile have later deadlines than anything already in the heap
+            self._wakeup.wait(self.idle_timeout if delay is None else max(delay, REAP_GRANULARITY))
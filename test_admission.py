@@ -0,0 +1,58 @@
+"""
+Tests for connection admission control in services/admission.py
+
+A fake clock drives the token bucket, so no test waits for real time.
+"""
+from services.admission import AdmissionControl, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=5, clock=clock)
+    assert [bucket.try_acquire() for _ in range(6)] == [True] * 5 + [False]
+
+    clock.now += 0.25  # 2.5 tokens
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+    clock.now += 100  # Refill is capped at the burst size
+    assert sum(bucket.try_acquire() for _ in range(10)) == 5
+
+
+def test_connection_limit():
+    admission = AdmissionControl(max_connections=2)
+    assert admission.admit(0) and admission.admit(1)
+    assert not admission.admit(2)
+    assert admission.get_stats()['admitted'] == 2
+    assert admission.get_stats()['refused_max_connections'] == 1
+
+
+def test_accept_rate():
+    clock = FakeClock()
+    admission = AdmissionControl(accept_rate=2, accept_burst=3, clock=clock)
+    assert sum(admission.admit(0) for _ in range(10)) == 3
+    clock.now += 1
+    assert sum(admission.admit(0) for _ in range(10)) == 2
+    stats = admission.get_stats()
+    assert stats['admitted'] == 5 and stats['refused_accept_rate'] == 15
+
+
+def test_unlimited_by_default():
+    admission = AdmissionControl()
+    assert all(admission.admit(n) for n in range(100000, 100100))
+    assert admission.get_stats()['admitted'] == 100
+
+
+if __name__ == "__main__":
+    test_token_bucket_allows_burst_then_rate()
+    test_connection_limit()
+    test_accept_rate()
+    test_unlimited_by_default()
+    print("Admission control tests passed")
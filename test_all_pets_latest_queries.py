@@ -0,0 +1,114 @@
+"""
+Regression test for /api/locations/all-pets-latest/
+
+The endpoint must issue the same number of SQL statements whether the user has
+one pet or dozens (no per-pet queries, no lazy loads in to_dict()).
+
+Uses an in-memory SQLite database unless DATABASE_URL is set; the test user and
+its data are removed afterwards either way.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")  # Also signs the JWT used below
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import app, db
+from models import User, Pet, Device, Location, DeviceLatestLocation
+
+
+def create_user_with_pets(pet_count):
+    """Create a user with pet_count pets, each with a device and a few fixes"""
+    suffix = uuid.uuid4().hex[:8]
+    user = User(email=f"n-plus-one-{suffix}@example.com", username=f"n-plus-one-{suffix}")
+    db.session.add(user)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    for i in range(pet_count):
+        pet = Pet(name=f"Pet {i}", pet_type="Dog", user_id=user.id)
+        db.session.add(pet)
+        db.session.flush()
+
+        device = Device(imei=f"35{uuid.uuid4().int % 10**13:013d}", name=f"Collar {i}",
+                        device_id=f"collar-{suffix}-{i}", user_id=user.id, pet_id=pet.id)
+        db.session.add(device)
+        db.session.flush()
+
+        for minutes in (10, 5, 1):
+            db.session.add(Location(device_id=device.id, latitude=37.77 + i * 0.001, longitude=-122.41,
+                                    timestamp=now - timedelta(minutes=minutes)))
+
+        # Every other device has a maintained latest fix, the rest exercise the history fallback
+        if i % 2 == 0:
+            db.session.add(DeviceLatestLocation(device_id=device.id, latitude=37.77 + i * 0.001,
+                                                longitude=-122.41, timestamp=now - timedelta(minutes=1)))
+
+    # One pet without a device
+    db.session.add(Pet(name="No collar", pet_type="Cat", user_id=user.id))
+    db.session.commit()
+    return user.id
+
+
+def delete_user(user_id):
+    device_ids = [device.id for device in Device.query.filter_by(user_id=user_id)]
+    DeviceLatestLocation.query.filter(DeviceLatestLocation.device_id.in_(device_ids)).delete(synchronize_session=False)
+    Location.query.filter(Location.device_id.in_(device_ids)).delete(synchronize_session=False)
+    Device.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    Pet.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def count_statements(user_id):
+    """Call the endpoint as user_id and return (statement count, response JSON)"""
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = app.test_client().get(
+            "/api/locations/all-pets-latest/",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return len(statements), response.get_json()
+
+
+def test_all_pets_latest_statement_count_is_constant():
+    with app.app_context():
+        small_user = create_user_with_pets(2)
+        large_user = create_user_with_pets(25)
+
+    try:
+        small_count, small_result = count_statements(small_user)
+        large_count, large_result = count_statements(large_user)
+
+        assert len(small_result) == 3
+        assert len(large_result) == 26
+        assert all('location' in pet for pet in large_result if 'device' in pet)
+        assert sum(1 for pet in large_result if 'device' not in pet) == 1
+        assert small_count == large_count, f"{small_count} statements for 2 pets, {large_count} for 25"
+    finally:
+        with app.app_context():
+            delete_user(small_user)
+            delete_user(large_user)
+
+
+if __name__ == "__main__":
+    test_all_pets_latest_statement_count_is_constant()
+    print("all-pets-latest statement count is constant")
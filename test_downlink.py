@@ -0,0 +1,266 @@
+"""
+Tests for downlink commands: services/downlink.py and the /api/devices/<id>/commands endpoints
+
+The dispatcher is driven by calling dispatch() directly with sessions that
+record the frames written to them; time passing is simulated by moving sent_at
+and expires_at back in the database.
+
+Uses an in-memory SQLite database unless DATABASE_URL is set; the test users and
+their data are removed afterwards either way.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")  # Also signs the JWTs used below
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import app, db
+from models import User, Device, DeviceCommand
+from services import jt808
+from services.downlink import (CommandDispatcher, create_command, STATUS_ACKNOWLEDGED, STATUS_EXPIRED,
+                               STATUS_FAILED, STATUS_PENDING, STATUS_SENT, STATUS_TIMEOUT)
+from services.protocol808 import ClientSession
+
+
+def create_user_with_devices(device_count):
+    """Create a user with device_count devices, returning (user id, [device ids])"""
+    suffix = uuid.uuid4().hex[:8]
+    with app.app_context():
+        user = User(email=f"downlink-{suffix}@example.com", username=f"downlink-{suffix}")
+        db.session.add(user)
+        db.session.flush()
+        devices = [Device(imei=f"35{uuid.uuid4().int % 10**13:013d}", name=f"Collar {i}",
+                          device_id=f"collar-{suffix}-{i}", user_id=user.id) for i in range(device_count)]
+        db.session.add_all(devices)
+        db.session.commit()
+        return user.id, [device.id for device in devices]
+
+
+def delete_user(user_id):
+    with app.app_context():
+        device_ids = [device.id for device in Device.query.filter_by(user_id=user_id)]
+        DeviceCommand.query.filter(DeviceCommand.device_id.in_(device_ids)).delete(synchronize_session=False)
+        Device.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def queue_command(device_pk, command='set_parameters', arguments=None, ttl=3600):
+    if arguments is None and command == 'set_parameters':
+        arguments = {'parameters': {'report_interval': 10}}
+    with app.app_context():
+        row = create_command(device_pk, command, arguments, ttl=ttl)
+        db.session.add(row)
+        db.session.commit()
+        return row.id
+
+
+def get_command(command_id):
+    with app.app_context():
+        return db.session.get(DeviceCommand, command_id)
+
+
+def age_command(command_id, **columns):
+    """Move timestamps of a command into the past, e.g. sent_at=31 for 31 seconds ago"""
+    now = datetime.utcnow()
+    with app.app_context():
+        DeviceCommand.query.filter_by(id=command_id).update(
+            {getattr(DeviceCommand, name): now - timedelta(seconds=seconds) for name, seconds in columns.items()},
+            synchronize_session=False)
+        db.session.commit()
+
+
+def connect(dispatcher, device_pk, phone='013800138000'):
+    """Attach a session that records the frames sent to it"""
+    sent = []
+    session = ClientSession(('127.0.0.1', 0), send=sent.append, close=lambda: None)
+    session.client_id = phone
+    dispatcher.attach(session, device_pk)
+    return session, sent
+
+
+def frames(sent):
+    return [jt808.decode_frame(frame) for frame in sent]
+
+
+def test_only_online_devices_are_claimed():
+    user_id, (online_pk, offline_pk) = create_user_with_devices(2)
+    try:
+        online_command = queue_command(online_pk)
+        offline_command = queue_command(offline_pk, 'location_query')
+        dispatcher = CommandDispatcher(app)
+        session, sent = connect(dispatcher, online_pk)
+        dispatcher.dispatch()
+
+        [frame] = frames(sent)
+        assert frame.message_id == jt808.MSG_SET_TERMINAL_PARAMETERS and frame.serial == 1
+        assert frame.phone == '013800138000'
+        assert get_command(online_command).status == STATUS_SENT
+        assert get_command(online_command).serial_number == 1
+        assert get_command(offline_command).status == STATUS_PENDING
+
+        # Delivered as soon as the other device connects
+        _, other_sent = connect(dispatcher, offline_pk, phone='013800138001')
+        dispatcher.dispatch()
+        assert [frame.message_id for frame in frames(other_sent)] == [jt808.MSG_LOCATION_QUERY]
+        assert len(sent) == 1
+    finally:
+        delete_user(user_id)
+
+
+def test_response_completes_matching_command():
+    user_id, (device_pk,) = create_user_with_devices(1)
+    try:
+        first = queue_command(device_pk)
+        second = queue_command(device_pk, 'location_query')
+        dispatcher = CommandDispatcher(app)
+        session, sent = connect(dispatcher, device_pk)
+        dispatcher.dispatch()
+        set_frame, query_frame = frames(sent)
+
+        # Wrong serial or message ID does not match
+        assert not dispatcher.on_response(session, 99, jt808.MSG_SET_TERMINAL_PARAMETERS)
+        assert not dispatcher.on_response(session, set_frame.serial, jt808.MSG_LOCATION_QUERY)
+        assert dispatcher.on_response(session, set_frame.serial, jt808.MSG_SET_TERMINAL_PARAMETERS, 0)
+        assert dispatcher.on_response(session, query_frame.serial, jt808.MSG_LOCATION_QUERY, 1)
+        # Answered once only
+        assert not dispatcher.on_response(session, set_frame.serial, jt808.MSG_SET_TERMINAL_PARAMETERS, 0)
+        dispatcher.dispatch()
+
+        assert get_command(first).status == STATUS_ACKNOWLEDGED
+        assert get_command(second).status == STATUS_FAILED and get_command(second).result == 1
+        assert dispatcher.get_stats()['in_flight'] == 0
+    finally:
+        delete_user(user_id)
+
+
+def test_response_survives_failed_commit(monkeypatch):
+    user_id, (device_pk,) = create_user_with_devices(1)
+    try:
+        command_id = queue_command(device_pk)
+        dispatcher = CommandDispatcher(app)
+        session, sent = connect(dispatcher, device_pk)
+        dispatcher.dispatch()
+        [frame] = frames(sent)
+        assert dispatcher.on_response(session, frame.serial, jt808.MSG_SET_TERMINAL_PARAMETERS, 0)
+
+        def fail_commit():
+            raise SQLAlchemyError("database unavailable")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(db.session, 'commit', fail_commit)
+            dispatcher.dispatch()
+        assert get_command(command_id).status == STATUS_SENT
+        assert dispatcher.metrics['acknowledged'] == 0
+
+        # Saved by the next pass once the database is back
+        dispatcher.dispatch()
+        assert get_command(command_id).status == STATUS_ACKNOWLEDGED
+        assert dispatcher.metrics['acknowledged'] == 1
+    finally:
+        delete_user(user_id)
+
+
+def test_unanswered_command_is_resent_then_times_out():
+    user_id, (device_pk,) = create_user_with_devices(1)
+    try:
+        command_id = queue_command(device_pk)
+        dispatcher = CommandDispatcher(app, ack_timeout=30, max_attempts=2)
+        session, sent = connect(dispatcher, device_pk)
+        dispatcher.dispatch()
+        dispatcher.dispatch()  # Not due again yet
+        assert len(sent) == 1
+
+        age_command(command_id, sent_at=31)
+        dispatcher.dispatch()
+        first, second = frames(sent)
+        assert second.serial == first.serial + 1
+        assert get_command(command_id).attempts == 2
+        # Only the latest frame completes the command
+        assert not dispatcher.on_response(session, first.serial, jt808.MSG_SET_TERMINAL_PARAMETERS)
+
+        # The second attempt waits twice as long
+        age_command(command_id, sent_at=31)
+        dispatcher.dispatch()
+        assert len(sent) == 2
+        age_command(command_id, sent_at=61)
+        dispatcher.dispatch()
+        assert len(sent) == 2
+        assert get_command(command_id).status == STATUS_TIMEOUT
+        assert dispatcher.get_stats()['in_flight'] == 0
+        assert dispatcher.metrics['sent'] == 1 and dispatcher.metrics['resent'] == 1
+    finally:
+        delete_user(user_id)
+
+
+def test_expired_commands_are_dropped():
+    user_id, (online_pk, offline_pk) = create_user_with_devices(2)
+    try:
+        sent_command = queue_command(online_pk)
+        pending_command = queue_command(offline_pk)
+        dispatcher = CommandDispatcher(app, ack_timeout=3600)
+        session, sent = connect(dispatcher, online_pk)
+        dispatcher.dispatch()
+        assert dispatcher.get_stats()['in_flight'] == 1
+
+        age_command(sent_command, expires_at=1)
+        age_command(pending_command, expires_at=1)
+        dispatcher.dispatch()
+        assert get_command(sent_command).status == STATUS_TIMEOUT
+        assert get_command(pending_command).status == STATUS_EXPIRED
+        assert dispatcher.get_stats()['in_flight'] == 0
+        assert not dispatcher.on_response(session, frames(sent)[0].serial, jt808.MSG_SET_TERMINAL_PARAMETERS)
+    finally:
+        delete_user(user_id)
+
+
+def test_command_endpoints():
+    user_id, (device_pk,) = create_user_with_devices(1)
+    other_user_id, (other_device_pk,) = create_user_with_devices(1)
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+    client = app.test_client()
+    url = f"/api/devices/{device_pk}/commands"
+    try:
+        response = client.post(url, json={"command": "set_parameters", "parameters": {"report_interval": 10},
+                                          "ttl": 600}, headers=headers)
+        assert response.status_code == 202, response.get_data(as_text=True)
+        created = response.get_json()
+        assert created['status'] == STATUS_PENDING and created['message_id'] == jt808.MSG_SET_TERMINAL_PARAMETERS
+        assert created['arguments'] == {'parameters': {'report_interval': 10}}
+
+        for body in ({"command": "location_query", "ttl": 0},
+                     {"command": "location_query", "ttl": -5},
+                     {"command": "location_query", "ttl": "soon"},
+                     {"command": "reboot"},
+                     {"command": "set_parameters", "parameters": {}},
+                     {}):
+            assert client.post(url, json=body, headers=headers).status_code == 400, body
+        assert client.post(f"/api/devices/{other_device_pk}/commands", json={"command": "location_query"},
+                           headers=headers).status_code == 404
+
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert [command['id'] for command in response.get_json()] == [created['id']]
+        assert client.get(f"{url}?status={STATUS_SENT}", headers=headers).get_json() == []
+
+        response = client.get(f"{url}/{created['id']}", headers=headers)
+        assert response.status_code == 200 and response.get_json()['id'] == created['id']
+        assert client.get(f"{url}/{created['id'] + 1000}", headers=headers).status_code == 404
+        assert client.get(f"/api/devices/{other_device_pk}/commands", headers=headers).status_code == 404
+    finally:
+        delete_user(user_id)
+        delete_user(other_user_id)
+
+
+if __name__ == "__main__":
+    test_only_online_devices_are_claimed()
+    test_response_completes_matching_command()
+    test_unanswered_command_is_resent_then_times_out()
+    test_expired_commands_are_dropped()
+    test_command_endpoints()
+    print("Downlink command tests passed")
@@ -0,0 +1,104 @@
+"""
+pytest-benchmark suite for the shared JT808 codec (services/jt808)
+
+Run with:
+    pip install pytest-benchmark
+    python -m pytest test_jt808_benchmark.py --benchmark-only
+    python -m pytest test_jt808_benchmark.py --benchmark-autosave
+    python -m pytest test_jt808_benchmark.py --benchmark-compare
+
+Every benchmark checks its result first, so a faster but wrong codec fails
+instead of showing up as an improvement. Skipped when pytest-benchmark is not
+installed.
+"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from services import jt808
+from services.jt808 import codec
+
+PHONE = '013800138000'
+TIMESTAMP = datetime(2026, 10, 16, 12, 30, 45)
+LOCATION = dict(
+    latitude=37.774929, longitude=-122.419416, altitude=12, speed=3.4, heading=270, timestamp=TIMESTAMP,
+    mileage=1234.5, battery_level=85, activity_level=60, health_flags=0x0001, temperature=38.5
+)
+LOCATION_BODY = jt808.encode_location(**LOCATION)
+LOCATION_FRAME = jt808.encode_frame(jt808.MSG_LOCATION_REPORT, PHONE, 1, LOCATION_BODY)
+# Serial 0x7e7d and a body full of 0x7e/0x7d, so every escape path is taken
+ESCAPED_FRAME = jt808.encode_frame(jt808.MSG_LOCATION_REPORT, PHONE, 0x7e7d, LOCATION_BODY + b'\x7e\x7d' * 40)
+
+
+def test_decode_location_frame(benchmark):
+    frame = benchmark(jt808.decode_frame, LOCATION_FRAME)
+    assert frame.message_id == jt808.MSG_LOCATION_REPORT and frame.phone == PHONE
+
+
+def test_decode_escaped_frame(benchmark):
+    frame = benchmark(jt808.decode_frame, ESCAPED_FRAME)
+    assert frame.serial == 0x7e7d
+
+
+def test_decode_location_body(benchmark):
+    location = benchmark(jt808.decode_location, memoryview(LOCATION_BODY))
+    assert location['longitude'] == -122.419416 and location['additional_data']['temperature'] == 38.5
+
+
+def test_decode_location_report(benchmark):
+    def decode(data):
+        return jt808.decode_location(jt808.decode_frame(data).body)
+
+    location = benchmark(decode, LOCATION_FRAME)
+    assert location['timestamp'] == TIMESTAMP
+
+
+def test_decode_location_for_storage(benchmark):
+    # The fields the location writer stores; the additional items are never decoded
+    def decode(body):
+        location = jt808.decode_location(body)
+        return location.latitude, location.longitude, location.timestamp, location.battery_level, location.has_pet_data
+
+    assert benchmark(decode, memoryview(LOCATION_BODY)) == (37.774929, -122.419416, TIMESTAMP, 85, True)
+
+
+def test_bcd_to_datetime(benchmark):
+    raw = jt808.datetime_to_bcd(TIMESTAMP)
+    assert benchmark(jt808.bcd_to_datetime, raw) == TIMESTAMP
+
+
+def test_bcd_to_datetime_uncached(benchmark):
+    # A timestamp not seen before: the BCD table lookups without the cache
+    raw = jt808.datetime_to_bcd(TIMESTAMP)
+    assert benchmark(codec._decode_bcd_time.__wrapped__, raw) == TIMESTAMP
+
+
+def test_bcd_to_epoch(benchmark):
+    raw = jt808.datetime_to_bcd(TIMESTAMP)
+    assert benchmark(jt808.bcd_to_epoch, raw) == 1792153845
+
+
+def test_encode_location_frame(benchmark):
+    def encode():
+        return jt808.encode_frame(jt808.MSG_LOCATION_REPORT, PHONE, 1, jt808.encode_location(**LOCATION))
+
+    assert benchmark(encode) == LOCATION_FRAME
+
+
+def test_encode_general_response(benchmark):
+    def encode():
+        return jt808.encode_frame(jt808.MSG_PLATFORM_GENERAL_RESPONSE, PHONE, 1,
+                                  jt808.encode_general_response(1, jt808.MSG_LOCATION_REPORT, 0))
+
+    frame = jt808.decode_frame(benchmark(encode))
+    assert jt808.decode_general_response(frame.body)['reply_id'] == jt808.MSG_LOCATION_REPORT
+
+
+def test_response_builder_general_response(benchmark):
+    # The per-session builder used for ACKs; must match the encoder above byte for byte
+    responses = jt808.ResponseBuilder(PHONE)
+    expected = jt808.encode_frame(jt808.MSG_PLATFORM_GENERAL_RESPONSE, PHONE, 1,
+                                  jt808.encode_general_response(1, jt808.MSG_LOCATION_REPORT, 0))
+    assert benchmark(responses.general_response, 1, jt808.MSG_LOCATION_REPORT) == expected
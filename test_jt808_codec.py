@@ -0,0 +1,265 @@
+"""
+Tests for the shared JT808 codec in services/jt808
+
+The protocol server, the MQTT adapter and the simulators all encode and decode
+through this codec, so these round trips are what keeps them in agreement.
+Frames in the wire formats older simulator and firmware builds produced
+(signed coordinates, 0xE0-0xE3 pet extensions, hand-built frames) are decoded
+here too.
+"""
+import random
+import struct
+from datetime import datetime
+
+import pytest
+
+from services import jt808
+
+TIMESTAMP = datetime(2026, 10, 16, 12, 30, 45)
+
+
+def legacy_frame(msg_id, phone_bcd, serial, body):
+    """Frame built the way the simulators did before they used the codec"""
+    payload = struct.pack('>HH6sH', msg_id, len(body), phone_bcd, serial) + body
+    checksum = 0
+    for b in payload:
+        checksum ^= b
+    escaped = bytearray()
+    for b in payload + bytes([checksum]):
+        if b == 0x7e:
+            escaped.extend([0x7d, 0x02])
+        elif b == 0x7d:
+            escaped.extend([0x7d, 0x01])
+        else:
+            escaped.append(b)
+    return b'\x7e' + bytes(escaped) + b'\x7e'
+
+
+def test_frame_round_trip():
+    rng = random.Random(808)
+    for _ in range(2000):
+        phone = ''.join(rng.choice('0123456789') for _ in range(12))
+        serial = rng.randint(0, 0xFFFF)
+        body = bytes(rng.choice((0x7d, 0x7e, rng.randint(0, 255))) for _ in range(rng.randint(0, 300)))
+        frame = jt808.decode_frame(jt808.encode_frame(0x0200, phone, serial, body))
+        assert (frame.message_id, frame.phone, frame.serial, bytes(frame.body)) == (0x0200, phone, serial, body)
+        assert frame.body_length == len(body)
+        assert not frame.is_subpackage
+
+
+def test_frame_matches_legacy_encoder():
+    body = b'\x7e\x7d\x01\x02' + bytes(range(40))
+    assert jt808.encode_frame(0x0102, '13800138000', 0x7e7d, body) == \
+        legacy_frame(0x0102, bytes.fromhex('013800138000'), 0x7e7d, body)
+
+
+def test_subpackage_frame():
+    frame = jt808.decode_frame(jt808.encode_frame(0x0200, '123456', 7, b'abc', total_packages=3, package_number=2))
+    assert frame.is_subpackage
+    assert (frame.total_packages, frame.package_number, bytes(frame.body)) == (3, 2, b'abc')
+
+
+def test_frame_errors():
+    frame = bytearray(jt808.encode_frame(0x0002, '123456', 1))
+    frame[-2] ^= 0xff
+    with pytest.raises(jt808.JT808Error):
+        jt808.decode_frame(bytes(frame))
+    with pytest.raises(jt808.JT808Error):
+        jt808.decode_frame(b'\x7e\x00\x02\x7e')
+    with pytest.raises(jt808.JT808Error):
+        jt808.encode_frame(0x0200, '123456', 1, bytes(1024))
+    with pytest.raises(jt808.JT808Error):
+        jt808.encode_phone('not-a-phone')
+
+
+def test_phone_is_bcd():
+    assert jt808.encode_phone('13800138000') == bytes.fromhex('013800138000')
+    assert jt808.encode_phone('86123456789012345') == bytes.fromhex('456789012345')
+    assert jt808.decode_phone(bytes.fromhex('013800138000')) == '013800138000'
+
+
+def test_location_round_trip():
+    body = jt808.encode_location(
+        -33.868820, -151.209290, altitude=58, speed=12.3, heading=359, timestamp=TIMESTAMP,
+        mileage=1234.5, battery_level=85, activity_level=60, health_flags=0x0005, temperature=-2.5
+    )
+    location = jt808.decode_location(body)
+    assert location['valid']
+    assert location['latitude'] == -33.86882
+    assert location['longitude'] == -151.20929
+    assert (location['altitude'], location['speed'], location['heading']) == (58, 12.3, 359)
+    assert location['timestamp'] == TIMESTAMP
+    assert location['battery_level'] == 85
+    extra = location['additional_data']
+    assert extra['status'] & 0x0C == 0x0C  # South and west bits
+    assert extra['mileage'] == 1234.5
+    assert (extra['activity_level'], extra['health_flags'], extra['temperature']) == (60, 5, -2.5)
+
+
+def test_location_includes_alarm_word():
+    body = jt808.encode_location(37.7749, 122.4194, alarm=0x00000001, timestamp=TIMESTAMP)
+    location = jt808.decode_location(body)
+    assert location['additional_data']['alarm'] == 1
+    assert location['latitude'] == 37.7749
+
+
+def test_location_signed_coordinates_without_status_bits():
+    # Older collars send negative coordinates instead of setting the south/west bits
+    body = struct.pack('>IIiiHHH6s', 0, 0x02, -33868820, -151209290, 0, 0, 0, jt808.datetime_to_bcd(TIMESTAMP))
+    location = jt808.decode_location(body)
+    assert (location['latitude'], location['longitude']) == (-33.86882, -151.20929)
+
+
+def test_location_legacy_pet_extension_ids():
+    body = struct.pack('>IIiiHHH6s', 0, 0x02, 1, 1, 0, 0, 0, jt808.datetime_to_bcd(TIMESTAMP))
+    body += bytes([0xE0, 1, 77, 0xE1, 1, 42]) + bytes([0xE2, 2]) + struct.pack('>H', 3)
+    body += bytes([0xE3, 2]) + struct.pack('>h', 385)
+    location = jt808.decode_location(body)
+    assert location['battery_level'] == 77
+    extra = location['additional_data']
+    assert (extra['activity_level'], extra['health_flags'], extra['temperature']) == (42, 3, 38.5)
+
+
+def test_location_skips_unknown_and_truncated_items():
+    body = jt808.encode_location(1.0, 2.0, timestamp=TIMESTAMP) + bytes([0x99, 2, 0, 0, 0x30, 2, 1, 2, 0x31, 5, 1])
+    extra = jt808.decode_location(body)['additional_data']
+    assert set(extra) == {'alarm', 'status'}
+    with pytest.raises(jt808.JT808Error):
+        jt808.decode_location(body[:27])
+
+
+def test_location_report_view():
+    body = jt808.encode_location(1.0, 2.0, speed=5, timestamp=TIMESTAMP, battery_level=70)
+    location = jt808.decode_location(memoryview(body))
+    assert isinstance(location, jt808.LocationReport)
+    assert (location.latitude, location.longitude, location.speed, location.timestamp) == (1.0, 2.0, 5.0, TIMESTAMP)
+    assert location.battery_level == 70 and not location.has_pet_data
+    assert location.get('accuracy') is None and 'accuracy' not in location
+    assert dict(location) == {
+        'valid': True, 'latitude': 1.0, 'longitude': 2.0, 'altitude': 0, 'speed': 5.0, 'heading': 0,
+        'timestamp': TIMESTAMP, 'battery_level': 70,
+        'additional_data': {'alarm': 0, 'status': jt808.codec.STATUS_POSITIONED, 'battery_level': 70},
+    }
+
+    location = jt808.decode_location(jt808.encode_location(1.0, 2.0, timestamp=TIMESTAMP, temperature=37.0))
+    assert location.has_pet_data and location.battery_level is None
+    assert 'battery_level' not in location and len(location) == len(jt808.LocationReport.KEYS)
+    with pytest.raises(KeyError):
+        location['battery_level']
+
+
+def test_bcd_time_fallbacks():
+    assert jt808.bcd_to_datetime(bytes.fromhex('261399250000')) == datetime(2026, 1, 1, 0, 0, 0)
+    before = datetime.utcnow()
+    assert jt808.bcd_to_datetime(b'\xff' * 6) >= before
+    assert jt808.bcd_to_datetime(bytes.fromhex('260231120000')) >= before
+    # The current time fallback is not cached
+    assert jt808.bcd_to_datetime(b'\xff' * 6) is not jt808.bcd_to_datetime(b'\xff' * 6)
+
+
+def test_bcd_time_decoding():
+    raw = jt808.datetime_to_bcd(TIMESTAMP)
+    assert jt808.bcd_to_datetime(raw) == jt808.bcd_to_datetime(memoryview(raw)) == TIMESTAMP
+    assert jt808.bcd_to_epoch(raw) == 1792153845
+    for value in (datetime(2000, 1, 1), datetime(2024, 2, 29, 23, 59, 59), datetime(2099, 12, 31, 0, 0, 1)):
+        assert jt808.bcd_to_datetime(jt808.datetime_to_bcd(value)) == value
+
+
+def test_registration_round_trip():
+    body = jt808.encode_registration(11, 1100, 'PETTR', 'PT100', 'SIM1234', 1, 'PET0001')
+    assert len(body) == 37 + 7
+    assert jt808.decode_registration(memoryview(body)) == {
+        'provincial_id': 11, 'city_id': 1100, 'manufacturer_id': 'PETTR', 'terminal_model': 'PT100',
+        'terminal_id': 'SIM1234', 'car_color': 1, 'plate_number': 'PET0001',
+    }
+    with pytest.raises(jt808.JT808Error):
+        jt808.decode_registration(body[:36])
+
+
+def test_responses_round_trip():
+    frame = jt808.decode_frame(jt808.encode_frame(0x8001, '123456', 9, jt808.encode_general_response(9, 0x0200, 0)))
+    assert jt808.decode_general_response(frame.body) == {'response_serial_number': 9, 'reply_id': 0x0200, 'result': 0}
+
+    frame = jt808.decode_frame(jt808.encode_frame(0x8100, '123456', 10, jt808.encode_registration_response(10, 0, 'AUTH')))
+    assert jt808.decode_registration_response(frame.body) == {
+        'response_serial_number': 10, 'result': 0, 'authentication_code': 'AUTH'
+    }
+    # The auth code is only sent when registration succeeded
+    assert jt808.encode_registration_response(10, 1, 'AUTH') == struct.pack('>HB', 10, 1)
+
+
+def test_response_builder_matches_encoder():
+    rng = random.Random(8001)
+    for phone in ('013800138000', '123456', '7'):
+        responses = jt808.ResponseBuilder(phone)
+        # 0x7e/0x7d in the serial, reply ID or check code must still be escaped
+        for serial in [0x007e, 0x7d7e, 0xffff] + [rng.randint(0, 0xFFFF) for _ in range(500)]:
+            reply_id = rng.choice((0x0200, 0x0002, 0x7e7d, rng.randint(0, 0xFFFF)))
+            result = rng.randint(0, 4)
+            assert responses.general_response(serial, reply_id, result) == jt808.encode_frame(
+                0x8001, phone, serial, jt808.encode_general_response(serial, reply_id, result))
+        assert responses.registration_response(10, 0, 'AUTH') == jt808.encode_frame(
+            0x8100, phone, 10, jt808.encode_registration_response(10, 0, 'AUTH'))
+
+
+def test_parameters():
+    body = bytes([2]) + struct.pack('>IB', 0x0001, 4) + struct.pack('>I', 30)
+    body += struct.pack('>IB', 0x0013, 9) + b'127.0.0.1'
+    assert jt808.decode_parameters(body) == {'num_params': 2, 'params': [
+        {'param_id': 0x0001, 'param_value': 30},
+        {'param_id': 0x0013, 'param_value': '127.0.0.1'},
+    ]}
+
+
+def test_parameters_round_trip():
+    body = jt808.encode_parameters([(jt808.PARAM_REPORT_INTERVAL, 10), (0x0013, 'example.org'), (0xF140, 2),
+                                    (0x1234, b'\x01\x02')])
+    assert body[:7] == bytes([4]) + struct.pack('>IB', 0x0029, 4) + b'\x00'
+    assert jt808.decode_parameters(body)['params'] == [
+        {'param_id': 0x0029, 'param_value': 10},
+        {'param_id': 0x0013, 'param_value': 'example.org'},
+        {'param_id': 0xF140, 'param_value': 2},
+        {'param_id': 0x1234, 'param_value': '0102'},
+    ]
+    # Report intervals sent as a single byte by some terminals still decode as numbers
+    assert jt808.decode_parameters(bytes([1]) + struct.pack('>IBB', 0x0029, 1, 10))['params'] == [
+        {'param_id': 0x0029, 'param_value': 10}]
+    for bad in ([], [(0x1234, 5)], [(0x0029, -1)], [(0xF140, 300)]):
+        try:
+            jt808.encode_parameters(bad)
+        except jt808.JT808Error:
+            pass
+        else:
+            raise AssertionError(f"encode_parameters({bad}) should fail")
+
+
+def test_location_query_response():
+    query = jt808.decode_frame(jt808.encode_frame(jt808.MSG_LOCATION_QUERY, '013800138000', 7))
+    assert query.message_id == 0x8201 and len(query.body) == 0
+    decoded = jt808.decode_location_query_response(b'\x00\x07' + jt808.encode_location(22.5, 114.0))
+    assert decoded['response_serial_number'] == 7
+    assert decoded['latitude'] == 22.5 and decoded['longitude'] == 114.0
+    assert jt808.MESSAGE_TYPES[jt808.MSG_LOCATION_QUERY_RESPONSE] == "Location Information Query Response"
+
+
+if __name__ == "__main__":
+    test_frame_round_trip()
+    test_frame_matches_legacy_encoder()
+    test_subpackage_frame()
+    test_frame_errors()
+    test_phone_is_bcd()
+    test_location_round_trip()
+    test_location_includes_alarm_word()
+    test_location_signed_coordinates_without_status_bits()
+    test_location_legacy_pet_extension_ids()
+    test_location_skips_unknown_and_truncated_items()
+    test_location_report_view()
+    test_bcd_time_fallbacks()
+    test_bcd_time_decoding()
+    test_registration_round_trip()
+    test_responses_round_trip()
+    test_response_builder_matches_encoder()
+    test_parameters()
+    test_parameters_round_trip()
+    test_location_query_response()
+    print("JT808 codec tests passed")
@@ -0,0 +1,119 @@
+"""
+Property tests for the JT808 unescape and checksum fast paths in services/framing.py
+
+unescape_jt808() and xor_checksum() replace per-byte Python loops in the
+protocol server and the MQTT adapter. These tests compare them against those
+original loops on many random inputs, biased towards the bytes that matter
+(0x7d, 0x7e, 0x01, 0x02).
+"""
+import random
+
+from services.framing import unescape_jt808, xor_checksum
+
+ITERATIONS = 5000
+INTERESTING_BYTES = (0x7d, 0x7e, 0x01, 0x02, 0x00, 0xff)
+
+
+def reference_unescape(data):
+    """The byte-by-byte unescape loop previously used by JT808Parser.parse_message"""
+    unescaped_data = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] == 0x7d:
+            if i + 1 < len(data):
+                if data[i + 1] == 0x02:
+                    unescaped_data.append(0x7e)
+                    i += 2
+                    continue
+                elif data[i + 1] == 0x01:
+                    unescaped_data.append(0x7d)
+                    i += 2
+                    continue
+            # Handle the case where 0x7d is at the end of the data
+            unescaped_data.append(data[i])
+            i += 1
+        else:
+            unescaped_data.append(data[i])
+            i += 1
+    return bytes(unescaped_data)
+
+
+def reference_checksum(data):
+    checksum = 0
+    for b in data:
+        checksum ^= b
+    return checksum
+
+
+def reference_escape(data):
+    escaped = bytearray()
+    for b in data:
+        if b == 0x7e:
+            escaped.extend([0x7d, 0x02])
+        elif b == 0x7d:
+            escaped.extend([0x7d, 0x01])
+        else:
+            escaped.append(b)
+    return bytes(escaped)
+
+
+def random_bytes(rng, max_size=1100):
+    """Random bytes of random length, with about half the bytes drawn from INTERESTING_BYTES"""
+    size = rng.choice((rng.randint(0, 8), rng.randint(0, 64), rng.randint(0, max_size)))
+    return bytes(
+        rng.choice(INTERESTING_BYTES) if rng.random() < 0.5 else rng.randint(0, 255)
+        for _ in range(size)
+    )
+
+
+def test_unescape_matches_reference():
+    rng = random.Random(808)
+    for _ in range(ITERATIONS):
+        data = random_bytes(rng)
+        assert unescape_jt808(data) == reference_unescape(data), data.hex()
+        assert bytes(unescape_jt808(bytearray(data))) == reference_unescape(data), data.hex()
+
+
+def test_unescape_edge_cases():
+    cases = [b'', b'\x7d', b'\x7d\x7d', b'\x7d\x7d\x02', b'\x7d\x01\x02', b'\x7d\x01\x01',
+             b'\x7d\x02\x7d', b'\x7e\x7d\x02\x7d\x01\x7e', b'\x7d\x03', b'\x7d\x7d\x01\x02']
+    for data in cases:
+        assert unescape_jt808(data) == reference_unescape(data), data.hex()
+
+
+def test_unescape_returns_input_without_escapes():
+    frame = bytes(range(0x7d)) + b'\x7f\x80'
+    assert unescape_jt808(frame) is frame
+
+
+def test_unescape_reverses_escape():
+    rng = random.Random(7)
+    for _ in range(ITERATIONS):
+        payload = random_bytes(rng)
+        assert unescape_jt808(b'\x7e' + reference_escape(payload) + b'\x7e') == b'\x7e' + payload + b'\x7e'
+
+
+def test_checksum_matches_reference():
+    rng = random.Random(2013)
+    for _ in range(ITERATIONS):
+        data = random_bytes(rng, max_size=9000)
+        assert xor_checksum(data) == reference_checksum(data), data.hex()
+
+
+def test_checksum_on_memoryview_slices():
+    rng = random.Random(42)
+    for _ in range(ITERATIONS // 5):
+        data = random_bytes(rng)
+        start = rng.randint(0, len(data))
+        end = rng.randint(start, len(data))
+        assert xor_checksum(memoryview(data)[start:end]) == reference_checksum(data[start:end])
+
+
+if __name__ == "__main__":
+    test_unescape_matches_reference()
+    test_unescape_edge_cases()
+    test_unescape_returns_input_without_escapes()
+    test_unescape_reverses_escape()
+    test_checksum_matches_reference()
+    test_checksum_on_memoryview_slices()
+    print("JT808 unescape and checksum match the reference implementations")
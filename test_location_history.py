@@ -0,0 +1,177 @@
+"""
+Tests for the device location endpoints /api/locations/device/<id>[/latest/]
+
+Uses an in-memory SQLite database unless DATABASE_URL is set; the test user and
+its data are removed afterwards either way.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")  # Also signs the JWT used below
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+from models import User, Device, DeviceLatestLocation, Location
+from routes.locations import decode_cursor, encode_cursor
+from services.location_service import LocationService
+
+
+def create_device_with_history(timestamps):
+    """Create a user with one device that has a fix at each timestamp; returns (user id, device id, headers)"""
+    suffix = uuid.uuid4().hex[:8]
+    with app.app_context():
+        user = User(email=f"history-{suffix}@example.com", username=f"history-{suffix}")
+        db.session.add(user)
+        db.session.flush()
+        device = Device(imei=f"35{uuid.uuid4().int % 10**13:013d}", device_id=f"collar-{suffix}", user_id=user.id)
+        db.session.add(device)
+        db.session.flush()
+        db.session.add_all([Location(device_id=device.id, latitude=37.77, longitude=-122.41, timestamp=timestamp)
+                            for timestamp in timestamps])
+        db.session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(user.id))}"}
+        return user.id, device.id, headers
+
+
+def delete_user(user_id):
+    with app.app_context():
+        device_ids = [device.id for device in Device.query.filter_by(user_id=user_id)]
+        DeviceLatestLocation.query.filter(DeviceLatestLocation.device_id.in_(device_ids)).delete(synchronize_session=False)
+        Location.query.filter(Location.device_id.in_(device_ids)).delete(synchronize_session=False)
+        Device.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def expected_ids(device_id):
+    """All location ids of a device, newest first"""
+    with app.app_context():
+        return [location.id for location in Location.query.filter_by(device_id=device_id)
+                .order_by(Location.timestamp.desc(), Location.id.desc())]
+
+
+def recent(count):
+    now = datetime.utcnow()
+    return [now - timedelta(minutes=minutes) for minutes in range(count)]
+
+
+def test_cursor_round_trip():
+    location = Location(id=42, timestamp=datetime(2026, 3, 1, 12, 30, 15, 250000))
+    cursor = encode_cursor(location)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (location.timestamp, 42)
+
+    for malformed in ('not-a-cursor', '!!!', encode_cursor(location)[:-3], ''):
+        try:
+            decode_cursor(malformed)
+        except ValueError:
+            continue
+        raise AssertionError(f"{malformed!r} was accepted")
+
+
+def test_malformed_cursor_is_rejected():
+    user_id, device_id, headers = create_device_with_history(recent(3))
+    try:
+        response = app.test_client().get(f"/api/locations/device/{device_id}",
+                                          query_string={"cursor": "garbage"}, headers=headers)
+        assert response.status_code == 400
+        assert 'cursor' in response.get_json()['error']
+    finally:
+        delete_user(user_id)
+
+
+def test_pages_with_equal_timestamps():
+    # Runs of identical timestamps straddle the page boundaries, only the id tells them apart
+    now = datetime.utcnow().replace(microsecond=0)
+    timestamps = [now] * 4 + [now - timedelta(minutes=1)] * 3 + [now - timedelta(minutes=2)] * 3
+    user_id, device_id, headers = create_device_with_history(timestamps)
+    client = app.test_client()
+    url = f"/api/locations/device/{device_id}"
+    try:
+        response = client.get(url, query_string={"limit": 3}, headers=headers)
+        seen = [location['id'] for location in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        pages = 1
+        while cursor:
+            response = client.get(url, query_string={"limit": 3, "cursor": cursor}, headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            page = response.get_json()
+            seen.extend(location['id'] for location in page['locations'])
+            assert page['next_cursor'] == response.headers.get('X-Next-Cursor')
+            cursor = page['next_cursor']
+            pages += 1
+
+        assert seen == expected_ids(device_id)
+        assert len(set(seen)) == len(timestamps)
+        assert pages == 4
+        # The last page has no cursor
+        assert 'X-Next-Cursor' not in response.headers
+    finally:
+        delete_user(user_id)
+
+
+def test_export_past_row_limit_continues_with_cursor():
+    user_id, device_id, headers = create_device_with_history(recent(12))
+    client = app.test_client()
+    url = f"/api/locations/device/{device_id}"
+    original_limit = app.config.get('LOCATION_EXPORT_MAX_LIMIT')
+    app.config['LOCATION_EXPORT_MAX_LIMIT'] = 5
+    try:
+        exported, cursors = [], []
+        params = {"stream": "ndjson"}
+        while True:
+            response = client.get(url, query_string=params, headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            exported.extend(row['id'] for row in rows)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            assert len(rows) == 5
+            cursors.append(cursor)
+            params = {"stream": "ndjson", "cursor": cursor}
+        assert len(cursors) == 2
+        assert exported == expected_ids(device_id)
+
+        # An export that ends exactly at the limit is complete
+        app.config['LOCATION_EXPORT_MAX_LIMIT'] = 12
+        response = client.get(url, query_string={"stream": "json"}, headers=headers)
+        assert len(response.get_json()) == 12
+        assert 'X-Next-Cursor' not in response.headers
+    finally:
+        app.config['LOCATION_EXPORT_MAX_LIMIT'] = original_limit
+        delete_user(user_id)
+
+
+def test_latest_location_matches_service():
+    user_id, device_id, headers = create_device_with_history(recent(3))
+    url = f"/api/locations/device/{device_id}/latest/"
+    client = app.test_client()
+    try:
+        # No maintained row yet: the newest fix from the history
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()['location']['id'] == expected_ids(device_id)[0]
+
+        with app.app_context():
+            db.session.add(DeviceLatestLocation(device_id=device_id, latitude=1.5, longitude=2.5,
+                                                timestamp=datetime.utcnow()))
+            db.session.commit()
+            latest = LocationService.get_latest_location(device_id).to_dict()
+        location = client.get(url, headers=headers).get_json()['location']
+        assert location == latest and location['latitude'] == 1.5
+    finally:
+        delete_user(user_id)
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_malformed_cursor_is_rejected()
+    test_pages_with_equal_timestamps()
+    test_export_past_row_limit_continues_with_cursor()
+    test_latest_location_matches_service()
+    print("Location history tests passed")
@@ -0,0 +1,152 @@
+"""
+Tests for write-behind persistence in services/location_writer.py
+
+Batches are flushed by calling _collect_batch()/_flush() from the test instead
+of starting the writer thread, so every step is deterministic.
+
+Uses an in-memory SQLite database unless DATABASE_URL is set; the test user and
+its data are removed afterwards either way.
+"""
+import os
+import time
+import uuid
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")
+
+from app import app, db
+from models import User, Device, DeviceLatestLocation, Location
+from services.location_writer import LocationWriter, build_location_row
+
+
+def create_device():
+    suffix = uuid.uuid4().hex[:8]
+    with app.app_context():
+        user = User(email=f"writer-{suffix}@example.com", username=f"writer-{suffix}")
+        db.session.add(user)
+        db.session.flush()
+        device = Device(imei=f"35{uuid.uuid4().int % 10**13:013d}", device_id=f"collar-{suffix}", user_id=user.id)
+        db.session.add(device)
+        db.session.commit()
+        return user.id, device.id
+
+
+def delete_user(user_id):
+    with app.app_context():
+        device_ids = [device.id for device in Device.query.filter_by(user_id=user_id)]
+        DeviceLatestLocation.query.filter(DeviceLatestLocation.device_id.in_(device_ids)).delete(synchronize_session=False)
+        Location.query.filter(Location.device_id.in_(device_ids)).delete(synchronize_session=False)
+        Device.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def count_locations(device_pk):
+    with app.app_context():
+        try:
+            return Location.query.filter_by(device_id=device_pk).count()
+        finally:
+            db.session.remove()
+
+
+def fix(device_pk, latitude=37.77):
+    return build_location_row(device_pk, {'latitude': latitude, 'longitude': -122.41})
+
+
+def flush(writer):
+    writer._flush(writer._collect_batch())
+
+
+def test_tickets_resolve_after_commit():
+    user_id, device_pk = create_device()
+    try:
+        writer = LocationWriter(app, flush_interval_ms=10)
+        seen_on_commit = []
+        tickets = [writer.submit(fix(device_pk, latitude), {'id': device_pk, 'last_ping': datetime.utcnow()})
+                   for latitude in (37.770, 37.771, 37.772)]
+        for ticket in tickets:
+            assert not ticket.done and not ticket.rejected
+            # The rows must already be visible to other sessions when the callback runs
+            ticket.add_done_callback(lambda ok: seen_on_commit.append((ok, count_locations(device_pk))))
+        assert count_locations(device_pk) == 0
+
+        flush(writer)
+        assert all(ticket.done and ticket.ok for ticket in tickets)
+        assert seen_on_commit == [(True, 3)] * 3
+        with app.app_context():
+            assert db.session.get(DeviceLatestLocation, device_pk).latitude == 37.772
+            assert db.session.get(Device, device_pk).last_ping is not None
+        assert writer.get_metrics()['rows_written'] == 3
+
+        # A callback added after completion runs straight away
+        late = []
+        tickets[0].add_done_callback(late.append)
+        assert late == [True]
+    finally:
+        delete_user(user_id)
+
+
+def test_failed_row_resolves_false_and_keeps_the_rest():
+    user_id, device_pk = create_device()
+    try:
+        writer = LocationWriter(app, flush_interval_ms=10)
+        bad_row = dict(fix(device_pk), longitude=None)  # NOT NULL violation fails the whole batch
+        tickets = [writer.submit(fix(device_pk)), writer.submit(bad_row), writer.submit(fix(device_pk))]
+
+        flush(writer)
+        assert [ticket.ok for ticket in tickets] == [True, False, True]
+        assert all(ticket.done for ticket in tickets)
+        assert count_locations(device_pk) == 2
+        metrics = writer.get_metrics()
+        assert metrics['failed_flushes'] == 1 and metrics['rows_failed'] == 1
+    finally:
+        delete_user(user_id)
+
+
+def test_request_flush_ends_the_batch():
+    writer = LocationWriter(app, flush_interval_ms=10000)
+    writer.submit(fix(1))
+    writer.submit(fix(1))
+    writer.request_flush()
+    writer.request_flush()  # Already requested, no second marker
+
+    started = time.monotonic()
+    assert len(writer._collect_batch()) == 2
+    assert time.monotonic() - started < 1
+    assert writer.queue.empty()
+
+
+def test_full_queue_rejects():
+    writer = LocationWriter(app, max_queue_size=2, enqueue_timeout=0.01)
+    accepted = [writer.submit(fix(1)), writer.submit(fix(1))]
+    rejected = writer.submit(fix(1))
+
+    assert not any(ticket.rejected for ticket in accepted)
+    assert rejected.rejected and rejected.done and not rejected.ok
+    assert writer.get_metrics()['rejected'] == 1
+    assert writer.fill_ratio() == 1.0
+
+
+def test_heartbeats_are_shed_when_queue_fills():
+    writer = LocationWriter(app, max_queue_size=4, enqueue_timeout=0.01)
+    heartbeat = {'id': 1, 'last_ping': datetime.utcnow()}
+    assert not writer.submit(None, heartbeat).done  # Queued while there is room
+    writer.submit(fix(1))
+
+    shed = writer.submit(None, heartbeat)
+    assert shed.done and shed.ok and not shed.rejected
+    # Fixes and device updates that carry more than a heartbeat are still queued
+    assert not writer.submit(None, dict(heartbeat, battery_level=50.0)).done
+    assert not writer.submit(fix(1), heartbeat).done
+    metrics = writer.get_metrics()
+    assert metrics['shed'] == 1 and metrics['queue_depth'] == 4
+
+
+if __name__ == "__main__":
+    test_tickets_resolve_after_commit()
+    test_failed_row_resolves_false_and_keeps_the_rest()
+    test_request_flush_ends_the_batch()
+    test_full_queue_rejects()
+    test_heartbeats_are_shed_when_queue_fills()
+    print("Location writer tests passed")
@@ -0,0 +1,175 @@
+"""
+Tests for broker acknowledgement in services/mqtt_bridge.py
+
+A QoS 1 message must only be acknowledged once its fix is committed, or when
+it can never be written; everything else is left for the broker to redeliver.
+The broker client and the location writer are replaced with fakes.
+"""
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")
+
+import app  # noqa: F401  (create the app before the services that import it)
+from services.device_cache import DeviceRef, get_device_cache
+from services.location_writer import ACK_ON_COMMIT, WriteTicket
+from services import mqtt_bridge
+from services.mqtt_bridge import MQTTBridge
+
+
+class FakeClient:
+    def __init__(self):
+        self.acked = []
+
+    def ack(self, mid, qos):
+        self.acked.append(mid)
+
+
+class FakeWriter:
+    """Hands out tickets the test resolves by hand"""
+    def __init__(self, rejected=False):
+        self.rejected = rejected
+        self.tickets = []
+        self.writes = []
+        self.flush_requests = 0
+
+    def submit(self, location_row=None, device_update=None):
+        ticket = WriteTicket(threading.Lock(), rejected=self.rejected)
+        self.tickets.append(ticket)
+        self.writes.append((location_row, device_update))
+        return ticket
+
+    def request_flush(self):
+        self.flush_requests += 1
+
+
+def make_bridge(writer, max_inflight=20):
+    get_device_cache().clear()
+    bridge = MQTTBridge(writer, ack_policy=ACK_ON_COMMIT, username='bridge', password='secret',
+                        max_inflight=max_inflight)
+    bridge.client = FakeClient()
+    bridge.manual_ack = True
+    bridge._load_device = lambda device_id: DeviceRef(7, device_id, '860000000000007') if device_id == 'known' else None
+    return bridge
+
+
+def message(mid, device_id='known', payload=None):
+    if payload is None:
+        payload = json.dumps({'latitude': 1.5, 'longitude': 2.5}).encode()
+    return SimpleNamespace(mid=mid, qos=1, topic=f'devices/{device_id}/location', payload=payload)
+
+
+def wait_for_tickets(writer, count):
+    deadline = time.monotonic() + 5
+    while len(writer.tickets) < count:
+        assert time.monotonic() < deadline, "Write was not retried"
+        time.sleep(0.01)
+
+
+def test_ack_only_after_commit():
+    writer = FakeWriter()
+    bridge = make_bridge(writer)
+    bridge._on_message(bridge.client, None, message(1))
+    bridge._on_message(bridge.client, None, message(2))
+    assert bridge.client.acked == []
+    assert bridge._unacked == 2
+
+    writer.tickets[1]._resolve(True)
+    writer.tickets[0]._resolve(True)
+    assert bridge.client.acked == [2, 1]
+    assert bridge._unacked == 0
+
+
+def test_failed_commit_is_retried(monkeypatch):
+    monkeypatch.setattr(mqtt_bridge, 'WRITE_RETRY_DELAY', 0.01)
+    writer = FakeWriter()
+    bridge = make_bridge(writer)
+    bridge._on_message(bridge.client, None, message(1))
+
+    writer.tickets[0]._resolve(False)
+    assert bridge.client.acked == []
+    wait_for_tickets(writer, 2)
+    assert writer.writes[1] == writer.writes[0]  # The same fix is written again
+    writer.tickets[1]._resolve(True)
+    assert bridge.client.acked == [1]
+    assert bridge.metrics['failed'] == 1 and bridge.metrics['retried'] == 1
+    assert bridge._unacked == 0
+
+
+def test_write_dropped_after_failed_attempts(monkeypatch):
+    monkeypatch.setattr(mqtt_bridge, 'WRITE_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(mqtt_bridge, 'MAX_WRITE_ATTEMPTS', 2)
+    writer = FakeWriter()
+    bridge = make_bridge(writer)
+    bridge._on_message(bridge.client, None, message(1))
+
+    writer.tickets[0]._resolve(False)
+    wait_for_tickets(writer, 2)
+    writer.tickets[1]._resolve(False)
+    # Acknowledged so it no longer holds one of the broker's in-flight slots
+    assert bridge.client.acked == [1]
+    assert bridge.metrics['dropped'] == 1 and bridge.metrics['failed'] == 2
+    assert len(writer.tickets) == 2
+
+
+def test_flush_requested_when_inflight_window_fills():
+    writer = FakeWriter()
+    bridge = make_bridge(writer, max_inflight=3)
+    bridge._on_message(bridge.client, None, message(1))
+    bridge._on_message(bridge.client, None, message(2))
+    assert writer.flush_requests == 0
+    bridge._on_message(bridge.client, None, message(3))
+    assert writer.flush_requests == 1
+
+    for ticket in writer.tickets:
+        ticket._resolve(True)
+    bridge._on_message(bridge.client, None, message(4))
+    assert writer.flush_requests == 1
+
+
+def test_rejected_write_is_not_acked():
+    bridge = make_bridge(FakeWriter(rejected=True))
+    bridge._on_message(bridge.client, None, message(3))
+    assert bridge.client.acked == []
+    assert bridge.metrics['rejected'] == 1
+
+
+def test_handling_error_is_not_acked():
+    bridge = make_bridge(FakeWriter())
+
+    def unreachable(device_id):
+        raise RuntimeError("database unreachable")
+
+    bridge._load_device = unreachable
+    bridge._on_message(bridge.client, None, message(4))
+    assert bridge.client.acked == []
+    assert bridge.metrics['failed'] == 1
+
+
+def test_unwritable_messages_are_acked():
+    bridge = make_bridge(FakeWriter())
+    bridge._on_message(bridge.client, None, message(5, payload=b'not json'))
+    bridge._on_message(bridge.client, None, message(6, device_id='unknown'))
+    assert bridge.client.acked == [5, 6]
+    assert bridge.metrics['invalid'] == 1 and bridge.metrics['unknown_device'] == 1
+
+
+def test_persistent_session_with_credentials():
+    bridge = MQTTBridge(FakeWriter(), ack_policy=ACK_ON_COMMIT, username='bridge', password='secret')
+    # paho keeps both on private attributes
+    assert bridge.client._clean_session is False
+    assert bridge.client._username == b'bridge'
+
+
+if __name__ == "__main__":
+    test_ack_only_after_commit()
+    test_rejected_write_is_not_acked()
+    test_handling_error_is_not_acked()
+    test_unwritable_messages_are_acked()
+    test_persistent_session_with_credentials()
+    test_flush_requested_when_inflight_window_fills()
+    print("MQTT bridge tests passed")
@@ -0,0 +1,172 @@
+"""
+Tests for the disk spool in services/mqtt_adapter/spool.py
+
+Each test works in its own temporary spool directory; segments are kept small
+so a handful of messages spans several of them.
+"""
+import os
+import pathlib
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services.mqtt_adapter import spool as spool_module
+from services.mqtt_adapter.spool import RECORD_HEADER, MessageSpool
+
+
+def payloads(messages):
+    return [message.payload for message in messages]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_append_read_commit_in_order(tmp_path, use_mmap):
+    spool = MessageSpool(str(tmp_path), segment_bytes=100, use_mmap=use_mmap)
+    for n in range(10):
+        assert spool.append('devices/1/location', f'fix-{n}', qos=1)
+    assert spool.get_stats()['segments'] > 2
+
+    first = spool.read(4)
+    assert payloads(first) == [b'fix-0', b'fix-1', b'fix-2', b'fix-3']
+    assert first[0].topic == 'devices/1/location' and first[0].qos == 1
+    # Reading does not consume
+    assert payloads(spool.read(4)) == payloads(first)
+
+    spool.commit(first[-1].position)
+    rest = spool.read(100)
+    assert payloads(rest) == [f'fix-{n}'.encode() for n in range(4, 10)]
+    spool.commit(rest[-1].position)
+    assert not spool.has_pending()
+    assert spool.read(100) == []
+    spool.close()
+
+
+def test_torn_tail_record_is_skipped(tmp_path):
+    spool = MessageSpool(str(tmp_path))
+    for n in range(3):
+        spool.append('t', f'fix-{n}')
+    path = spool._segment_path(spool._write_seq)
+    spool.close()
+    # Crash in the middle of writing the last record
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 2)
+
+    spool = MessageSpool(str(tmp_path))
+    spool.append('t', 'after-restart')
+    messages = spool.read(100)
+    assert payloads(messages) == [b'fix-0', b'fix-1', b'after-restart']
+    spool.commit(messages[-1].position)
+    assert not spool.has_pending()
+
+
+def test_checkpoint_survives_restart(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=60)
+    for n in range(5):
+        spool.append('t', f'fix-{n}')
+    spool.commit(spool.read(2)[-1].position)
+    spool.close()
+
+    spool = MessageSpool(str(tmp_path), segment_bytes=60)
+    assert payloads(spool.read(100)) == [b'fix-2', b'fix-3', b'fix-4']
+
+
+def test_max_bytes_discards_oldest_segments(tmp_path):
+    record_size = RECORD_HEADER.size + len('t') + len('fix-00')
+    spool = MessageSpool(str(tmp_path), max_bytes=4 * record_size, segment_bytes=2 * record_size)
+    for n in range(10):
+        spool.append('t', f'fix-{n:02d}')
+
+    assert spool.total_bytes <= 4 * record_size
+    assert spool.get_stats()['discarded_bytes'] == 6 * record_size
+    assert payloads(spool.read(100)) == [b'fix-06', b'fix-07', b'fix-08', b'fix-09']
+    # A single message larger than the whole spool is refused
+    assert not spool.append('t', b'x' * (4 * record_size))
+    assert spool.get_stats()['rejected'] == 1
+
+
+def test_commit_after_discard_does_not_move_back(tmp_path):
+    # 100-byte records, 10 per segment, 30 fit in the spool
+    spool = MessageSpool(str(tmp_path), max_bytes=3000, segment_bytes=1000)
+    payload_size = 100 - RECORD_HEADER.size - 1
+    for n in range(10):
+        spool.append('t', f'{n:03d}'.ljust(payload_size, '.'))
+    in_flight = spool.read(5)
+
+    # While the batch is being published the first segment is discarded to make room
+    for n in range(10, 35):
+        spool.append('t', f'{n:03d}'.ljust(payload_size, '.'))
+    assert spool.get_stats()['discarded_bytes'] == 1000
+    spool.commit(in_flight[-1].position)
+
+    remaining = spool.read(100)
+    assert [message.payload[:3] for message in remaining] == [f'{n:03d}'.encode() for n in range(10, 35)]
+    spool.commit(remaining[-1].position)
+    assert not spool.has_pending()
+
+
+def test_max_age_skips_stale_messages(tmp_path, monkeypatch):
+    spool = MessageSpool(str(tmp_path), max_age=60)
+    spool.append('t', 'stale')
+    clock = SimpleNamespace(time=lambda: time.time() + 120, monotonic=time.monotonic, sleep=time.sleep)
+    monkeypatch.setattr(spool_module, 'time', clock)
+    spool.append('t', 'fresh')
+
+    assert payloads(spool.read(100)) == [b'fresh']
+    assert spool.get_stats()['expired'] == 1
+
+
+def test_max_age_discards_old_segments(tmp_path):
+    spool = MessageSpool(str(tmp_path), max_age=60, segment_bytes=1)
+    spool.append('t', 'old')
+    old_path = spool._segment_path(spool._write_seq)
+    stale = time.time() - 120
+    os.utime(old_path, (stale, stale))
+
+    spool.append('t', 'new')  # Rolls to a new segment and seals the old one
+    spool.append('t', 'newer')
+    assert not os.path.exists(old_path)
+    assert payloads(spool.read(100)) == [b'new', b'newer']
+
+
+def test_start_replay_picks_up_message_appended_while_finishing(tmp_path):
+    published = []
+
+    class RacingSpool(MessageSpool):
+        """Appends a message right after the replay thread found the spool empty"""
+        raced = False
+
+        def read(self, max_records=100):
+            messages = super().read(max_records)
+            if not messages and not self.raced:
+                self.raced = True
+                self.append('t', 'late')
+                self.start_replay(publish, lambda: True, rate=0)
+            return messages
+
+    def publish(topic, payload, qos):
+        published.append(payload)
+        return True
+
+    spool = RacingSpool(str(tmp_path))
+    spool.append('t', 'early')
+    spool.start_replay(publish, lambda: True, rate=0)
+    deadline = time.monotonic() + 5
+    while spool._replay_thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert published == [b'early', b'late']
+    assert not spool.has_pending()
+
+
+if __name__ == "__main__":
+    for test in (test_torn_tail_record_is_skipped, test_checkpoint_survives_restart,
+                 test_max_bytes_discards_oldest_segments, test_commit_after_discard_does_not_move_back,
+                 test_max_age_discards_old_segments,
+                 test_start_replay_picks_up_message_appended_while_finishing):
+        with tempfile.TemporaryDirectory() as directory:
+            test(pathlib.Path(directory))
+    for use_mmap in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            test_append_read_commit_in_order(pathlib.Path(directory), use_mmap)
+    print("MQTT spool tests passed")
@@ -0,0 +1,153 @@
+"""
+Tests for the asyncio ingest engine in services/protocol808_async.py
+
+The loopback test runs the server on an ephemeral port and talks to it over a
+real socket; message processing is replaced so nothing is written to the
+database. The flow control test drives a DeviceProtocol with a fake transport.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SESSION_SECRET", "test-secret")
+
+import app  # noqa: F401  (create the app before the services that import it)
+from services import jt808
+from services.downlink import CommandDispatcher
+from services.protocol808_async import MAX_PENDING_CHUNKS, AsyncProtocol808Server, DeviceProtocol
+
+PHONE = '013800138000'
+
+
+def make_server():
+    server = AsyncProtocol808Server(host='127.0.0.1', port=0, command_dispatcher=CommandDispatcher(poll_interval=3600))
+    server.process_message = lambda message: None  # Nothing to persist, ACK straight away
+    return server
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_loopback_acks_in_order_across_split_chunks():
+    server = make_server()
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    wait_for(lambda: server.running)
+    port = server._server.sockets[0].getsockname()[1]
+
+    # Location reports and heartbeats; serial 0x7e7d needs escaping in both directions
+    serials = [1, 2, 0x7e7d, 4, 5]
+    messages = [(jt808.MSG_LOCATION_REPORT, jt808.encode_location(37.77, -122.41, timestamp=datetime(2026, 1, 1)))
+                if serial % 2 else (jt808.MSG_HEARTBEAT, b'') for serial in serials]
+    data = b''.join(jt808.encode_frame(message_id, PHONE, serial, body)
+                    for serial, (message_id, body) in zip(serials, messages))
+    expected = b''.join(jt808.encode_frame(jt808.MSG_PLATFORM_GENERAL_RESPONSE, PHONE, serial,
+                                           jt808.encode_general_response(serial, message_id, 0))
+                        for serial, (message_id, _) in zip(serials, messages))
+
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Chunk boundaries fall inside frames, headers and escape sequences
+            for start in range(0, len(data), 7):
+                sock.sendall(data[start:start + 7])
+                time.sleep(0.002)
+
+            received = b''
+            while len(received) < len(expected):
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                received += chunk
+        assert received == expected
+    finally:
+        server.stop()
+        thread.join(5)
+
+
+class FakeTransport:
+    def __init__(self):
+        self.events = []  # ('pause' | 'resume', chunks still queued)
+        self.written = []
+        self.protocol = None
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 40000)
+
+    def pause_reading(self):
+        self.events.append(('pause', len(self.protocol.pending)))
+
+    def resume_reading(self):
+        self.events.append(('resume', len(self.protocol.pending)))
+
+    def is_closing(self):
+        return False
+
+    def writelines(self, frames):
+        self.written.extend(frames)
+
+    def close(self):
+        pass
+
+
+def test_reading_pauses_at_max_pending_chunks_and_resumes():
+    server = make_server()
+    release = threading.Event()
+    handled = []
+
+    def handle_data(session, data):
+        release.wait(5)
+        handled.append(data)
+        return [b'ack-' + data]
+
+    server.handle_data = handle_data
+    chunks = [b'chunk-%d' % n for n in range(MAX_PENDING_CHUNKS + 3)]
+
+    async def scenario():
+        server.loop = asyncio.get_running_loop()
+        server.executor = ThreadPoolExecutor(max_workers=1)
+        protocol = DeviceProtocol(server)
+        transport = FakeTransport()
+        transport.protocol = protocol
+        protocol.connection_made(transport)
+
+        # The first chunk is being processed, the rest queue up behind it
+        for chunk in chunks[:MAX_PENDING_CHUNKS]:
+            protocol.data_received(chunk)
+        assert transport.events == []
+        protocol.data_received(chunks[MAX_PENDING_CHUNKS])
+        assert transport.events == [('pause', MAX_PENDING_CHUNKS)] and protocol.paused
+        # Data already in flight while paused is still queued, not lost
+        for chunk in chunks[MAX_PENDING_CHUNKS + 1:]:
+            protocol.data_received(chunk)
+
+        release.set()
+        for _ in range(500):
+            if len(transport.written) == len(chunks):
+                break
+            await asyncio.sleep(0.01)
+        server.executor.shutdown()
+        return protocol, transport
+
+    protocol, transport = asyncio.run(scenario())
+    assert handled == chunks
+    assert transport.written == [b'ack-' + chunk for chunk in chunks]
+    # Resumed once the backlog fell below half the limit
+    assert transport.events == [('pause', MAX_PENDING_CHUNKS), ('resume', MAX_PENDING_CHUNKS // 2 - 1)]
+    assert not protocol.paused and not protocol.pending
+
+
+if __name__ == "__main__":
+    test_loopback_acks_in_order_across_split_chunks()
+    test_reading_pauses_at_max_pending_chunks_and_resumes()
+    print("Asyncio protocol engine tests passed")
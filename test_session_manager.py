@@ -0,0 +1,80 @@
+"""
+Tests for the idle session reaper in services/session_manager.py
+
+A fake clock drives the manager, so no test waits for real timeouts.
+"""
+from services.session_manager import SessionManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSession:
+    def __init__(self, name):
+        self.addr = (name, 0)
+        self.client_id = name
+        self.last_activity = None
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+def test_idle_sessions_are_closed_after_heartbeat_multiple():
+    clock = FakeClock()
+    manager = SessionManager(heartbeat_interval=60, idle_heartbeats=3, clock=clock)
+    quiet, chatty = FakeSession('quiet'), FakeSession('chatty')
+    manager.register(quiet)
+    manager.register(chatty)
+
+    for _ in range(5):
+        clock.now += 30
+        manager.touch(chatty)
+        manager.reap()
+    assert not quiet.closed and not chatty.closed
+    assert manager.get_stats() == {'live': 2, 'idle': 1, 'reaped': 0, 'idle_timeout': 180}
+
+    clock.now += 31
+    assert manager.reap() == 149  # chatty was re-armed from its last activity
+    assert quiet.closed == 1 and not chatty.closed
+    assert manager.get_stats() == {'live': 1, 'idle': 0, 'reaped': 1, 'idle_timeout': 180}
+
+    # Never closed twice, even though the session only unregisters once its connection is torn down
+    clock.now += 1000
+    manager.unregister(quiet)
+    manager.reap()
+    assert quiet.closed == 1 and chatty.closed == 1
+
+
+def test_unregistered_sessions_are_not_closed():
+    clock = FakeClock()
+    manager = SessionManager(heartbeat_interval=10, idle_heartbeats=2, clock=clock)
+    session = FakeSession('gone')
+    manager.register(session)
+    manager.unregister(session)
+    clock.now += 100
+    assert manager.reap() is None
+    assert not session.closed and manager.get_stats()['live'] == 0
+
+
+def test_reaping_disabled():
+    clock = FakeClock()
+    manager = SessionManager(heartbeat_interval=60, idle_heartbeats=0, clock=clock)
+    session = FakeSession('kept')
+    manager.register(session)
+    clock.now += 10000
+    manager.reap()
+    assert not session.closed
+    assert manager.get_stats()['idle'] == 1
+
+
+if __name__ == "__main__":
+    test_idle_sessions_are_closed_after_heartbeat_multiple()
+    test_unregistered_sessions_are_not_closed()
+    test_reaping_disabled()
+    print("Session manager tests passed")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+JT808 Decode Benchmark
+
+Measures the per-frame time of JT808Parser.parse_message and of the 0x0200
+(location report) body decoder alone. Pass --baseline-ref to load
+services/protocol808.py from another git revision as well and compare the two,
+e.g. before and after a parser change.
+
+Usage:
+    python tools/benchmark_jt808_decode.py
+    python tools/benchmark_jt808_decode.py --baseline-ref HEAD~1 --iterations 200000
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+import subprocess
+from datetime import datetime
+
+# Add the project root to Python path
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from services import jt808
+
+
+def build_location_frame(phone='013800', serial=1):
+    """Build an escaped 0x0200 frame with the additional fields pet collars send"""
+    body = jt808.encode_location(
+        37.774929, -122.419416, altitude=12, speed=3.4, heading=270,
+        timestamp=datetime(2026, 10, 16, 12, 30, 45),
+        mileage=1234.5, battery_level=85, activity_level=60, health_flags=0x0001, temperature=38.5
+    )
+    return jt808.encode_frame(jt808.MSG_LOCATION_REPORT, phone, serial, body)
+
+
+def load_parser(ref=None):
+    """Import JT808Parser from the working tree, or from services/protocol808.py at a git revision"""
+    if ref is None:
+        from services.protocol808 import JT808Parser
+        return JT808Parser
+
+    source = subprocess.check_output(['git', 'show', f'{ref}:services/protocol808.py'], cwd=ROOT)
+    spec = importlib.util.spec_from_loader(f'protocol808_{ref}', loader=None)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(source, f'protocol808.py@{ref}', 'exec'), module.__dict__)
+    return module.JT808Parser
+
+
+def time_per_call(func, arg, iterations):
+    """Return the mean time per call in microseconds"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def benchmark(label, parser, frame, body, iterations):
+    message = parser.parse_message(frame)
+    assert message and message['location']['latitude'] == 37.774929, f"{label}: frame did not decode"
+
+    # Warm up
+    time_per_call(parser.parse_message, frame, min(1000, iterations))
+
+    parse_us = time_per_call(parser.parse_message, frame, iterations)
+    decode_us = time_per_call(parser._decode_location_information_report, body, iterations)
+    print(f"{label:<24} parse_message {parse_us:8.2f} us/frame   0x0200 body decode {decode_us:8.2f} us")
+    return parse_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JT808 frame decoding')
+    parser.add_argument('--iterations', type=int, default=100000, help='Frames decoded per measurement (default: 100000)')
+    parser.add_argument('--baseline-ref', help='Git revision to compare against (e.g. HEAD~1)')
+    args = parser.parse_args()
+
+    frame = build_location_frame()
+    # The body as the decoder receives it: a memoryview into the unescaped frame
+    body = memoryview(frame)[13:-2]
+
+    print(f"0x0200 frame: {len(frame)} bytes, {args.iterations} iterations\n")
+    current = benchmark('working tree', load_parser(), frame, body, args.iterations)
+    if args.baseline_ref:
+        baseline = benchmark(args.baseline_ref, load_parser(args.baseline_ref), frame, bytes(body), args.iterations)
+        print(f"\nspeedup: parse_message {baseline[0] / current[0]:.2f}x, "
+              f"body decode {baseline[1] / current[1]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
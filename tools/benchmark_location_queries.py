@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Location Query Benchmark
+
+Seeds the location table with synthetic history and shows the query plan and
+latency of the queries run by the location routes with and without the
+composite ix_location_device_id_timestamp index.
+
+The seeded rows belong to a dedicated benchmark user, but seeding millions of
+rows is still heavy: point DATABASE_URL at a scratch database.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/pettracker_bench python tools/benchmark_location_queries.py --rows 10000000
+    python tools/benchmark_location_queries.py --skip-seed   # Re-run against already seeded data
+    python tools/benchmark_location_queries.py --cleanup     # Remove the benchmark user and its data
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('location_benchmark')
+
+BENCHMARK_EMAIL = 'location-benchmark@example.com'
+INDEX_NAME = 'ix_location_device_id_timestamp'
+
+# The routes/locations.py endpoints to benchmark: (label, path, follow X-Next-Cursor).
+# The statements are not copied here; each route is requested once and the
+# location queries it runs are recorded. The benchmark devices have no
+# device_latest_location row, so /latest/ shows the lookup and the history fallback.
+ROUTES = [
+    ('GET /api/locations/device/<id> (and /pet/<id>)', '/api/locations/device/{device_id}', False),
+    ('GET /api/locations/device/<id>?cursor= (next page)', '/api/locations/device/{device_id}', True),
+    ('GET /api/locations/device/<id>/latest/ (and /pet/<id>/latest/)', '/api/locations/device/{device_id}/latest/', False),
+    ('GET /api/locations/recent/', '/api/locations/recent/', False),
+]
+
+# Statements that read the location tables, as opposed to the user and device lookups
+LOCATION_TABLES = re.compile(r'\bFROM "?(location|device_latest_location)"?\b', re.IGNORECASE)
+
+
+def get_benchmark_devices(db, User, Device, device_count):
+    """Create (or reuse) the benchmark user and its devices; returns (user id, [device ids])"""
+    user = User.query.filter_by(email=BENCHMARK_EMAIL).first()
+    if not user:
+        user = User(email=BENCHMARK_EMAIL, username='location-benchmark')
+        db.session.add(user)
+        db.session.flush()
+
+    devices = Device.query.filter_by(user_id=user.id).order_by(Device.id).all()
+    for i in range(len(devices), device_count):
+        device = Device(
+            imei=f"99{user.id:05d}{i:08d}",
+            device_id=f"bench-{user.id}-{i}",
+            name=f"Benchmark device {i}",
+            user_id=user.id
+        )
+        db.session.add(device)
+        devices.append(device)
+    db.session.commit()
+    return user.id, [device.id for device in devices]
+
+
+def seed_locations(db, Location, device_ids, rows, days, chunk_size=50000):
+    """Insert synthetic fixes spread evenly over the devices and the last N days"""
+    from sqlalchemy import insert, text
+
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    if db.engine.dialect.name == 'postgresql':
+        # Let the server generate the rows, much faster than shipping them over the wire
+        db.session.execute(text(
+            "INSERT INTO location (device_id, latitude, longitude, speed, heading, timestamp, battery_level, created_at) "
+            "SELECT (:device_ids)[1 + (n % :device_count)], 37.7 + random() * 0.1, -122.5 + random() * 0.1, "
+            "random() * 5, random() * 360, :now - (random() * :seconds) * interval '1 second', 80, :now "
+            "FROM generate_series(1, :rows) AS n"
+        ), {
+            'device_ids': device_ids,
+            'device_count': len(device_ids),
+            'now': now,
+            'seconds': days * 86400,
+            'rows': rows
+        })
+        db.session.commit()
+    else:
+        inserted = 0
+        while inserted < rows:
+            batch = []
+            for n in range(inserted, min(rows, inserted + chunk_size)):
+                batch.append({
+                    'device_id': device_ids[n % len(device_ids)],
+                    'latitude': 37.7 + random.random() * 0.1,
+                    'longitude': -122.5 + random.random() * 0.1,
+                    'speed': random.random() * 5,
+                    'heading': random.random() * 360,
+                    'timestamp': now - timedelta(seconds=random.random() * days * 86400),
+                    'battery_level': 80.0,
+                    'created_at': now
+                })
+            db.session.execute(insert(Location), batch)
+            db.session.commit()
+            inserted += len(batch)
+            logger.info(f"Inserted {inserted}/{rows} rows")
+
+    logger.info(f"Seeded {rows} locations in {time.perf_counter() - started:.1f}s")
+
+
+def capture_location_queries(db, client, url, **query_string):
+    """
+    Request a route and return the location statements it ran
+    
+    Returns:
+        (response, [(sql, parameters)]) - statements as sent to the driver
+    """
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if LOCATION_TABLES.search(statement):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url, query_string=query_string)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)}")
+    return response, statements
+
+
+def explain(db, sql, params):
+    """Return the query plan for a statement in the current dialect"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    elif dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + sql, params).fetchall()
+    return '\n'.join('    ' + ' | '.join(str(value) for value in row) for row in rows)
+
+
+def time_query(db, sql, params, repeat):
+    """Return the median latency of a statement in milliseconds"""
+    connection = db.session.connection()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        connection.exec_driver_sql(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def run_queries(app, db, user_id, device_ids, hours, repeat, label):
+    """Print the plan and latency of the location queries run by every route"""
+    from flask_jwt_extended import create_access_token
+
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {create_access_token(identity=str(user_id))}"
+    device_id = random.choice(device_ids)
+    next_cursor = None
+
+    print(f"\n===== {label} =====")
+    for route, path, next_page in ROUTES:
+        url = path.format(device_id=device_id)
+        if next_page:
+            if not next_cursor:
+                print(f"\n{route}\n  skipped: the first page was the last one")
+                continue
+            response, statements = capture_location_queries(db, client, url, cursor=next_cursor)
+        else:
+            response, statements = capture_location_queries(db, client, url, hours=hours)
+            next_cursor = next_cursor or response.headers.get('X-Next-Cursor')
+
+        print(f"\n{route}")
+        for sql, params in statements:
+            print(f"  {' '.join(sql.split())}")
+            print(explain(db, sql, params))
+            print(f"  median latency: {time_query(db, sql, params, repeat):.2f} ms")
+
+
+def set_index(db, Location, present):
+    """Create or drop the composite index"""
+    index = next(index for index in Location.__table__.indexes if index.name == INDEX_NAME)
+    index.drop(db.engine, checkfirst=True)
+    if present:
+        index.create(db.engine, checkfirst=True)
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy import text
+        db.session.execute(text("ANALYZE location"))
+        db.session.commit()
+
+
+def cleanup(db, User, Device, Location, DeviceLatestLocation):
+    """Remove the benchmark user, its devices and their locations"""
+    user = User.query.filter_by(email=BENCHMARK_EMAIL).first()
+    if not user:
+        logger.info("No benchmark data found")
+        return
+    device_ids = [device.id for device in Device.query.filter_by(user_id=user.id)]
+    DeviceLatestLocation.query.filter(DeviceLatestLocation.device_id.in_(device_ids)).delete(synchronize_session=False)
+    Location.query.filter(Location.device_id.in_(device_ids)).delete(synchronize_session=False)
+    Device.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    db.session.delete(user)
+    db.session.commit()
+    logger.info(f"Removed benchmark user and {len(device_ids)} devices")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark location history queries')
+    parser.add_argument('--rows', type=int, default=10000000, help='Number of locations to seed (default: 10000000)')
+    parser.add_argument('--devices', type=int, default=1000, help='Number of devices to spread rows over (default: 1000)')
+    parser.add_argument('--days', type=int, default=90, help='Days of history to spread rows over (default: 90)')
+    parser.add_argument('--hours', type=int, default=24, help='History window used by the queries (default: 24)')
+    parser.add_argument('--repeat', type=int, default=20, help='Executions per query for timing (default: 20)')
+    parser.add_argument('--skip-seed', action='store_true', help='Use the existing benchmark data')
+    parser.add_argument('--cleanup', action='store_true', help='Remove benchmark data and exit')
+    args = parser.parse_args()
+
+    from app import app, db
+    from models import User, Device, DeviceLatestLocation, Location
+
+    with app.app_context():
+        if args.cleanup:
+            cleanup(db, User, Device, Location, DeviceLatestLocation)
+            return
+
+        user_id, device_ids = get_benchmark_devices(db, User, Device, args.devices)
+        if not args.skip_seed:
+            seed_locations(db, Location, device_ids, args.rows, args.days)
+
+        set_index(db, Location, present=False)
+        run_queries(app, db, user_id, device_ids, args.hours, args.repeat, f"Without {INDEX_NAME}")
+
+        set_index(db, Location, present=True)
+        run_queries(app, db, user_id, device_ids, args.hours, args.repeat, f"With {INDEX_NAME}")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,10 +26,15 @@ import sys
 import threading
 import signal
 import math
-import struct
+import os
 import binascii
 from datetime import datetime
 
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import jt808
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('device_simulator')
@@ -238,9 +243,9 @@ class JT808Simulator:
     """Simulates a GPS device using the JT/T 808 protocol"""
     
     def __init__(self, device_id, imei, server_host='localhost', server_port=8080):
-        # In JT808, phone_number is used as the device identifier
-        # We'll use the provided device_id as the phone number
-        self.phone_number = device_id.replace('-', '').ljust(11, '0')[:11]  # Ensure it's 11 digits
+        # In JT808, the 12 digit BCD phone number is the device identifier; the
+        # server matches it against the last 12 digits of the registered IMEI
+        self.phone_number = ''.join(c for c in imei if c.isdigit())[-12:].zfill(12)
         self.imei = imei
         self.server_host = server_host
         self.server_port = server_port
@@ -298,44 +303,27 @@ class JT808Simulator:
         plate_color = 0  # No license plate
         plate_number = "PET" + self.phone_number[-4:]  # Pet name/number
         
-        # Pack the body data
-        body = struct.pack(
-            '>HH5s20s7sB',
-            provincial_id,
-            city_id,
-            manufacturer_id.encode().ljust(5, b'\x00'),
-            terminal_model.encode().ljust(20, b'\x00'),
-            terminal_id.encode().ljust(7, b'\x00'),
-            plate_color
-        )
-        
-        # Add plate number if available
-        if plate_number:
-            try:
-                body += plate_number.encode('gbk')
-            except:
-                body += plate_number.encode('ascii')
+        body = jt808.encode_registration(provincial_id, city_id, manufacturer_id, terminal_model,
+                                         terminal_id, plate_color, plate_number)
         
         # Send the message and process response
         response = self._send_jt808_message(msg_id, body)
         
         # Process response - should be a 0x8100 Terminal Registration Response
-        if response and len(response) >= 12:  # Minimum response size
+        if response:
             try:
-                # Extract message ID from the response (should be 0x8100)
-                resp_msg_id = struct.unpack('>H', response[1:3])[0]
+                frame = jt808.decode_frame(response)
                 
-                if resp_msg_id == 0x8100:
+                if frame.message_id == jt808.MSG_TERMINAL_REGISTRATION_RESPONSE:
                     logger.info("Registration successful")
                     
                     # Extract authentication code and save it
-                    resp_body_offset = 13  # 1(start flag) + 12(header)
-                    resp_result = response[resp_body_offset + 2]  # Skip response serial
+                    registration = jt808.decode_registration_response(frame.body)
+                    resp_result = registration['result']
                     
                     if resp_result == 0:  # Success
                         self.authenticated = True
-                        # Extract auth code (variable length ASCII)
-                        auth_code = response[resp_body_offset+3:-2].decode('ascii', errors='ignore').strip('\x00')
+                        auth_code = registration['authentication_code']
                         logger.info(f"Received authentication code: {auth_code}")
                         
                         # Send authentication message with the received code
@@ -343,7 +331,7 @@ class JT808Simulator:
                     else:
                         logger.warning(f"Registration failed with result code: {resp_result}")
                 else:
-                    logger.warning(f"Unexpected response message ID: 0x{resp_msg_id:04X}")
+                    logger.warning(f"Unexpected response message ID: 0x{frame.message_id:04X}")
             except Exception as e:
                 logger.error(f"Error processing registration response: {str(e)}")
                 
@@ -357,23 +345,21 @@ class JT808Simulator:
         response = self._send_jt808_message(msg_id, body)
         
         # Check if response indicates successful authentication
-        if response and len(response) >= 15:  # Minimum size for a general response
+        if response:
             try:
-                resp_msg_id = struct.unpack('>H', response[1:3])[0]
+                frame = jt808.decode_frame(response)
                 
-                if resp_msg_id == 0x8001:  # General Response
-                    resp_body_offset = 13  # 1(start flag) + 12(header)
-                    resp_serial = struct.unpack('>H', response[resp_body_offset:resp_body_offset+2])[0]
-                    resp_msg = struct.unpack('>H', response[resp_body_offset+2:resp_body_offset+4])[0]
-                    resp_result = response[resp_body_offset+4]
+                if frame.message_id == jt808.MSG_PLATFORM_GENERAL_RESPONSE:  # General Response
+                    general = jt808.decode_general_response(frame.body)
+                    resp_result = general['result']
                     
-                    if resp_msg == 0x0102 and resp_result == 0:
+                    if general['reply_id'] == msg_id and resp_result == 0:
                         logger.info("Authentication successful")
                         self.authenticated = True
                     else:
                         logger.warning(f"Authentication failed: result={resp_result}")
                 else:
-                    logger.warning(f"Unexpected response message ID: 0x{resp_msg_id:04X}")
+                    logger.warning(f"Unexpected response message ID: 0x{frame.message_id:04X}")
             except Exception as e:
                 logger.error(f"Error processing authentication response: {str(e)}")
                 
@@ -410,65 +396,15 @@ class JT808Simulator:
         # Message ID for Location Information Report
         msg_id = 0x0200
         
-        # Pack the message body according to JT808 protocol
-        # Alarm (4 bytes) + Status (4 bytes) + Latitude (4 bytes) + Longitude (4 bytes) + 
-        # Altitude (2 bytes) + Speed (2 bytes) + Direction (2 bytes) + 
-        # Time (6 bytes BCD) + Additional data
-        
-        # Alarm: 0 (no alarm)
-        alarm = 0
-        
-        # Status: Bit 1 set (position valid)
-        status = 0x02  # Bit 1 set - position is valid
-        
-        # Convert position to JT808 format (integer, millionths of a degree)
-        lat_int = int(self.latitude * 1000000)
-        lon_int = int(self.longitude * 1000000)
-        
-        # Altitude in meters (integer)
-        alt_int = int(self.altitude)
-        
-        # Speed in 0.1 km/h (integer)
-        speed_int = int(self.speed * 36)  # Convert m/s to 0.1 km/h
-        
-        # Direction in degrees (0-359)
-        dir_int = int(self.heading) % 360
-        
-        # Time as BCD (YYMMDDhhmmss)
-        # Converting each digit to BCD format
-        now = datetime.now()
-        year_bcd = ((now.year - 2000) // 10 << 4) | ((now.year - 2000) % 10)
-        month_bcd = (now.month // 10 << 4) | (now.month % 10)
-        day_bcd = (now.day // 10 << 4) | (now.day % 10)
-        hour_bcd = (now.hour // 10 << 4) | (now.hour % 10)
-        minute_bcd = (now.minute // 10 << 4) | (now.minute % 10)
-        second_bcd = (now.second // 10 << 4) | (now.second % 10)
-        
-        time_bcd = bytes([
-            year_bcd,
-            month_bcd,
-            day_bcd,
-            hour_bcd,
-            minute_bcd,
-            second_bcd
-        ])
-        
-        # Pack the main body
-        body = struct.pack(
-            '>IIiiHHH',
-            alarm,          # Alarm
-            status,         # Status
-            lat_int,        # Latitude
-            lon_int,        # Longitude
-            alt_int,        # Altitude
-            speed_int,      # Speed
-            dir_int         # Direction
-        ) + time_bcd  # Time (BCD)
-        
-        # Add additional data: battery level
-        # ID: 0x30 (custom battery level), Length: 1, Value: battery percent
-        battery_percent = int(self.battery_level)
-        body += bytes([0x30, 1, battery_percent])
+        # Position valid, with the battery level as pet tracking extension 0x30
+        body = jt808.encode_location(
+            self.latitude,
+            self.longitude,
+            altitude=self.altitude,
+            speed=self.speed * 3.6,  # m/s to km/h
+            heading=self.heading,
+            battery_level=self.battery_level
+        )
         
         # Send the message
         response = self._send_jt808_message(msg_id, body)
@@ -483,64 +419,16 @@ class JT808Simulator:
             return None
             
         try:
-            # 1. Prepare the message components
-            msg_body_len = len(body)
-            
-            # 2. Prepare header fields
-            msg_attributes = msg_body_len & 0x1FFF  # Lower 13 bits for length
-            phone_bytes = self.phone_number.encode('ascii')
-            # Ensure phone number is exactly 6 bytes (right padding with zeros)
-            if len(phone_bytes) < 6:
-                phone_bytes = phone_bytes.ljust(6, b'\x00')
-            elif len(phone_bytes) > 6:
-                phone_bytes = phone_bytes[:6]
-                
-            # 3. Get next serial number and increment
+            # Get next serial number and increment
             serial = self.serial_number
             self.serial_number = (self.serial_number + 1) % 65536  # Wrap at 16 bits
             
-            # 4. Pack the header
-            header = struct.pack(
-                '>HH6sH',
-                msg_id,            # Message ID
-                msg_attributes,    # Message attributes
-                phone_bytes,       # Phone number (6 bytes)
-                serial             # Serial number
-            )
-            
-            # 5. Calculate checksum (XOR of all bytes in header and body)
-            checksum = 0
-            for b in header + body:
-                checksum ^= b
-            
-            # 6. Assemble the full message
-            full_msg = bytearray()
-            full_msg.append(0x7e)  # Start flag
-            
-            # 7. Escape special bytes in header and body
-            for b in header + body:
-                if b == 0x7e:
-                    full_msg.extend([0x7d, 0x02])
-                elif b == 0x7d:
-                    full_msg.extend([0x7d, 0x01])
-                else:
-                    full_msg.append(b)
-            
-            # 8. Add checksum (with escaping if needed)
-            if checksum == 0x7e:
-                full_msg.extend([0x7d, 0x02])
-            elif checksum == 0x7d:
-                full_msg.extend([0x7d, 0x01])
-            else:
-                full_msg.append(checksum)
-            
-            # 9. Add end flag
-            full_msg.append(0x7e)
+            full_msg = jt808.encode_frame(msg_id, self.phone_number, serial, body)
             
-            # 10. Send message and receive response
+            # Send message and receive response
             self.sock.sendall(full_msg)
             
-            # 11. Wait for response with a timeout
+            # Wait for response with a timeout
             self.sock.settimeout(5.0)
             try:
                 response = self.sock.recv(1024)
@@ -7,16 +7,19 @@ It connects to a protocol server and sends location messages at regular interval
 """
 
 import argparse
-import binascii
-import datetime
 import logging
+import os
 import random
 import socket
-import struct
 import sys
 import time
 from typing import Any, Dict, Optional, Union
 
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import jt808
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -34,18 +37,7 @@ class JT808DeviceSimulator:
     """
     
     # JT/T 808 Message Types
-    MESSAGE_TYPES = {
-        0x0001: "Terminal General Response",
-        0x8001: "Platform General Response",
-        0x0002: "Heartbeat",
-        0x0100: "Terminal Registration",
-        0x8100: "Terminal Registration Response",
-        0x0003: "Terminal Logout",
-        0x0102: "Terminal Authentication",
-        0x8103: "Set Terminal Parameters",
-        0x0200: "Location Information Report",
-        0x8201: "Location Information Query Response"
-    }
+    MESSAGE_TYPES = jt808.MESSAGE_TYPES
     
     def __init__(self, 
                  server_host: str = "localhost", 
@@ -293,6 +285,11 @@ class JT808DeviceSimulator:
         # Update altitude
         self.altitude = max(0.0, min(100.0, self.altitude + random.uniform(-1.0, 1.0)))
     
+    def _next_serial(self) -> int:
+        """Advance and return the message serial number."""
+        self.seq_num = (self.seq_num + 1) % 0xFFFF
+        return self.seq_num
+    
     def _create_registration_message(self) -> bytes:
         """
         Create a terminal registration message (0x0100).
@@ -300,73 +297,9 @@ class JT808DeviceSimulator:
         Returns:
             bytes: Encoded JT808 message
         """
-        self.seq_num = (self.seq_num + 1) % 0xFFFF
-        
-        # Message ID: 0x0100 (Terminal Registration)
-        msg_id_bytes = struct.pack('>H', 0x0100)
-        
-        # Message body:
-        # - Province ID (2 bytes): 0
-        # - City ID (2 bytes): 0
-        # - Manufacturer ID (5 bytes): ASCII
-        # - Terminal model (20 bytes): ASCII
-        # - Terminal ID (7 bytes): ASCII
-        # - License plate color (1 byte): 0 (no license plate)
-        # - License plate: Empty
-        body = struct.pack('>HH', 0, 0)
-        body += self.manufacturer_id.encode('ascii')
-        body += self.terminal_model.encode('ascii')
-        body += self.terminal_id.encode('ascii').ljust(7, b'\x00')
-        body += struct.pack('B', 0)  # No license plate
-        
-        # Message properties: body length
-        msg_props_bytes = struct.pack('>H', len(body))
-        
-        # Phone number (device ID): convert to BCD
-        phone_bytes = bytearray(6)
-        for i in range(min(len(self.device_id), 12)):
-            if i % 2 == 0:
-                phone_bytes[i // 2] = (int(self.device_id[i]) << 4)
-            else:
-                phone_bytes[i // 2] |= int(self.device_id[i])
-        
-        # Message serial number
-        serial_bytes = struct.pack('>H', self.seq_num)
-        
-        # Calculate checksum (XOR of all header and body bytes)
-        message = msg_id_bytes + msg_props_bytes + phone_bytes + serial_bytes + body
-        checksum = 0
-        for b in message:
-            checksum ^= b
-        
-        # Construct the final message
-        final_message = bytearray()
-        final_message.append(0x7e)  # Start marker
-        
-        # Escape the message bytes
-        for b in message:
-            if b == 0x7e:
-                final_message.append(0x7d)
-                final_message.append(0x02)
-            elif b == 0x7d:
-                final_message.append(0x7d)
-                final_message.append(0x01)
-            else:
-                final_message.append(b)
-        
-        # Append checksum (escaped if needed)
-        if checksum == 0x7e:
-            final_message.append(0x7d)
-            final_message.append(0x02)
-        elif checksum == 0x7d:
-            final_message.append(0x7d)
-            final_message.append(0x01)
-        else:
-            final_message.append(checksum)
-        
-        final_message.append(0x7e)  # End marker
-        
-        return bytes(final_message)
+        # No license plate (color 0, empty plate number)
+        body = jt808.encode_registration(0, 0, self.manufacturer_id, self.terminal_model, self.terminal_id)
+        return jt808.encode_frame(jt808.MSG_TERMINAL_REGISTRATION, self.device_id, self._next_serial(), body)
     
     def _create_authentication_message(self, auth_code: str) -> bytes:
         """
@@ -378,62 +311,9 @@ class JT808DeviceSimulator:
         Returns:
             bytes: Encoded JT808 message
         """
-        self.seq_num = (self.seq_num + 1) % 0xFFFF
-        
-        # Message ID: 0x0102 (Terminal Authentication)
-        msg_id_bytes = struct.pack('>H', 0x0102)
-        
         # Message body is just the authentication code as ASCII
-        body = auth_code.encode('ascii')
-        
-        # Message properties: body length
-        msg_props_bytes = struct.pack('>H', len(body))
-        
-        # Phone number (device ID): convert to BCD
-        phone_bytes = bytearray(6)
-        for i in range(min(len(self.device_id), 12)):
-            if i % 2 == 0:
-                phone_bytes[i // 2] = (int(self.device_id[i]) << 4)
-            else:
-                phone_bytes[i // 2] |= int(self.device_id[i])
-        
-        # Message serial number
-        serial_bytes = struct.pack('>H', self.seq_num)
-        
-        # Calculate checksum (XOR of all header and body bytes)
-        message = msg_id_bytes + msg_props_bytes + phone_bytes + serial_bytes + body
-        checksum = 0
-        for b in message:
-            checksum ^= b
-        
-        # Construct the final message
-        final_message = bytearray()
-        final_message.append(0x7e)  # Start marker
-        
-        # Escape the message bytes
-        for b in message:
-            if b == 0x7e:
-                final_message.append(0x7d)
-                final_message.append(0x02)
-            elif b == 0x7d:
-                final_message.append(0x7d)
-                final_message.append(0x01)
-            else:
-                final_message.append(b)
-        
-        # Append checksum (escaped if needed)
-        if checksum == 0x7e:
-            final_message.append(0x7d)
-            final_message.append(0x02)
-        elif checksum == 0x7d:
-            final_message.append(0x7d)
-            final_message.append(0x01)
-        else:
-            final_message.append(checksum)
-        
-        final_message.append(0x7e)  # End marker
-        
-        return bytes(final_message)
+        return jt808.encode_frame(jt808.MSG_TERMINAL_AUTHENTICATION, self.device_id, self._next_serial(),
+                                  auth_code.encode('ascii'))
     
     def _create_heartbeat_message(self) -> bytes:
         """
@@ -442,191 +322,33 @@ class JT808DeviceSimulator:
         Returns:
             bytes: Encoded JT808 message
         """
-        self.seq_num = (self.seq_num + 1) % 0xFFFF
-        
-        # Message ID: 0x0002 (Heartbeat)
-        msg_id_bytes = struct.pack('>H', 0x0002)
-        
         # Message body is empty for heartbeat
-        body = b''
-        
-        # Message properties: body length
-        msg_props_bytes = struct.pack('>H', len(body))
-        
-        # Phone number (device ID): convert to BCD
-        phone_bytes = bytearray(6)
-        for i in range(min(len(self.device_id), 12)):
-            if i % 2 == 0:
-                phone_bytes[i // 2] = (int(self.device_id[i]) << 4)
-            else:
-                phone_bytes[i // 2] |= int(self.device_id[i])
-        
-        # Message serial number
-        serial_bytes = struct.pack('>H', self.seq_num)
-        
-        # Calculate checksum (XOR of all header and body bytes)
-        message = msg_id_bytes + msg_props_bytes + phone_bytes + serial_bytes + body
-        checksum = 0
-        for b in message:
-            checksum ^= b
-        
-        # Construct the final message
-        final_message = bytearray()
-        final_message.append(0x7e)  # Start marker
-        
-        # Escape the message bytes
-        for b in message:
-            if b == 0x7e:
-                final_message.append(0x7d)
-                final_message.append(0x02)
-            elif b == 0x7d:
-                final_message.append(0x7d)
-                final_message.append(0x01)
-            else:
-                final_message.append(b)
-        
-        # Append checksum (escaped if needed)
-        if checksum == 0x7e:
-            final_message.append(0x7d)
-            final_message.append(0x02)
-        elif checksum == 0x7d:
-            final_message.append(0x7d)
-            final_message.append(0x01)
-        else:
-            final_message.append(checksum)
-        
-        final_message.append(0x7e)  # End marker
-        
-        return bytes(final_message)
+        return jt808.encode_frame(jt808.MSG_HEARTBEAT, self.device_id, self._next_serial())
     
     def _create_location_message(self) -> bytes:
         """
-        Create a location message (0x0200).
+        Create a location message (0x0200) with the pet tracking extensions.
         
         Returns:
             bytes: Encoded JT808 message
         """
-        self.seq_num = (self.seq_num + 1) % 0xFFFF
-        
-        # Message ID: 0x0200 (Location)
-        msg_id_bytes = struct.pack('>H', 0x0200)
-        
-        # Message body:
-        # - Alarm flag (4 bytes): 0
-        # - Status (4 bytes): 0 (ACC off, not positioned)
-        # - Latitude (4 bytes): degrees * 1,000,000
-        # - Longitude (4 bytes): degrees * 1,000,000
-        # - Altitude (2 bytes): meters
-        # - Speed (2 bytes): 0.1 km/h
-        # - Direction (2 bytes): 0-359 degrees
-        # - Time (6 bytes): BCD YY-MM-DD-HH-MM-SS
-        
-        # Status flags (bit 0: ACC, bit 1: positioned, etc.)
-        status = 0
-        status |= 0x02  # Bit 1: Positioned
-        if self.latitude < 0:
-            status |= 0x04  # Bit 2: South latitude
-        if self.longitude < 0:
-            status |= 0x08  # Bit 3: West longitude
+        # Positioned, plus moving while the pet walks (south/west bits are set by the codec)
+        status = 0x02
         if self.speed > 0:
-            status |= 0x10  # Bit 4: Moving
-        
-        # Convert latitude/longitude to JT808 format (absolute value * 1,000,000)
-        lat_int = int(abs(self.latitude) * 1000000)
-        lon_int = int(abs(self.longitude) * 1000000)
-        
-        # Convert speed to 0.1 km/h
-        speed_int = int(self.speed * 10)
-        
-        # Get current time as BCD
-        now = datetime.datetime.now()
-        year = now.year % 100
-        month = now.month
-        day = now.day
-        hour = now.hour
-        minute = now.minute
-        second = now.second
-        
-        # Convert time to BCD format
-        time_bytes = bytearray(6)
-        time_bytes[0] = ((year // 10) << 4) | (year % 10)
-        time_bytes[1] = ((month // 10) << 4) | (month % 10)
-        time_bytes[2] = ((day // 10) << 4) | (day % 10)
-        time_bytes[3] = ((hour // 10) << 4) | (hour % 10)
-        time_bytes[4] = ((minute // 10) << 4) | (minute % 10)
-        time_bytes[5] = ((second // 10) << 4) | (second % 10)
-        
-        # Put together the base location data
-        body = struct.pack('>IIIIHHH', 0, status, lat_int, lon_int, 
-                          int(self.altitude), speed_int, int(self.heading))
-        body += bytes(time_bytes)
-        
-        # Additional location data elements:
-        
-        # 0xE0: Battery level (0-100%)
-        body += struct.pack('BB', 0xE0, 1)  # ID, length
-        body += struct.pack('B', int(self.battery_level))
-        
-        # 0xE1: Activity level (0-100%)
-        body += struct.pack('BB', 0xE1, 1)  # ID, length
-        body += struct.pack('B', int(self.activity_level))
-        
-        # 0xE2: Health flags (bit flags)
-        body += struct.pack('BB', 0xE2, 2)  # ID, length
-        body += struct.pack('>H', self.health_flags)
-        
-        # 0xE3: Temperature (celsius x 10)
-        body += struct.pack('BB', 0xE3, 2)  # ID, length
-        body += struct.pack('>H', int(self.temperature * 10))
-        
-        # Message properties: body length
-        msg_props_bytes = struct.pack('>H', len(body))
-        
-        # Phone number (device ID): convert to BCD
-        phone_bytes = bytearray(6)
-        for i in range(min(len(self.device_id), 12)):
-            if i % 2 == 0:
-                phone_bytes[i // 2] = (int(self.device_id[i]) << 4)
-            else:
-                phone_bytes[i // 2] |= int(self.device_id[i])
-        
-        # Message serial number
-        serial_bytes = struct.pack('>H', self.seq_num)
-        
-        # Calculate checksum (XOR of all header and body bytes)
-        message = msg_id_bytes + msg_props_bytes + phone_bytes + serial_bytes + body
-        checksum = 0
-        for b in message:
-            checksum ^= b
-        
-        # Construct the final message
-        final_message = bytearray()
-        final_message.append(0x7e)  # Start marker
-        
-        # Escape the message bytes
-        for b in message:
-            if b == 0x7e:
-                final_message.append(0x7d)
-                final_message.append(0x02)
-            elif b == 0x7d:
-                final_message.append(0x7d)
-                final_message.append(0x01)
-            else:
-                final_message.append(b)
-        
-        # Append checksum (escaped if needed)
-        if checksum == 0x7e:
-            final_message.append(0x7d)
-            final_message.append(0x02)
-        elif checksum == 0x7d:
-            final_message.append(0x7d)
-            final_message.append(0x01)
-        else:
-            final_message.append(checksum)
-        
-        final_message.append(0x7e)  # End marker
-        
-        return bytes(final_message)
+            status |= 0x10
+        
+        body = jt808.encode_location(
+            self.latitude, self.longitude,
+            altitude=self.altitude,
+            speed=self.speed,
+            heading=self.heading,
+            status=status,
+            battery_level=self.battery_level,
+            activity_level=self.activity_level,
+            health_flags=self.health_flags,
+            temperature=self.temperature
+        )
+        return jt808.encode_frame(jt808.MSG_LOCATION_REPORT, self.device_id, self._next_serial(), body)
     
     def _wait_for_response(self, timeout: float = 5.0) -> Optional[Dict[str, Any]]:
         """
@@ -666,11 +388,8 @@ class JT808DeviceSimulator:
                             # Extract message
                             message = buffer[start_idx:end_idx+1]
                             
-                            # Unescape the message
-                            unescaped = self._unescape_message(message)
-                            
                             # Parse response
-                            return self._parse_response(unescaped)
+                            return self._parse_response(message)
                 except socket.timeout:
                     continue
             
@@ -684,103 +403,42 @@ class JT808DeviceSimulator:
             # Reset socket timeout
             self.socket.settimeout(None)
     
-    def _unescape_message(self, message: bytes) -> bytes:
-        """
-        Unescape a JT/T 808 message.
-        
-        Args:
-            message: Escaped message bytes
-            
-        Returns:
-            Unescaped message bytes
-        """
-        # Strip start/end markers
-        if message.startswith(b'\x7e') and message.endswith(b'\x7e'):
-            message = message[1:-1]
-        
-        # Handle escape sequences
-        result = bytearray()
-        i = 0
-        while i < len(message):
-            if message[i] == 0x7d and i + 1 < len(message):
-                if message[i + 1] == 0x01:
-                    result.append(0x7d)
-                    i += 2
-                elif message[i + 1] == 0x02:
-                    result.append(0x7e)
-                    i += 2
-                else:
-                    result.append(message[i])
-                    i += 1
-            else:
-                result.append(message[i])
-                i += 1
-        
-        return bytes(result)
-    
-    def _parse_response(self, data: bytes) -> Optional[Dict[str, Any]]:
+    def _parse_response(self, message: bytes) -> Optional[Dict[str, Any]]:
         """
         Parse a response from the server.
         
         Args:
-            data: Response message bytes (without start/end markers)
+            message: Response frame, including the start/end markers
             
         Returns:
             Parsed response or None on error
         """
         try:
-            if len(data) < 12:  # Minimum header size
-                logger.warning(f"Response too short: {len(data)} bytes")
-                return None
-            
-            # Parse header
-            msg_id = struct.unpack('>H', data[0:2])[0]
-            msg_props = struct.unpack('>H', data[2:4])[0]
-            
-            # Extract message properties
-            msg_length = msg_props & 0x03FF  # First 10 bits
-            
-            # Phone number (device ID) - 6 bytes BCD
-            phone_bytes = data[4:10]
-            phone_number = ''.join([f'{b:02x}' for b in phone_bytes]).upper()
-            
-            # Message serial number - 2 bytes
-            msg_serial = struct.unpack('>H', data[10:12])[0]
+            frame = jt808.decode_frame(message)
+            msg_id = frame.message_id
             
             result = {
                 'msg_id': msg_id,
-                'msg_props': msg_props,
-                'msg_length': msg_length,
-                'phone_number': phone_number,
-                'msg_serial': msg_serial,
+                'msg_props': frame.attributes,
+                'msg_length': frame.body_length,
+                'phone_number': frame.phone,
+                'msg_serial': frame.serial,
                 'msg_type': self.MESSAGE_TYPES.get(msg_id, 'Unknown')
             }
             
-            # Message body (without checksum)
-            body = data[12:-1]
-            
             # Parse response body based on message type
-            if msg_id == 0x8001:  # Platform general response
-                if len(body) >= 5:
-                    resp_serial = struct.unpack('>H', body[0:2])[0]
-                    resp_msg_id = struct.unpack('>H', body[2:4])[0]
-                    resp_result = body[4]
-                    
-                    result['response_serial'] = resp_serial
-                    result['response_msg_id'] = resp_msg_id
-                    result['result'] = resp_result
+            if msg_id == jt808.MSG_PLATFORM_GENERAL_RESPONSE:
+                body = jt808.decode_general_response(frame.body)
+                result['response_serial'] = body['response_serial_number']
+                result['response_msg_id'] = body['reply_id']
+                result['result'] = body['result']
             
-            elif msg_id == 0x8100:  # Terminal registration response
-                if len(body) >= 3:
-                    resp_serial = struct.unpack('>H', body[0:2])[0]
-                    resp_result = body[2]
-                    
-                    result['response_serial'] = resp_serial
-                    result['result'] = resp_result
-                    
-                    if resp_result == 0 and len(body) > 3:
-                        auth_code = body[3:].decode('ascii')
-                        result['auth_code'] = auth_code
+            elif msg_id == jt808.MSG_TERMINAL_REGISTRATION_RESPONSE:
+                body = jt808.decode_registration_response(frame.body)
+                result['response_serial'] = body['response_serial_number']
+                result['result'] = body['result']
+                if body['authentication_code']:
+                    result['auth_code'] = body['authentication_code']
             
             logger.debug(f"Parsed response: {result}")
             return result
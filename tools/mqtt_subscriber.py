@@ -3,7 +3,8 @@
 MQTT Subscriber for pet tracking data.
 
 This script subscribes to all pet tracking topics on the MQTT broker
-and prints received messages.
+and prints received messages. Compact binary location messages
+(devices/<id>/location/bin) are decoded to the same shape as JSON ones.
 """
 
 import argparse
@@ -16,6 +17,11 @@ import time
 
 import paho.mqtt.client as mqtt
 
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.mqtt_adapter.payloads import BINARY_TOPIC_SUFFIX, decode_location
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -142,14 +148,18 @@ class MQTTSubscriber:
             msg: Received message
         """
         try:
-            # Try to parse as JSON
-            payload = json.loads(msg.payload)
+            if msg.topic.endswith(BINARY_TOPIC_SUFFIX):
+                payload = decode_location(msg.payload)
+                logger.debug(f"Decoded {len(msg.payload)} byte binary location message")
+            else:
+                # Try to parse as JSON
+                payload = json.loads(msg.payload)
             
             # Format the JSON for display
             formatted_json = json.dumps(payload, indent=2)
             
             logger.info(f"Received message on topic {msg.topic}:\n{formatted_json}")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValueError):
             # If not JSON, just print as string
             logger.info(f"Received message on topic {msg.topic}: {msg.payload}")
 
@@ -2,16 +2,26 @@
 """
 Protocol 808 Server Standalone Starter
 
-This script runs the 808 Protocol server without starting the full Flask application.
-It's useful for testing device simulators when you don't need the web API.
+This script runs the 808 Protocol server without starting the full Flask application
+(PROCESS_ROLE defaults to 'ingest', so the web API blueprints are not registered).
+It's useful for testing device simulators when you don't need the web API, and for
+running ingest on its own.
+
+With --workers N it forks N worker processes that all bind the protocol port with
+SO_REUSEPORT, so the kernel spreads incoming device connections across them. Each
+worker has its own protocol server, device cache and location writer, so ingest
+is no longer limited to one process (and one GIL).
 
 Usage:
     python start_protocol_server.py
+    python start_protocol_server.py --workers 4 --engine asyncio
 """
 
+import argparse
 import os
 import sys
 import logging
+import socket
 import time
 import threading
 import signal
@@ -19,37 +29,46 @@ import signal
 # Add the project root to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Only the protocol server runs here, so the Flask app skips the web API blueprints
+os.environ.setdefault('PROCESS_ROLE', 'ingest')
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(process)d - %(levelname)s - %(message)s')
 logger = logging.getLogger('protocol_server')
 
 # Create a event to signal when script should exit
 shutdown_event = threading.Event()
 
+# Seconds workers get to flush their location writers before they are killed
+WORKER_SHUTDOWN_TIMEOUT = 15
+
+# Seconds to wait before restarting a worker that exited unexpectedly
+WORKER_RESTART_DELAY = 1
+
 def signal_handler(sig, frame):
     """Handle interrupt signal"""
     logger.info(f"Received signal {sig}, shutting down...")
     shutdown_event.set()
 
-def main():
-    """Main function to start the 808 protocol server standalone"""
+def run_server(engine=None, reuse_port=False):
+    """Run one protocol server in this process until a shutdown signal"""
     # Import here to avoid circular imports
     from services.protocol808 import start_protocol_server, stop_protocol_server
-    
+
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    
+
     try:
         logger.info("Starting 808 Protocol server...")
-        server_thread = start_protocol_server()
-        
+        server_thread = start_protocol_server(engine, reuse_port=reuse_port)
+
         logger.info("Server started, press Ctrl+C to stop")
-        
-        # Keep running until shutdown signal
-        while not shutdown_event.is_set():
+
+        # Keep running until shutdown signal (or until the server gives up, e.g. the port is taken)
+        while not shutdown_event.is_set() and server_thread.is_alive():
             time.sleep(1)
-            
+
     except Exception as e:
         logger.error(f"Error running server: {str(e)}")
     finally:
@@ -57,5 +76,98 @@ def main():
         stop_protocol_server()
         logger.info("Server stopped")
 
+def spawn_worker(index, engine):
+    """Fork a worker process that runs its own protocol server on the shared port"""
+    pid = os.fork()
+    if pid:
+        logger.info(f"Started worker {index} (pid {pid})")
+        return pid
+
+    # Worker process: never return into the supervisor loop
+    exit_code = 0
+    try:
+        run_server(engine, reuse_port=True)
+    except BaseException:
+        logger.error(f"Worker {index} failed", exc_info=True)
+        exit_code = 1
+    finally:
+        logging.shutdown()
+        os._exit(exit_code)
+
+def run_workers(workers, engine=None):
+    """Run workers protocol server processes sharing the port with SO_REUSEPORT and supervise them"""
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+        logger.error("SO_REUSEPORT and fork() are required for --workers, run a single worker instead")
+        return 1
+
+    # Import (and create the tables) once, so a broken setup fails here rather than in every
+    # worker, then drop the pooled database connections so no worker inherits one
+    from app import app, db
+    import services.protocol808  # noqa: F401
+    with app.app_context():
+        db.engine.dispose()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    children = {}
+    for index in range(workers):
+        children[spawn_worker(index, engine)] = index
+    logger.info(f"Running {workers} protocol server workers, press Ctrl+C to stop")
+
+    while not shutdown_event.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in children:
+            index = children.pop(pid)
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting it")
+            time.sleep(WORKER_RESTART_DELAY)
+            if not shutdown_event.is_set():
+                children[spawn_worker(index, engine)] = index
+            continue
+        shutdown_event.wait(1)
+
+    # Let every worker flush its location writer, then kill the stragglers
+    logger.info(f"Stopping {len(children)} workers...")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        logger.warning(f"Worker pid {pid} did not stop in time, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    logger.info("All workers stopped")
+    return 0
+
+def main():
+    """Main function to start the 808 protocol server standalone"""
+    parser = argparse.ArgumentParser(description='Run the 808/JT808 protocol server without the web API')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port with SO_REUSEPORT (default: 1)')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'],
+                        help='Protocol server engine (default: PROTOCOL_SERVER_ENGINE)')
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        sys.exit(run_workers(args.workers, args.engine))
+    run_server(args.engine)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -10,12 +10,15 @@ import os
 import sys
 import time
 import socket
-import struct
 import binascii
 import logging
 import argparse
 import random
-from datetime import datetime
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import jt808
 
 # Setup logging
 logging.basicConfig(
@@ -36,74 +39,18 @@ def encode_jt808_message(msg_id, phone_number, body, seq_num=None):
 
     Args:
         msg_id: Message ID (e.g., 0x0200 for location report)
-        phone_number: Device identifier (max 6 bytes)
+        phone_number: Device identifier (up to 12 digits, sent as BCD)
         body: Message body as bytes
         seq_num: Message sequence number (generated if None)
 
     Returns:
         Bytes object containing the encoded JT808 message
     """
-    # Format phone number consistently
-    if isinstance(phone_number, str):
-        phone_bytes = phone_number.encode('ascii')
-        # Ensure it's exactly 6 bytes (right-padded with zeros)
-        if len(phone_bytes) < 6:
-            phone_bytes = phone_bytes.ljust(6, b'\x00')
-        elif len(phone_bytes) > 6:
-            phone_bytes = phone_bytes[:6]
-    else:
-        phone_bytes = phone_number
-
     # Generate sequence number if not provided
     if seq_num is None:
         seq_num = random.randint(1, 65535)
 
-    # Prepare header
-    msg_attributes = len(body) & 0x1FFF  # Lower 13 bits for body length
-    header = struct.pack('>HH6sH', msg_id, msg_attributes, phone_bytes, seq_num)
-
-    # Calculate checksum (XOR of all bytes in header and body)
-    checksum = 0
-    for b in header + body:
-        checksum ^= b
-
-    # Assemble message with start/end markers
-    message = bytearray([0x7e])  # Start marker
-    message.extend(header)
-    message.extend(body)
-    message.append(checksum)
-    message.append(0x7e)  # End marker
-
-    # Apply escape rules: 0x7e -> 0x7d, 0x02 and 0x7d -> 0x7d, 0x01
-    escaped_message = bytearray([0x7e])  # Keep start marker
-    for b in message[1:-1]:  # Process everything except start/end markers
-        if b == 0x7e:
-            escaped_message.extend([0x7d, 0x02])
-        elif b == 0x7d:
-            escaped_message.extend([0x7d, 0x01])
-        else:
-            escaped_message.append(b)
-    escaped_message.append(0x7e)  # Keep end marker
-
-    return bytes(escaped_message)
-
-def datetime_to_bcd(dt=None):
-    """
-    Convert datetime to BCD format used in JT808
-
-    Args:
-        dt: Datetime object to convert (uses current time if None)
-
-    Returns:
-        Bytes containing BCD-encoded time (YYMMDDhhmmss)
-    """
-    if dt is None:
-        dt = datetime.now()
-
-    # Format as string then convert to BCD
-    time_str = dt.strftime('%y%m%d%H%M%S')
-    bcd = bytes.fromhex(time_str)
-    return bcd
+    return jt808.encode_frame(msg_id, phone_number, seq_num, body)
 
 def generate_location_message(phone_number, seq_num=None, include_pet_data=True):
     """
@@ -118,51 +65,31 @@ def generate_location_message(phone_number, seq_num=None, include_pet_data=True)
         Encoded JT808 message
     """
     # Basic parameters - using random values for testing
-    latitude = random.uniform(35.0, 42.0) * 1000000  # Convert to JT808 format (integer)
-    longitude = random.uniform(-125.0, -115.0) * 1000000
-    altitude = random.randint(0, 100)  # Meters
-    speed = random.randint(0, 200)  # 0.1 km/h units
-    direction = random.randint(0, 359)  # Degrees
-    alarm = 0  # No alarms
-    status = 2  # Bit 1 set (GPS valid)
-
-    # Prepare location body with basic fields
-    # Format: Alarm (4 bytes) + Status (4 bytes) + Latitude (4 bytes) + Longitude (4 bytes) + 
-    # Altitude (2 bytes) + Speed (2 bytes) + Direction (2 bytes) + Time (6 bytes BCD)
-    location_body = struct.pack(
-        '>IIiiHHH6s',
-        alarm, status, 
-        int(latitude), int(longitude),
-        altitude, speed, direction,
-        datetime_to_bcd()
-    )
-
-    # Add pet-specific additional data fields if requested
+    location = {
+        'latitude': random.uniform(35.0, 42.0),
+        'longitude': random.uniform(-125.0, -115.0),
+        'altitude': random.randint(0, 100),  # Meters
+        'speed': random.randint(0, 200) / 10.0,  # km/h
+        'heading': random.randint(0, 359),  # Degrees
+    }
+
+    # Add pet-specific additional data fields (0x30-0x33) if requested
     if include_pet_data:
-        # Add battery level (0x30) - 1 byte value
-        battery_level = random.randint(50, 100)
-        location_body += bytes([0x30, 1, battery_level])
-
-        # Add activity level (0x31) - 1 byte value
-        activity_level = random.randint(0, 100)
-        location_body += bytes([0x31, 1, activity_level])
+        location['battery_level'] = random.randint(50, 100)
+        location['activity_level'] = random.randint(0, 100)
 
-        # Add health status flags (0x32) - 2 bytes
         # Bits indicating different health conditions
         health_flags = 0  # All healthy
         if random.random() < 0.1:  # 10% chance of warning
             health_flags |= 1  # Temperature warning
-        if activity_level < 20 and random.random() < 0.5:
+        if location['activity_level'] < 20 and random.random() < 0.5:
             health_flags |= 2  # Inactivity warning
-        location_body += bytes([0x32, 2]) + struct.pack('>H', health_flags)
+        location['health_flags'] = health_flags
 
-        # Add temperature data (0x33) - 2 bytes, signed
-        # Temperature in 0.1°C units
-        temperature = random.uniform(36.5, 39.5) * 10  # Normal dog temperature
-        location_body += bytes([0x33, 2]) + struct.pack('>h', int(temperature))
+        location['temperature'] = random.uniform(36.5, 39.5)  # Normal dog temperature
 
     # Encode the full message
-    return encode_jt808_message(0x0200, phone_number, location_body, seq_num)
+    return encode_jt808_message(0x0200, phone_number, jt808.encode_location(**location), seq_num)
 
 def decode_response(data):
     """
@@ -174,99 +101,39 @@ def decode_response(data):
     Returns:
         Dictionary with decoded response data or None on error
     """
-    try:
-        if not data:
-            logger.warning("No data received")
-            return None
-
-        # For debugging
-        hex_data = binascii.hexlify(data).decode('ascii')
-        logger.debug(f"Received: {hex_data}")
-
-        if data[0] != 0x7e:
-            logger.warning("Missing start marker in response")
-            return None
+    if not data:
+        logger.warning("No data received")
+        return None
 
-        if data[-1] != 0x7e:
-            logger.warning("Missing end marker in response")
-            return None
+    # For debugging
+    hex_data = binascii.hexlify(data).decode('ascii')
+    logger.debug(f"Received: {hex_data}")
 
-        # Remove escape sequences (reverse the 0x7d 0x01, 0x7d 0x02 escapes)
-        unescaped_data = bytearray()
-        i = 1  # Skip start marker
-        while i < len(data) - 1:  # Skip end marker
-            if data[i] == 0x7d:
-                if i + 1 < len(data) - 1:
-                    if data[i + 1] == 0x02:
-                        unescaped_data.append(0x7e)
-                        i += 2
-                        continue
-                    elif data[i + 1] == 0x01:
-                        unescaped_data.append(0x7d)
-                        i += 2
-                        continue
-                unescaped_data.append(data[i])
-                i += 1
-            else:
-                unescaped_data.append(data[i])
-                i += 1
+    try:
+        frame = jt808.decode_frame(data)
+
+        # For general response (0x8001), decode body
+        if frame.message_id == jt808.MSG_PLATFORM_GENERAL_RESPONSE:
+            general = jt808.decode_general_response(frame.body)
+            body_dict = {
+                'response_serial_number': general['response_serial_number'],
+                'response_msg_id': general['reply_id'],
+                'result': general['result']
+            }
+        else:
+            body_dict = {'raw_hex': binascii.hexlify(frame.body).decode('ascii')}
 
-        # Verify minimum length after unescaping
-        if len(unescaped_data) < 12:  # Minimum size for header + checksum
-            logger.warning(f"Message too short after unescaping: {len(unescaped_data)} bytes")
-            return None
+        return {
+            'msg_id': frame.message_id,
+            'msg_id_hex': f"0x{frame.message_id:04X}",
+            'phone_number': frame.phone,
+            'serial_number': frame.serial,
+            'body': body_dict
+        }
 
-        # Extract header fields
-        try:
-            header_format = '>HH6sH'
-            header_size = struct.calcsize(header_format)
-            
-            if len(unescaped_data) < header_size + 1:  # +1 for checksum
-                logger.warning(f"Message too short for header: {len(unescaped_data)} bytes")
-                return None
-                
-            header_data = struct.unpack(header_format, unescaped_data[:header_size])
-            
-            msg_id = header_data[0]
-            msg_attributes = header_data[1]
-            phone_number = header_data[2].decode('ascii', errors='ignore').strip('\x00')
-            serial_number = header_data[3]
-            
-            # For general response (0x8001), decode body
-            body = unescaped_data[header_size:-1]  # Exclude checksum
-            body_dict = {}
-            
-            if msg_id == 0x8001:  # General response
-                if len(body) >= 5:  # At least 2-byte serial + 2-byte msg_id + 1-byte result
-                    resp_serial = struct.unpack('>H', body[0:2])[0]
-                    resp_msg_id = struct.unpack('>H', body[2:4])[0]
-                    result = body[4]
-                    
-                    body_dict = {
-                        'response_serial_number': resp_serial,
-                        'response_msg_id': resp_msg_id,
-                        'result': result
-                    }
-                else:
-                    body_dict = {'raw_hex': binascii.hexlify(body).decode('ascii')}
-            else:
-                body_dict = {'raw_hex': binascii.hexlify(body).decode('ascii')}
-            
-            return {
-                'msg_id': msg_id,
-                'msg_id_hex': f"0x{msg_id:04X}",
-                'phone_number': phone_number,
-                'serial_number': serial_number,
-                'body': body_dict
-            }
-            
-        except Exception as e:
-            logger.error(f"Error parsing header/body: {e}")
-            return {'error': str(e), 'raw_hex': binascii.hexlify(data).decode('ascii')}
-            
     except Exception as e:
         logger.error(f"Error decoding response: {e}")
-        return {'error': str(e), 'raw_hex': binascii.hexlify(data).decode('ascii') if data else 'No data'}
+        return {'error': str(e), 'raw_hex': hex_data}
 
 def run_test(host, port, device_id, test_count=5, delay=2, include_pet_data=True):
     """